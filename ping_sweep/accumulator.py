@@ -0,0 +1,314 @@
+#!/usr/bin/env python
+
+#
+# Copyright 2011 Pierre V. Villeneuve
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Streaming statistics for ping times, in constant memory.
+
+Accumulator keeps count, mean and variance (Welford's method), min and max, plus a log-bucketed
+histogram good for percentiles to within about a percent.  Accumulators from different sweeps or
+worker processes can be merged.  Tally wraps one up together with the lost packet counts for one
+(host, size) combination.
+"""
+
+from __future__ import division, print_function #, unicode_literals
+
+import math
+
+
+#################################################
+
+class LogHistogram(object):
+    """
+    Histogram with logarithmically spaced buckets, in the spirit of HDR histograms.  Bucket k
+    covers [lowest * base**k, lowest * base**(k+1)).  Anything below lowest, zero included, goes
+    into bucket -1.  Memory depends on the range of values seen, not on how many.
+
+    lowest: smallest value resolved, milliseconds.
+    precision: relative bucket width.
+    """
+    def __init__(self, lowest=None, precision=None):
+        if not lowest:
+            lowest = 0.001   # milliseconds, one microsecond.
+
+        if not precision:
+            precision = 0.02
+
+        self.lowest = lowest
+        self.precision = precision
+        self.base = 1. + precision
+        self._log_base = math.log(self.base)
+
+        self.counts = {}
+        self.total = 0
+
+    def __len__(self):
+        return self.total
+
+
+
+    def bucket(self, value):
+        """
+        Bucket index for a value.
+        """
+        if value < self.lowest:
+            return -1
+
+        # Done.
+        return int(math.log(value / self.lowest) / self._log_base)
+
+
+
+    def add(self, value, count=1):
+        """
+        Add a value to the histogram.
+        """
+        k = self.bucket(value)
+        self.counts[k] = self.counts.get(k, 0) + count
+        self.total += count
+
+
+
+    def merge(self, other):
+        """
+        Add the counts from another histogram with the same bucket layout.
+        """
+        if (other.lowest, other.precision) != (self.lowest, self.precision):
+            raise ValueError('Histograms have different bucket layouts')
+
+        for k, count in other.counts.items():
+            self.counts[k] = self.counts.get(k, 0) + count
+        self.total += other.total
+
+
+
+    def value(self, k):
+        """
+        Representative value of bucket k, the geometric middle.
+        """
+        if k < 0:
+            return 0.
+
+        # Done.
+        return self.lowest * self.base**(k + 0.5)
+
+
+
+    def percentile(self, q):
+        """
+        Value at percentile q (0 to 100).  None if the histogram is empty.
+        """
+        if not self.total:
+            return None
+
+        rank = max(1, int(math.ceil(q / 100. * self.total)))
+
+        seen = 0
+        for k in sorted(self.counts):
+            seen += self.counts[k]
+            if seen >= rank:
+                return self.value(k)
+
+        # Done.
+        return self.value(max(self.counts))
+
+#################################################
+
+
+class Accumulator(object):
+    """
+    Running count, mean, variance, min, max and percentiles of a stream of values.
+    """
+    def __init__(self, lowest=None, precision=None):
+        self.count = 0
+        self.mean = 0.
+        self.m2 = 0.
+        self.min = None
+        self.max = None
+
+        self.histogram = LogHistogram(lowest=lowest, precision=precision)
+
+    def __len__(self):
+        return self.count
+
+
+
+    def add(self, value):
+        """
+        Add one value.
+        """
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+
+        if self.min is None or value < self.min:
+            self.min = value
+
+        if self.max is None or value > self.max:
+            self.max = value
+
+        self.histogram.add(value)
+
+
+
+    def merge(self, other):
+        """
+        Fold another accumulator into this one (Chan et al. parallel variance).
+        """
+        self.histogram.merge(other.histogram)
+
+        if not other.count:
+            return
+
+        if not self.count:
+            self.count = other.count
+            self.mean = other.mean
+            self.m2 = other.m2
+            self.min = other.min
+            self.max = other.max
+            return
+
+        count = self.count + other.count
+        delta = other.mean - self.mean
+
+        self.mean += delta * other.count / count
+        self.m2 += other.m2 + delta**2 * self.count * other.count / count
+        self.count = count
+
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+
+
+    @property
+    def variance(self):
+        """
+        Population variance, same as std() in ping_sweep.
+        """
+        if not self.count:
+            return None
+
+        # Done.
+        return self.m2 / self.count
+
+
+
+    @property
+    def std(self):
+        if not self.count:
+            return None
+
+        # Done.
+        return self.variance**.5
+
+
+
+    def percentile(self, q):
+        """
+        Estimated value at percentile q (0 to 100), kept within the observed min and max.
+        """
+        value = self.histogram.percentile(q)
+        if value is None:
+            return None
+
+        # Done.
+        return min(max(value, self.min), self.max)
+
+#################################################
+
+
+class Tally(object):
+    """
+    Outcome of every probe for one (host, size): ping time statistics plus lost packet counts.
+
+    keep_times: also keep the list of every ping time.  Memory then grows with the probe count.
+    """
+    def __init__(self, keep_times=False, lowest=None, precision=None):
+        self.count_send = 0
+        self.count_timeout = 0
+        self.count_corrupt = 0
+        self.count_error = 0
+        self.count_late = 0
+        self.count_duplicate = 0
+        self.count_foreign = 0
+        self.packet_size = None
+
+        self.accumulator = Accumulator(lowest=lowest, precision=precision)
+
+        if keep_times:
+            self.times = []
+        else:
+            self.times = None
+
+    @property
+    def count_lost(self):
+        return self.count_timeout + self.count_corrupt + self.count_error
+
+    @property
+    def count_recv(self):
+        return self.count_send - self.count_lost
+
+
+
+    def add_result(self, res):
+        """
+        Count one ping_once() style result.
+        """
+        self.count_send += 1
+        self.packet_size = res['packet_size']
+
+        if res.get('error'):
+            # ICMP error came back instead of a reply, e.g. host unreachable.
+            self.count_error += 1
+        elif res['is_same_data']:
+            self.accumulator.add(res['time_ping'])
+            if self.times is not None:
+                self.times.append(res['time_ping'])
+        else:
+            if res['time_ping']:
+                # Packet is corrupt, but at least it still came back.
+                # Still considered lost since returned payload did not match original.
+                self.count_corrupt += 1
+            else:
+                # No return time recorded, packet never came back.  Most likely a timeout.
+                self.count_timeout += 1
+
+
+
+    def merge(self, other):
+        """
+        Fold in the tally for the same (host, size) from another sweep or worker.
+        """
+        self.count_send += other.count_send
+        self.count_timeout += other.count_timeout
+        self.count_corrupt += other.count_corrupt
+        self.count_error += other.count_error
+        self.count_late += other.count_late
+        self.count_duplicate += other.count_duplicate
+        self.count_foreign += other.count_foreign
+
+        if other.packet_size is not None:
+            self.packet_size = other.packet_size
+
+        self.accumulator.merge(other.accumulator)
+
+        if self.times is not None and other.times is not None:
+            self.times.extend(other.times)
+        else:
+            self.times = None
@@ -0,0 +1,271 @@
+#!/usr/bin/env python
+
+#
+# Copyright 2011 Pierre V. Villeneuve
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Vectorized analysis of sweep results with NumPy.
+
+load() packs the ping times from a sweep into an array shaped (host, size, sample), padded with
+NaN.  Everything else works on whole arrays at once: percentiles, loss rates, RFC 3550 jitter,
+and a straight line fit of ping time against packet size for each host.  The slope of that line
+gives the link bandwidth, the intercept the fixed delay.
+
+Ping times are needed, so run the sweep with keep_times=True.  NumPy is optional for the rest of
+ping_sweep, only this module needs it.
+"""
+
+from __future__ import division, print_function #, unicode_literals
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+#################################################
+
+class AnalysisError(Exception):
+    pass
+
+
+
+class SweepArrays(object):
+    """
+    Results of a sweep as NumPy arrays.
+
+    host_names: list of H host names.
+    data_sizes: (S,) payload sizes, bytes.
+    packet_sizes: (S,) ICMP packet sizes, bytes.
+    times: (H, S, N) ping times in milliseconds, in the order the replies came back.  Padded at
+           the end with NaN.
+    count_recv: (H, S) number of ping times in each row of times.
+    count_send: (H, S) number of probes sent.
+    count_lost: (H, S) number of probes lost to timeout, corruption or ICMP error.
+    """
+    def __init__(self, host_names, data_sizes, packet_sizes, times, count_recv, count_send,
+                 count_lost):
+        self.host_names = host_names
+        self.data_sizes = data_sizes
+        self.packet_sizes = packet_sizes
+        self.times = times
+        self.count_recv = count_recv
+        self.count_send = count_send
+        self.count_lost = count_lost
+
+    @property
+    def shape(self):
+        return self.times.shape
+
+#################################################
+
+
+def load(stats_sweep):
+    """
+    Pack a list of stats dicts, as returned by ping_sweep_hosts(keep_times=True), into
+    SweepArrays.  Hosts that skipped a size (user stop) get an empty row.
+    """
+    if np is None:
+        raise AnalysisError('NumPy is required for sweep analysis')
+
+    host_names = []
+    host_index = {}
+    data_sizes = []
+    size_index = {}
+    packet_sizes = {}
+    num_samples = 0
+
+    for stats in stats_sweep:
+        if stats['times'] is None:
+            raise AnalysisError('No ping times kept for {:s}, sweep with keep_times=True'.format(
+                                stats['host_name']))
+
+        if stats['host_name'] not in host_index:
+            host_index[stats['host_name']] = len(host_names)
+            host_names.append(stats['host_name'])
+
+        if stats['data_size'] not in size_index:
+            size_index[stats['data_size']] = None
+            data_sizes.append(stats['data_size'])
+
+        packet_sizes[stats['data_size']] = stats['packet_size']
+        num_samples = max(num_samples, len(stats['times']))
+
+    data_sizes.sort()
+    for k, data_size in enumerate(data_sizes):
+        size_index[data_size] = k
+
+    shape = len(host_names), len(data_sizes)
+    times = np.full(shape + (num_samples,), np.nan)
+    count_recv = np.zeros(shape, dtype=np.int64)
+    count_send = np.zeros(shape, dtype=np.int64)
+    count_lost = np.zeros(shape, dtype=np.int64)
+
+    for stats in stats_sweep:
+        h = host_index[stats['host_name']]
+        s = size_index[stats['data_size']]
+        n = len(stats['times'])
+
+        times[h, s, :n] = stats['times']
+        count_recv[h, s] = n
+        count_send[h, s] = stats['count_send']
+        count_lost[h, s] = stats['count_lost']
+
+    sweep = SweepArrays(host_names,
+                        np.array(data_sizes, dtype=np.int64),
+                        np.array([packet_sizes[d] for d in data_sizes], dtype=np.int64),
+                        times, count_recv, count_send, count_lost)
+
+    # Done.
+    return sweep
+
+#################################################
+
+
+def percentiles(sweep, q=None):
+    """
+    Ping time percentiles for every host and size.  Returns an array shaped (H, S, len(q)).
+    NaN where nothing came back.
+
+    q: sequence of percentiles, 0 to 100.  Default is 50, 90, 99 and 99.9.
+    """
+    if q is None:
+        q = [50., 90., 99., 99.9]
+
+    q = np.asarray(q, dtype=np.float64)
+
+    n = sweep.count_recv[..., np.newaxis]
+    if not sweep.times.shape[-1]:
+        return np.full(n.shape[:2] + q.shape, np.nan)
+
+    # Ping times sit at the front of each row and NaN sorts last, so sorting once and then
+    # interpolating between ranks, same as numpy.percentile(), works on every row at once.
+    # Much faster than nanpercentile(), which goes row by row.
+    ordered = np.sort(sweep.times, axis=-1)
+
+    rank = q / 100. * np.maximum(n - 1, 0)
+    lo = np.floor(rank).astype(np.int64)
+    hi = np.minimum(lo + 1, np.maximum(n - 1, 0))
+    frac = rank - lo
+
+    v_lo = np.take_along_axis(ordered, lo, axis=-1)
+    v_hi = np.take_along_axis(ordered, hi, axis=-1)
+    values = v_lo + (v_hi - v_lo) * frac
+
+    # Done.
+    return np.where(n > 0, values, np.nan)
+
+
+
+def loss_rate(sweep):
+    """
+    Fraction of probes lost for every host and size, shaped (H, S).  NaN where nothing was sent.
+    """
+    with np.errstate(invalid='ignore', divide='ignore'):
+        rate = sweep.count_lost / sweep.count_send
+
+    # Done.
+    return rate
+
+
+
+def jitter(sweep):
+    """
+    RFC 3550 interarrival jitter for every host and size, shaped (H, S), milliseconds.
+
+    The estimator J += (|D| - J) / 16 is run over consecutive ping times.  Unrolled, J is a sum of
+    |D| weighted by (15/16)**age / 16, which is computed for all rows at once.
+    """
+    times = sweep.times
+    if times.shape[-1] < 2:
+        return np.zeros(times.shape[:2])
+
+    delta = np.abs(np.diff(times, axis=-1))
+
+    # Age of each difference, counted back from the last one in its row.
+    index = np.arange(delta.shape[-1])
+    age = (sweep.count_recv[..., np.newaxis] - 2) - index
+
+    valid = (age >= 0) & np.isfinite(delta)
+    weight = np.where(valid, np.power(15. / 16., np.where(valid, age, 0)) / 16., 0.)
+
+    # Done.
+    return np.sum(np.where(valid, delta, 0.) * weight, axis=-1)
+
+
+
+def linear_fit(sweep, q=None):
+    """
+    Least squares line through ping time versus packet size for each host.  Sizes where nothing
+    came back are left out.
+
+    Echo replies are the same size as the request, so each byte crosses the path twice.  The
+    slope then gives a bandwidth of 2 * 8 bits per slope milliseconds, and the intercept the fixed
+    round trip delay.
+
+    q: percentile of ping times to fit, default 0 for the minimum, least affected by queueing.
+
+    Returns (slope, intercept, bandwidth), each shaped (H,), in ms/byte, ms and bits/second.
+    """
+    if q is None:
+        q = 0.
+
+    y = percentiles(sweep, [q])[..., 0]
+    x = np.broadcast_to(sweep.packet_sizes.astype(np.float64), y.shape)
+
+    w = np.isfinite(y)
+    n = w.sum(axis=-1)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        x_mean = np.where(w, x, 0.).sum(axis=-1) / n
+        y_mean = np.where(w, y, 0.).sum(axis=-1) / n
+
+        dx = np.where(w, x - x_mean[:, np.newaxis], 0.)
+        dy = np.where(w, y - y_mean[:, np.newaxis], 0.)
+
+        slope = (dx * dy).sum(axis=-1) / (dx * dx).sum(axis=-1)
+        intercept = y_mean - slope * x_mean
+
+        bandwidth = np.where(slope > 0, 2 * 8 / (slope / 1000.), np.inf)
+
+    # Need at least two sizes for a line.
+    slope[n < 2] = np.nan
+    intercept[n < 2] = np.nan
+    bandwidth[n < 2] = np.nan
+
+    # Done.
+    return slope, intercept, bandwidth
+
+
+
+def summarize(sweep):
+    """
+    All of the above in one dict of arrays.
+    """
+    slope, intercept, bandwidth = linear_fit(sweep)
+
+    summary = {'host_names': sweep.host_names,
+               'data_sizes': sweep.data_sizes,
+               'percentiles': percentiles(sweep),
+               'loss_rate': loss_rate(sweep),
+               'jitter': jitter(sweep),
+               'slope': slope,
+               'intercept': intercept,
+               'bandwidth': bandwidth}
+
+    # Done.
+    return summary
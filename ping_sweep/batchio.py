@@ -0,0 +1,369 @@
+#!/usr/bin/env python
+
+#
+# Copyright 2011 Pierre V. Villeneuve
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Batch socket I/O for Linux, moving many packets per system call with sendmmsg() and recvmmsg().
+
+libc is reached through ctypes.  Use is_supported() to check before making a BatchSocket, and
+fall back to the plain per-packet socket calls otherwise.
+"""
+
+from __future__ import division, print_function #, unicode_literals
+
+import ctypes
+import ctypes.util
+import errno
+import os
+import socket
+import struct
+
+import receive
+
+
+MSG_DONTWAIT = 0x40
+MSG_ERRQUEUE = 0x2000
+
+SOCKADDR_SIZE = 128     # struct sockaddr_storage
+
+IPV6_HOPLIMIT = getattr(socket, 'IPV6_HOPLIMIT', 52)
+
+CMSG_HEADER = str('@Lii')   # struct cmsghdr, then data aligned to size_t.
+
+
+#################################################
+# C structures, see sendmmsg(2) and recvmmsg(2).
+
+class iovec(ctypes.Structure):
+    _fields_ = [('iov_base', ctypes.c_void_p),
+                ('iov_len', ctypes.c_size_t)]
+
+
+class msghdr(ctypes.Structure):
+    _fields_ = [('msg_name', ctypes.c_void_p),
+                ('msg_namelen', ctypes.c_uint32),
+                ('msg_iov', ctypes.POINTER(iovec)),
+                ('msg_iovlen', ctypes.c_size_t),
+                ('msg_control', ctypes.c_void_p),
+                ('msg_controllen', ctypes.c_size_t),
+                ('msg_flags', ctypes.c_int)]
+
+
+class mmsghdr(ctypes.Structure):
+    _fields_ = [('msg_hdr', msghdr),
+                ('msg_len', ctypes.c_uint)]
+
+#################################################
+
+
+_libc = None
+
+def get_libc():
+    """
+    Load libc with sendmmsg() and recvmmsg() set up, or return None if not available.
+    """
+    global _libc
+    if _libc is not None:
+        return _libc or None
+
+    _libc = False
+    if not os.sys.platform.startswith('linux'):
+        return None
+
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        sendmmsg = libc.sendmmsg
+        recvmmsg = libc.recvmmsg
+    except (OSError, AttributeError):
+        return None
+
+    sendmmsg.argtypes = [ctypes.c_int, ctypes.POINTER(mmsghdr), ctypes.c_uint, ctypes.c_int]
+    sendmmsg.restype = ctypes.c_int
+
+    recvmmsg.argtypes = [ctypes.c_int, ctypes.POINTER(mmsghdr), ctypes.c_uint, ctypes.c_int,
+                         ctypes.c_void_p]
+    recvmmsg.restype = ctypes.c_int
+
+    _libc = libc
+
+    # Done.
+    return _libc
+
+
+
+def is_supported():
+    """
+    Return True if batch I/O is available on this platform.
+    """
+    return get_libc() is not None
+
+
+
+def pack_sockaddr(host_addr):
+    """
+    Pack an IPv4 address into a struct sockaddr_in, or an IPv6 address into a struct
+    sockaddr_in6, port zero.
+    """
+    if ':' in host_addr:
+        addr = ctypes.create_string_buffer(28)
+        ctypes.memmove(addr, ctypes.byref(ctypes.c_ushort(socket.AF_INET6)), 2)
+        ctypes.memmove(ctypes.byref(addr, 8), socket.inet_pton(socket.AF_INET6, host_addr), 16)
+        return addr
+
+    addr = ctypes.create_string_buffer(16)
+    ctypes.memmove(addr, ctypes.byref(ctypes.c_ushort(socket.AF_INET)), 2)
+    ctypes.memmove(ctypes.byref(addr, 4), socket.inet_aton(host_addr), 4)
+
+    # Done.
+    return addr
+
+
+
+def unpack_sockaddr(raw):
+    """
+    Source address from a struct sockaddr, as a string.
+    """
+    family = ctypes.c_ushort.from_buffer_copy(raw[:2]).value
+    if family == socket.AF_INET:
+        return socket.inet_ntoa(raw[4:8])
+
+    if family == socket.AF_INET6:
+        return socket.inet_ntop(socket.AF_INET6, raw[8:24])
+
+    # Done.
+    return None
+
+
+
+def cmsg_align(size):
+    """
+    Round a size up the way CMSG_ALIGN() does.
+    """
+    align = ctypes.sizeof(ctypes.c_size_t)
+
+    # Done.
+    return (size + align - 1) & ~(align - 1)
+
+#################################################
+
+
+class BatchSocket(object):
+    """
+    Send and receive many datagrams per system call on an existing non-blocking socket.
+
+    batch_size: maximum number of packets per call.
+    buf_size: size of each send and receive slot, bytes.
+    control_size: room for ancillary data per received packet, bytes.  Zero for none.
+
+    Packets staged with a ttl carry it as an IP_TTL, or IPV6_HOPLIMIT, control message, so one
+    call can send probes for many hops of a traceroute.
+    """
+    def __init__(self, sock, batch_size=None, buf_size=None, control_size=0):
+        if not batch_size:
+            batch_size = 32
+
+        if not buf_size:
+            buf_size = receive.BUFFER_SIZE
+
+        self.libc = get_libc()
+        if not self.libc:
+            raise OSError(errno.ENOSYS, 'sendmmsg/recvmmsg not available')
+
+        self.sock = sock
+        self.fd = sock.fileno()
+        self.family = sock.family
+        self.batch_size = batch_size
+        self.control_size = control_size
+        self.addr_cache = {}
+
+        # Send side, packets are copied into preallocated slots.
+        self._send_c = [ctypes.create_string_buffer(buf_size) for k in range(batch_size)]
+
+        # Room for one control message with an int, the TTL.
+        self._ttl_offset = cmsg_align(struct.calcsize(CMSG_HEADER))
+        self._ttl_len = self._ttl_offset + ctypes.sizeof(ctypes.c_int)
+        self._ttl_space = self._ttl_offset + cmsg_align(ctypes.sizeof(ctypes.c_int))
+        if self.family == socket.AF_INET6:
+            self._ttl_option = socket.IPPROTO_IPV6, IPV6_HOPLIMIT
+        else:
+            self._ttl_option = socket.IPPROTO_IP, socket.IP_TTL
+        self._send_control = [ctypes.create_string_buffer(self._ttl_space)
+                              for k in range(batch_size)]
+
+        self.send_iov = (iovec * batch_size)()
+        self.send_msgs = (mmsghdr * batch_size)()
+        for k in range(batch_size):
+            self.send_iov[k].iov_base = ctypes.addressof(self._send_c[k])
+
+            hdr = self.send_msgs[k].msg_hdr
+            hdr.msg_iov = ctypes.pointer(self.send_iov[k])
+            hdr.msg_iovlen = 1
+
+        # Receive side, preallocated buffers that stay put.
+        pool = receive.BufferPool(count=batch_size, size=buf_size)
+        self.buffers = [pool.acquire() for k in range(batch_size)]
+        self._recv_c = [(ctypes.c_char * buf_size).from_buffer(buf) for buf in self.buffers]
+        self._recv_names = [ctypes.create_string_buffer(SOCKADDR_SIZE) for k in range(batch_size)]
+        self._recv_control = [ctypes.create_string_buffer(control_size) for k in range(batch_size)]
+
+        self.recv_iov = (iovec * batch_size)()
+        self.recv_msgs = (mmsghdr * batch_size)()
+        for k in range(batch_size):
+            self.recv_iov[k].iov_base = ctypes.addressof(self._recv_c[k])
+            self.recv_iov[k].iov_len = buf_size
+
+            hdr = self.recv_msgs[k].msg_hdr
+            hdr.msg_iov = ctypes.pointer(self.recv_iov[k])
+            hdr.msg_iovlen = 1
+            hdr.msg_name = ctypes.addressof(self._recv_names[k])
+            if control_size:
+                hdr.msg_control = ctypes.addressof(self._recv_control[k])
+
+
+
+    def sockaddr(self, host_addr):
+        """
+        Cached struct sockaddr for a destination address.
+        """
+        addr = self.addr_cache.get(host_addr)
+        if addr is None:
+            addr = pack_sockaddr(host_addr)
+            self.addr_cache[host_addr] = addr
+
+        # Done.
+        return addr
+
+
+
+    def stage(self, k, packet, host_addr, ttl=None):
+        """
+        Copy a packet into send slot k, addressed to host_addr.  The caller may reuse its own
+        buffer right away.
+
+        ttl: IP time to live, or IPv6 hop limit, for this packet alone.  None for the socket's.
+        """
+        size = len(packet)
+        if isinstance(packet, bytearray):
+            packet = (ctypes.c_char * size).from_buffer(packet)
+
+        ctypes.memmove(self._send_c[k], packet, size)
+        self.send_iov[k].iov_len = size
+
+        addr = self.sockaddr(host_addr)
+        hdr = self.send_msgs[k].msg_hdr
+        hdr.msg_name = ctypes.addressof(addr)
+        hdr.msg_namelen = ctypes.sizeof(addr)
+
+        if ttl is None:
+            hdr.msg_control = None
+            hdr.msg_controllen = 0
+        else:
+            level, option = self._ttl_option
+            control = self._send_control[k]
+            struct.pack_into(CMSG_HEADER, control, 0, self._ttl_len, level, option)
+            struct.pack_into(str('@i'), control, self._ttl_offset, ttl)
+            hdr.msg_control = ctypes.addressof(control)
+            hdr.msg_controllen = self._ttl_space
+
+
+
+    def send_staged(self, count):
+        """
+        Send slots 0 to count-1 in one call.  Returns the number actually sent, which may be fewer
+        than asked for if the socket is full.
+        """
+        num_sent = self.libc.sendmmsg(self.fd, self.send_msgs, count, MSG_DONTWAIT)
+        if num_sent < 0:
+            err = ctypes.get_errno()
+            if err in (errno.EAGAIN, errno.EWOULDBLOCK, errno.ENOBUFS):
+                return 0
+            raise socket.error(err, os.strerror(err))
+
+        # Done.
+        return num_sent
+
+
+
+    def send_batch(self, items):
+        """
+        Send a list of (packet, host_addr) in one call.  Returns the number actually sent.
+        """
+        count = min(len(items), self.batch_size)
+        for k in range(count):
+            packet, host_addr = items[k]
+            self.stage(k, packet, host_addr)
+
+        # Done.
+        return self.send_staged(count)
+
+
+
+    def recv_batch(self, errqueue=False):
+        """
+        Receive whatever is waiting, up to batch_size packets, without blocking.  Returns the
+        number received.  Packet k is in buffers[k], with length(k) bytes, from source(k).
+
+        errqueue: read from the socket's error queue (MSG_ERRQUEUE) instead.
+        """
+        for k in range(self.batch_size):
+            hdr = self.recv_msgs[k].msg_hdr
+            hdr.msg_namelen = SOCKADDR_SIZE
+            hdr.msg_controllen = self.control_size
+
+        flags = MSG_DONTWAIT
+        if errqueue:
+            flags |= MSG_ERRQUEUE
+
+        num_recv = self.libc.recvmmsg(self.fd, self.recv_msgs, self.batch_size, flags, None)
+        if num_recv < 0:
+            err = ctypes.get_errno()
+            if err in (errno.EAGAIN, errno.EWOULDBLOCK):
+                return 0
+            raise socket.error(err, os.strerror(err))
+
+        # Done.
+        return num_recv
+
+
+
+    def length(self, k):
+        """
+        Number of bytes received into buffers[k].
+        """
+        return self.recv_msgs[k].msg_len
+
+
+
+    def source(self, k):
+        """
+        Source address of packet k, as a string.
+        """
+        return unpack_sockaddr(self._recv_names[k].raw)
+
+
+
+    def control(self, k):
+        """
+        Ancillary data that came with packet k, as a string.
+        """
+        size = self.recv_msgs[k].msg_hdr.msg_controllen
+        if not size:
+            return b''
+
+        # Done.
+        return ctypes.string_at(self._recv_control[k], size)
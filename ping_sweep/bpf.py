@@ -0,0 +1,414 @@
+#!/usr/bin/env python
+
+#
+# Copyright 2011 Pierre V. Villeneuve
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Classic BPF socket filters.
+
+A raw ICMP socket gets a copy of every ICMP packet arriving at the host.  A filter attached with
+SO_ATTACH_FILTER lets the kernel throw away everything that isn't ours before the process is even
+woken up.  Program builds a filter from Python, with named labels for jump targets, and
+simulate() runs one over a packet for testing without a socket.
+"""
+
+from __future__ import division, print_function #, unicode_literals
+
+import ctypes
+import os
+import socket
+import struct
+
+import dpkt
+
+
+SO_ATTACH_FILTER = 26
+SO_DETACH_FILTER = 27
+
+# Instruction classes.
+BPF_LD = 0x00
+BPF_LDX = 0x01
+BPF_ALU = 0x04
+BPF_JMP = 0x05
+BPF_RET = 0x06
+BPF_MISC = 0x07
+
+# Load sizes and modes.
+BPF_W = 0x00
+BPF_H = 0x08
+BPF_B = 0x10
+
+BPF_IMM = 0x00
+BPF_ABS = 0x20
+BPF_IND = 0x40
+BPF_MSH = 0xa0
+
+# ALU operations.
+BPF_ADD = 0x00
+BPF_SUB = 0x10
+BPF_OR = 0x40
+BPF_AND = 0x50
+BPF_LSH = 0x60
+BPF_RSH = 0x70
+
+# Jumps.
+BPF_JA = 0x00
+BPF_JEQ = 0x10
+BPF_JGT = 0x20
+BPF_JGE = 0x30
+BPF_JSET = 0x40
+
+# Operand source.
+BPF_K = 0x00
+BPF_X = 0x08
+BPF_A = 0x10
+
+# Misc.
+BPF_TAX = 0x00
+BPF_TXA = 0x80
+
+ACCEPT = 0xffff     # bytes of the packet to keep.
+DROP = 0
+
+_INSN = struct.Struct('=HBBI')
+
+try:
+    _string_types = basestring
+except NameError:
+    _string_types = str
+
+# ICMP errors that quote the datagram that caused them.
+ICMP_ERROR_TYPES = (dpkt.icmp.ICMP_UNREACH, dpkt.icmp.ICMP_SRCQUENCH, dpkt.icmp.ICMP_REDIRECT,
+                    dpkt.icmp.ICMP_TIMEXCEED, dpkt.icmp.ICMP_PARAMPROB)
+
+ICMP6_ERROR_TYPES = (dpkt.icmp6.ICMP6_DST_UNREACH, dpkt.icmp6.ICMP6_PACKET_TOO_BIG,
+                     dpkt.icmp6.ICMP6_TIME_EXCEEDED, dpkt.icmp6.ICMP6_PARAM_PROB)
+
+IP6_HEADER_SIZE = 40
+
+
+#################################################
+
+class BPFError(Exception):
+    pass
+
+
+
+class Program(object):
+    """
+    Classic BPF program under construction.
+
+    Jump targets may be given as label names, resolved once the whole program is known.
+    """
+    def __init__(self):
+        self.insns = []
+        self.labels = {}
+
+    def __len__(self):
+        return len(self.insns)
+
+
+
+    def label(self, name):
+        """
+        Attach a label to the next instruction.
+        """
+        self.labels[name] = len(self.insns)
+
+
+
+    def stmt(self, code, k=0):
+        """
+        Add a plain instruction.
+        """
+        self.insns.append((code, 0, 0, k))
+
+
+
+    def jump(self, code, k, jt, jf):
+        """
+        Add a conditional jump.  jt and jf are label names, or offsets counted from the next
+        instruction.
+        """
+        self.insns.append((code, jt, jf, k))
+
+
+
+    def assemble(self):
+        """
+        Resolve labels.  Returns the list of (code, jt, jf, k) instructions.
+        """
+        insns = []
+        for index, (code, jt, jf, k) in enumerate(self.insns):
+            jt = self._offset(index, jt)
+            jf = self._offset(index, jf)
+            insns.append((code, jt, jf, k))
+
+        # Done.
+        return insns
+
+
+
+    def pack(self):
+        """
+        Machine code: an array of struct sock_filter, as a string.
+        """
+        return b''.join(_INSN.pack(*insn) for insn in self.assemble())
+
+
+
+    def _offset(self, index, target):
+        if not isinstance(target, _string_types):
+            return target
+
+        if target not in self.labels:
+            raise BPFError('Unknown label: {:s}'.format(target))
+
+        offset = self.labels[target] - index - 1
+        if not 0 <= offset <= 0xff:
+            raise BPFError('Jump out of range: {:s}'.format(target))
+
+        # Done.
+        return offset
+
+#################################################
+
+
+def echo_filter(pid, ip_header=True, family=None):
+    """
+    Build a filter passing only echo replies carrying our id, and ICMP errors quoting one of our
+    echo requests.  Everything else is dropped in the kernel.
+
+    ip_header: True for raw sockets, where the filter sees the IP header in front of ICMP.
+    family: socket.AF_INET6 for a raw ICMPv6 socket, which never sees the IP header.
+    """
+    if family == socket.AF_INET6:
+        return _echo6_filter(pid)
+
+    p = Program()
+
+    # X = offset of the ICMP header.
+    if ip_header:
+        p.stmt(BPF_LDX | BPF_B | BPF_MSH, 0)
+    else:
+        p.stmt(BPF_LDX | BPF_W | BPF_IMM, 0)
+
+    # Echo reply with our id?
+    p.stmt(BPF_LD | BPF_B | BPF_IND, 0)
+    p.jump(BPF_JMP | BPF_JEQ | BPF_K, dpkt.icmp.ICMP_ECHOREPLY, 'echo', 0)
+    for icmp_type in ICMP_ERROR_TYPES:
+        p.jump(BPF_JMP | BPF_JEQ | BPF_K, icmp_type, 'error', 0)
+    p.stmt(BPF_RET | BPF_K, DROP)
+
+    p.label('echo')
+    p.stmt(BPF_LD | BPF_H | BPF_IND, 4)
+    p.jump(BPF_JMP | BPF_JEQ | BPF_K, pid, 'accept', 'drop')
+
+    # ICMP error.  Step X over the quoted IP header, which starts 8 bytes into the ICMP message.
+    p.label('error')
+    p.stmt(BPF_LD | BPF_B | BPF_IND, 8)
+    p.stmt(BPF_ALU | BPF_AND | BPF_K, 0x0f)
+    p.stmt(BPF_ALU | BPF_LSH | BPF_K, 2)
+    p.stmt(BPF_ALU | BPF_ADD | BPF_X, 0)
+    p.stmt(BPF_MISC | BPF_TAX, 0)
+
+    # Quoted echo request with our id?
+    p.stmt(BPF_LD | BPF_B | BPF_IND, 8)
+    p.jump(BPF_JMP | BPF_JEQ | BPF_K, dpkt.icmp.ICMP_ECHO, 0, 'drop')
+    p.stmt(BPF_LD | BPF_H | BPF_IND, 8 + 4)
+    p.jump(BPF_JMP | BPF_JEQ | BPF_K, pid, 'accept', 'drop')
+
+    p.label('accept')
+    p.stmt(BPF_RET | BPF_K, ACCEPT)
+
+    p.label('drop')
+    p.stmt(BPF_RET | BPF_K, DROP)
+
+    # Done.
+    return p
+
+
+
+def _echo6_filter(pid):
+    p = Program()
+
+    # Echo reply with our id?
+    p.stmt(BPF_LD | BPF_B | BPF_ABS, 0)
+    p.jump(BPF_JMP | BPF_JEQ | BPF_K, dpkt.icmp6.ICMP6_ECHO_REPLY, 'echo', 0)
+    for icmp_type in ICMP6_ERROR_TYPES:
+        p.jump(BPF_JMP | BPF_JEQ | BPF_K, icmp_type, 'error', 0)
+    p.stmt(BPF_RET | BPF_K, DROP)
+
+    p.label('echo')
+    p.stmt(BPF_LD | BPF_H | BPF_ABS, 4)
+    p.jump(BPF_JMP | BPF_JEQ | BPF_K, pid, 'accept', 'drop')
+
+    # ICMPv6 error.  The quoted IPv6 header starts 8 bytes in and is a fixed size, quotes with
+    # extension headers in between are not followed.
+    p.label('error')
+    p.stmt(BPF_LD | BPF_B | BPF_ABS, 8 + 6)
+    p.jump(BPF_JMP | BPF_JEQ | BPF_K, dpkt.ip.IP_PROTO_ICMP6, 0, 'drop')
+
+    # Quoted echo request with our id?
+    offset = 8 + IP6_HEADER_SIZE
+    p.stmt(BPF_LD | BPF_B | BPF_ABS, offset)
+    p.jump(BPF_JMP | BPF_JEQ | BPF_K, dpkt.icmp6.ICMP6_ECHO_REQUEST, 0, 'drop')
+    p.stmt(BPF_LD | BPF_H | BPF_ABS, offset + 4)
+    p.jump(BPF_JMP | BPF_JEQ | BPF_K, pid, 'accept', 'drop')
+
+    p.label('accept')
+    p.stmt(BPF_RET | BPF_K, ACCEPT)
+
+    p.label('drop')
+    p.stmt(BPF_RET | BPF_K, DROP)
+
+    # Done.
+    return p
+
+#################################################
+
+
+class sock_fprog(ctypes.Structure):
+    _fields_ = [('len', ctypes.c_ushort),
+                ('filter', ctypes.c_void_p)]
+
+
+
+def attach_filter(sock, program):
+    """
+    Attach a filter program to a socket.  Returns True if it worked, False where socket filters
+    are not supported.
+    """
+    if not os.sys.platform.startswith('linux'):
+        return False
+
+    code = program.pack()
+    insns = ctypes.create_string_buffer(code, len(code))
+    fprog = sock_fprog(len(program), ctypes.addressof(insns))
+
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, SO_ATTACH_FILTER,
+                        ctypes.string_at(ctypes.addressof(fprog), ctypes.sizeof(fprog)))
+    except socket.error:
+        return False
+
+    # Done.
+    return True
+
+
+
+def detach_filter(sock):
+    """
+    Remove the filter from a socket.
+    """
+    sock.setsockopt(socket.SOL_SOCKET, SO_DETACH_FILTER, 0)
+
+#################################################
+
+
+def simulate(program, packet):
+    """
+    Run a filter program over a packet in Python, the way the kernel would.  Returns the number
+    of bytes to keep, zero meaning drop.
+    """
+    insns = program.assemble()
+    packet = bytearray(packet)
+
+    def load(size, offset):
+        if offset < 0 or offset + size > len(packet):
+            return None
+        return struct.unpack_from({1: '>B', 2: '>H', 4: '>I'}[size], packet, offset)[0]
+
+    sizes = {BPF_W: 4, BPF_H: 2, BPF_B: 1}
+
+    A = X = 0
+    pc = 0
+    while pc < len(insns):
+        code, jt, jf, k = insns[pc]
+        pc += 1
+
+        klass = code & 0x07
+        if klass == BPF_LD:
+            mode = code & 0xe0
+            if mode == BPF_IMM:
+                A = k
+            else:
+                offset = k + (X if mode == BPF_IND else 0)
+                A = load(sizes[code & 0x18], offset)
+                if A is None:
+                    return 0
+
+        elif klass == BPF_LDX:
+            if code & 0xe0 == BPF_MSH:
+                value = load(1, k)
+                if value is None:
+                    return 0
+                X = (value & 0x0f) << 2
+            else:
+                X = k
+
+        elif klass == BPF_ALU:
+            operand = X if code & BPF_X else k
+            op = code & 0xf0
+            if op == BPF_ADD:
+                A = A + operand
+            elif op == BPF_SUB:
+                A = A - operand
+            elif op == BPF_OR:
+                A = A | operand
+            elif op == BPF_AND:
+                A = A & operand
+            elif op == BPF_LSH:
+                A = A << operand
+            elif op == BPF_RSH:
+                A = A >> operand
+            else:
+                raise BPFError('Unsupported ALU op: 0x{:02x}'.format(code))
+            A &= 0xffffffff
+
+        elif klass == BPF_JMP:
+            op = code & 0xf0
+            operand = X if code & BPF_X else k
+            if op == BPF_JA:
+                pc += k
+                continue
+            elif op == BPF_JEQ:
+                taken = A == operand
+            elif op == BPF_JGT:
+                taken = A > operand
+            elif op == BPF_JGE:
+                taken = A >= operand
+            elif op == BPF_JSET:
+                taken = bool(A & operand)
+            else:
+                raise BPFError('Unsupported jump: 0x{:02x}'.format(code))
+            pc += jt if taken else jf
+
+        elif klass == BPF_RET:
+            return A if code & BPF_A else k
+
+        elif klass == BPF_MISC:
+            if code & 0xf8 == BPF_TXA:
+                A = X
+            else:
+                X = A
+
+        else:
+            raise BPFError('Unsupported instruction: 0x{:02x}'.format(code))
+
+    # Done.
+    raise BPFError('Program fell off the end without returning')
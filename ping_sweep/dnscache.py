@@ -0,0 +1,449 @@
+#!/usr/bin/env python
+
+#
+# Copyright 2011 Pierre V. Villeneuve
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Bulk host name resolution with a TTL cache kept on disk.
+
+A whole target list is resolved in parallel on a thread pool.  Each name is looked up with the
+system resolver, so /etc/hosts, mDNS and the rest of nsswitch work as they do for every other
+program, and cached for DEFAULT_TTL.  Only names the system can't resolve are asked of the name
+servers in resolv.conf directly, with the bundled dpkt.dns, and cached for their record's TTL.
+Names that can't be resolved at all are reported back, not raised.
+
+A Resolver looks up either IPv4 (A) or IPv6 (AAAA) addresses, as set by its family.
+"""
+
+from __future__ import division, print_function #, unicode_literals
+
+import json
+import multiprocessing.pool
+import os
+import random
+import socket
+import tempfile
+import time
+
+import dpkt
+
+
+DNS_PORT = 53
+
+DEFAULT_TTL = 300.   # seconds, for answers from the system resolver which come without a TTL.
+
+
+#################################################
+
+class ResolverError(Exception):
+    pass
+
+
+
+def default_cache_path(family=None):
+    """
+    Where the command line tool keeps its cache between runs.
+    """
+    path = os.path.join(os.path.expanduser('~'), '.cache', 'ping_sweep', 'hosts.json')
+
+    # Done.
+    return family_cache_path(path, family)
+
+
+
+def family_cache_path(cache_path, family=None):
+    """
+    Cache file for one address family.  IPv6 answers are kept apart, e.g. in hosts6.json next to
+    hosts.json, so that each Resolver has a file to itself.
+    """
+    if not cache_path or family != socket.AF_INET6:
+        return cache_path
+
+    root, ext = os.path.splitext(cache_path)
+
+    # Done.
+    return root + '6' + ext
+
+
+
+def is_address(host_name, family=None):
+    """
+    Return True if host_name is already a dotted quad IPv4 address, or with family
+    socket.AF_INET6 an IPv6 address.
+    """
+    if family == socket.AF_INET6:
+        return normalize_ipv6(host_name) is not None
+
+    try:
+        socket.inet_aton(host_name)
+    except (socket.error, UnicodeError, TypeError):
+        return False
+
+    # Done.
+    return host_name.count('.') == 3
+
+
+
+def normalize_ipv6(host_name):
+    """
+    IPv6 address in its canonical text form, the way the kernel reports sources.  None if
+    host_name is not an IPv6 address.
+    """
+    try:
+        packed = socket.inet_pton(socket.AF_INET6, host_name)
+    except (socket.error, ValueError, UnicodeError, TypeError):
+        return None
+
+    # Done.
+    return socket.inet_ntop(socket.AF_INET6, packed)
+
+
+
+def nameservers(path=None):
+    """
+    Name server addresses listed in resolv.conf, IPv4 or IPv6.
+    """
+    if not path:
+        path = '/etc/resolv.conf'
+
+    servers = []
+    try:
+        with open(path) as fi:
+            for line in fi:
+                fields = line.split()
+                if len(fields) < 2 or fields[0] != 'nameserver':
+                    continue
+
+                # IPv6 link local servers come with a zone, e.g. fe80::1%eth0.
+                server = fields[1]
+                if is_address(server) or normalize_ipv6(server.split('%', 1)[0]):
+                    servers.append(server)
+    except IOError:
+        pass
+
+    # Done.
+    return servers
+
+#################################################
+
+
+def query_records(host_name, server, timeout=None, port=None, family=None):
+    """
+    Ask a name server for the A records of host_name over UDP, or the AAAA records with family
+    socket.AF_INET6.  Returns (list of addresses, ttl seconds).  Raises ResolverError if there is
+    no answer.
+
+    server: name server address, IPv4 or IPv6.
+    """
+    if not timeout:
+        timeout = 2.   # seconds
+
+    if not port:
+        port = DNS_PORT
+
+    if family == socket.AF_INET6:
+        record_type = dpkt.dns.DNS_AAAA
+    else:
+        record_type = dpkt.dns.DNS_A
+
+    query = dpkt.dns.DNS(id=random.randint(0, 0xffff))
+    query.qd = [dpkt.dns.DNS.Q(name=str(host_name), type=record_type, cls=dpkt.dns.DNS_IN)]
+
+    try:
+        server_family, _, _, _, server_addr = socket.getaddrinfo(server, port, 0,
+                                                                 socket.SOCK_DGRAM)[0]
+    except socket.error as e:
+        raise ResolverError('Bad name server address {:s}: {}'.format(server, e))
+
+    sock = socket.socket(server_family, socket.SOCK_DGRAM)
+    sock.settimeout(timeout)
+    try:
+        sock.sendto(bytes(query), server_addr)
+
+        while True:
+            data, addr = sock.recvfrom(0x10000)
+            if addr[0] != server_addr[0]:
+                continue
+
+            reply = dpkt.dns.DNS(data)
+            if reply.id == query.id and reply.qr == dpkt.dns.DNS_R:
+                break
+
+    except (socket.error, dpkt.UnpackError) as e:
+        raise ResolverError('No answer from {:s}: {}'.format(server, e))
+
+    finally:
+        sock.close()
+
+    if reply.rcode != dpkt.dns.DNS_RCODE_NOERR:
+        raise ResolverError('Name server {:s} returned error {:d}'.format(server, reply.rcode))
+
+    # CNAME records may come first, the TTL is the smallest along the chain.
+    records = [rr for rr in reply.an if rr.type == record_type]
+    if not records:
+        raise ResolverError('No address records for {:s}'.format(host_name))
+
+    ttl = min(rr.ttl for rr in reply.an)
+
+    if family == socket.AF_INET6:
+        addresses = [socket.inet_ntop(socket.AF_INET6, rr.rdata) for rr in records]
+    else:
+        addresses = [socket.inet_ntoa(rr.rdata) for rr in records]
+
+    # Done.
+    return addresses, ttl
+
+
+
+def query_dns(host_name, server, timeout=None, port=None, family=None):
+    """
+    Ask a name server for the A record of host_name over UDP, or the AAAA record with family
+    socket.AF_INET6.  Returns (address, ttl seconds).  Raises ResolverError if there is no answer.
+    """
+    addresses, ttl = query_records(host_name, server, timeout=timeout, port=port, family=family)
+
+    # Done.
+    return addresses[0], ttl
+
+
+
+def lookup(host_name, servers=None, timeout=None, family=None, port=None):
+    """
+    Resolve one name.  Returns (address, ttl seconds), ttl None meaning forever.  Raises
+    ResolverError if the name can't be resolved.
+
+    The system resolver is asked first, its answers come without a TTL and are given
+    DEFAULT_TTL.  The name servers are only asked when it fails, each one in turn until one has
+    an address.
+
+    servers: name servers to fall back on, first one to answer wins.
+    family: socket.AF_INET6 for an IPv6 address, default IPv4.
+    port: name server port, default DNS_PORT.
+    """
+    if family == socket.AF_INET6:
+        host_addr = normalize_ipv6(host_name)
+        if host_addr:
+            return host_addr, None
+
+        if is_address(host_name):
+            raise ResolverError('Not an IPv6 address: {:s}'.format(host_name))
+
+    elif is_address(host_name):
+        return host_name, None
+
+    elif normalize_ipv6(host_name):
+        raise ResolverError('Not an IPv4 address: {:s}'.format(host_name))
+
+    try:
+        if family == socket.AF_INET6:
+            infos = socket.getaddrinfo(host_name, None, socket.AF_INET6, socket.SOCK_RAW)
+            host_addr = normalize_ipv6(infos[0][4][0].split('%', 1)[0])
+        else:
+            host_addr = socket.gethostbyname(host_name)
+    except socket.error as e:
+        error = e
+    else:
+        return host_addr, DEFAULT_TTL
+
+    for server in servers or []:
+        try:
+            return query_dns(host_name, server, timeout=timeout, port=port, family=family)
+        except ResolverError:
+            continue
+
+    # Done.
+    raise ResolverError('Unable to resolve host name: {:s} ({})'.format(host_name, error))
+
+#################################################
+
+
+class Resolver(object):
+    """
+    Resolve many names at once, keeping answers until their TTL runs out.
+
+    cache_path: JSON file to keep the cache in between runs.  None for memory only.
+    workers: number of lookups in parallel.
+    timeout: seconds to wait for each name server.
+    use_dns: ask the name servers from resolv.conf directly for names the system resolver can't
+             resolve.
+    family: socket.AF_INET6 to look up IPv6 addresses, default IPv4.  Give each family its own
+            cache_path.
+    """
+    def __init__(self, cache_path=None, workers=None, timeout=None, use_dns=True, family=None):
+        if not workers:
+            workers = 32
+
+        if not family:
+            family = socket.AF_INET
+
+        self.cache_path = cache_path
+        self.workers = workers
+        self.timeout = timeout
+        self.family = family
+
+        if use_dns:
+            self.servers = nameservers()
+        else:
+            self.servers = []
+
+        # name -> (address, wall clock time it expires or None).
+        self.cache = {}
+        if cache_path:
+            self.load()
+
+
+
+    def load(self):
+        """
+        Read the cache file, skipping anything already expired.  A missing or damaged file just
+        means an empty cache.
+        """
+        try:
+            with open(self.cache_path) as fi:
+                entries = json.load(fi)
+        except (IOError, ValueError):
+            return
+
+        time_now = time.time()
+        for host_name, (host_addr, expires) in entries.items():
+            if expires is None or expires > time_now:
+                self.cache[host_name] = (host_addr, expires)
+
+
+
+    def save(self):
+        """
+        Write the cache file.  Written to a temporary file first and renamed into place, so a
+        crash never leaves a half written cache.
+        """
+        folder = os.path.dirname(self.cache_path)
+        if folder and not os.path.isdir(folder):
+            os.makedirs(folder)
+
+        fd, path_temp = tempfile.mkstemp(dir=folder or '.', suffix='.tmp')
+        with os.fdopen(fd, 'w') as fo:
+            json.dump(self.cache, fo)
+
+        os.rename(path_temp, self.cache_path)
+
+
+
+    def cached(self, host_name):
+        """
+        Cached address for a name, or None if not known or expired.
+        """
+        entry = self.cache.get(host_name)
+        if not entry:
+            return None
+
+        host_addr, expires = entry
+        if expires is not None and expires <= time.time():
+            del self.cache[host_name]
+            return None
+
+        # Done.
+        return host_addr
+
+
+
+    def _lookup(self, host_name):
+        try:
+            host_addr, ttl = lookup(host_name, servers=self.servers, timeout=self.timeout,
+                                    family=self.family)
+        except ResolverError as e:
+            return host_name, None, None, str(e)
+
+        # Done.
+        return host_name, host_addr, ttl, None
+
+
+
+    def resolve_all(self, host_names):
+        """
+        Resolve a list of names.  Returns (addresses, errors): a dict of name to address for every
+        name resolved, and a dict of name to error message for the rest.
+        """
+        addresses = {}
+        errors = {}
+
+        todo = []
+        seen = set()
+        for host_name in host_names:
+            if self.family == socket.AF_INET6:
+                host_addr = normalize_ipv6(host_name)
+                if host_addr:
+                    addresses[host_name] = host_addr
+                    continue
+
+            elif is_address(host_name):
+                addresses[host_name] = host_name
+                continue
+
+            host_addr = self.cached(host_name)
+            if host_addr:
+                addresses[host_name] = host_addr
+            elif host_name not in seen:
+                seen.add(host_name)
+                todo.append(host_name)
+
+        if not todo:
+            return addresses, errors
+
+        if len(todo) == 1:
+            answers = [self._lookup(todo[0])]
+        else:
+            pool = multiprocessing.pool.ThreadPool(min(self.workers, len(todo)))
+            try:
+                answers = pool.map(self._lookup, todo)
+            finally:
+                pool.close()
+                pool.join()
+
+        time_now = time.time()
+        for host_name, host_addr, ttl, error in answers:
+            if error:
+                errors[host_name] = error
+                continue
+
+            addresses[host_name] = host_addr
+            if ttl is None:
+                self.cache[host_name] = (host_addr, None)
+            else:
+                self.cache[host_name] = (host_addr, time_now + ttl)
+
+        if self.cache_path:
+            try:
+                self.save()
+            except (IOError, OSError):
+                # Only a cache, carry on without it.
+                pass
+
+        # Done.
+        return addresses, errors
+
+
+
+    def resolve(self, host_name):
+        """
+        Resolve one name.  Raises ResolverError if it can't be.
+        """
+        addresses, errors = self.resolve_all([host_name])
+        if host_name in errors:
+            raise ResolverError(errors[host_name])
+
+        # Done.
+        return addresses[host_name]
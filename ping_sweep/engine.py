@@ -0,0 +1,1141 @@
+#!/usr/bin/env python
+
+#
+# Copyright 2011 Pierre V. Villeneuve
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Event-driven sweep engine.
+
+Many echo requests are kept in flight at once over a single shared raw ICMP socket.  Replies are
+matched back to their probes by (id, seq) instead of being assumed to belong to the most recent
+send.  The engine only deals with addresses, packets and timing.  Name resolution and turning the
+per-probe results into summary statistics is left to the caller.  IPv6 hosts are swept the same
+way over an ICMPv6 socket, one engine per address family.
+
+Probes may also go out with a limited IP TTL, for traceroute.  Time exceeded errors quoting such
+a probe then count as its reply, coming from the hop that sent them.
+"""
+
+from __future__ import division, print_function #, unicode_literals
+
+import collections
+import errno
+import heapq
+import itertools
+import os
+import select
+import socket
+
+import dpkt
+
+import accumulator
+import batchio
+import bpf
+import inflight
+import packets
+import receive
+import rtt
+import scheduler
+import timestamps
+
+
+# Send times and scheduling run on a monotonic clock.
+clock = timestamps.monotonic
+
+DEFAULT_TIMEOUT = 1000.   # milliseconds to wait for each reply.
+
+# What a datagram socket's receive call fails with, once, when an ICMP error has been queued.
+ICMP_ERRNOS = (errno.ENETUNREACH, errno.EHOSTUNREACH, errno.ENOPROTOOPT, errno.ECONNREFUSED,
+               errno.EMSGSIZE, errno.EOPNOTSUPP, errno.EACCES, errno.EPROTO, errno.EREMOTEIO)
+
+
+#################################################
+
+class Cell(object):
+    """
+    Bookkeeping for one (host, payload size) combination.
+
+    Outcomes are folded into a running Tally as they come in.  The per-probe result dicts are
+    only kept if asked for with keep_results, the ping times alone with keep_times.
+
+    ttl: IP time to live for this cell's probes, None for the socket default.  Addresses of the
+         hops that answered are counted in hop_addrs.
+    family: socket.AF_INET6 for ICMPv6 probes, default IPv4.
+    """
+    def __init__(self, host_name, host_addr, data_size, count_send, pattern=None, keep_results=False,
+                 keep_times=False, ttl=None, family=None):
+        self.host_name = host_name
+        self.host_addr = host_addr
+        self.data_size = data_size
+        self.count_send = count_send
+        self.ttl = ttl
+        self.hop_addrs = collections.Counter()
+
+        # With a stopping rule count_send moves: down when sampling stops early, up when given
+        # probes saved elsewhere.  count_budget is what was asked for.
+        self.count_budget = count_send
+        self.count_queued = 0
+        self.tally = accumulator.Tally(keep_times=keep_times)
+
+        if keep_results:
+            self.results = []
+        else:
+            self.results = None
+
+        # Same packet template and payload for every probe in this cell.
+        self.template = packets.get_template(data_size, pattern=pattern, family=family)
+        self.payload = self.template.payload
+
+    @property
+    def is_done(self):
+        return self.tally.count_send == self.count_send
+
+
+
+class Probe(object):
+    """
+    One echo request currently in flight.
+    """
+    __slots__ = ('cell', 'host', 'seq', 'packet_size', 'time_send', 'timeout', 'deadline')
+
+    def __init__(self, cell, host, seq, packet_size, time_send, deadline):
+        self.cell = cell
+        self.host = host
+        self.seq = seq
+        self.packet_size = packet_size
+        self.time_send = time_send
+        self.timeout = None
+        self.deadline = deadline
+
+
+
+class Host(object):
+    """
+    Probes still to be sent to one host.  Sends cycle over the payload sizes so that no single
+    size gets all of its probes in a burst.  When each host may send is up to the Scheduler.
+
+    rtt: RttEstimator for adaptive timeouts, or None.
+    """
+    def __init__(self, host_addr, rtt=None):
+        self.host_addr = host_addr
+        self.cells = collections.deque()
+        self.rtt = rtt
+
+        # Cells added for this host and not yet let go of.
+        self.count_live = 0
+
+        # Probes left over by cells that stopped early, free for the noisier ones.
+        self.count_spare = 0
+
+#################################################
+
+
+def create_engine_socket(rcvbuf=None, dgram=False, family=None):
+    """
+    Make an unconnected, non-blocking ICMP socket to be shared by all probes.
+
+    NOTE: This function requires the user to be running as admin or root since
+    we are creating a raw socket, unless dgram is set.
+
+    rcvbuf: requested kernel receive buffer size, bytes.
+    dgram: make an unprivileged ICMP datagram socket instead (Linux "ping socket").  The kernel
+           picks the echo id, only passes up replies meant for this socket, and strips the IP
+           header.  Allowed groups are set by the net.ipv4.ping_group_range sysctl.
+    family: socket.AF_INET6 for an ICMPv6 socket, default IPv4.
+    """
+    if not rcvbuf:
+        rcvbuf = 4*1024*1024
+
+    if not family:
+        family = socket.AF_INET
+
+    if dgram:
+        s_type = socket.SOCK_DGRAM
+    else:
+        s_type = socket.SOCK_RAW
+
+    if family == socket.AF_INET6:
+        s_proto = dpkt.ip.IP_PROTO_ICMP6
+    else:
+        s_proto = dpkt.ip.IP_PROTO_ICMP
+
+    sock = socket.socket(family, s_type, s_proto)
+    sock.setblocking(False)
+
+    if family == socket.AF_INET6 and not dgram:
+        # ICMPv6 checksum covers the source address, have the kernel fill it in.  Linux always
+        # does so for ICMPv6 and refuses the option.
+        try:
+            sock.setsockopt(socket.IPPROTO_IPV6, socket.IPV6_CHECKSUM, 2)
+        except socket.error:
+            pass
+
+    if dgram:
+        # Have the kernel assign our echo id right away.
+        sock.bind(('', 0))
+
+    # Lots of replies may arrive in a burst.  Ask for a big buffer, the kernel will clamp it.
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, rcvbuf)
+    except socket.error:
+        pass
+
+    # Done.
+    return sock
+
+
+
+def is_dgram(sock):
+    """
+    Return True for an ICMP datagram socket, where replies come without an IP header.
+    """
+    return sock.getsockopt(socket.SOL_SOCKET, socket.SO_TYPE) == socket.SOCK_DGRAM
+
+
+
+def socket_echo_id(sock):
+    """
+    Echo id the kernel assigned to an ICMP datagram socket.  One not bound yet is bound here, so
+    the id is known before the first request goes out.  None where the kernel assigns no id and
+    leaves the one in each request as it is, replies are then matched on the id we send.
+    """
+    echo_id = sock.getsockname()[1]
+    if not echo_id:
+        try:
+            sock.bind(sock.getsockname()[:2])
+        except socket.error:
+            return None
+
+        echo_id = sock.getsockname()[1]
+        if not echo_id:
+            return None
+
+    # Done.
+    return echo_id
+
+
+
+def enable_error_queue(sock):
+    """
+    Have the kernel queue ICMP errors about requests sent on an ICMP datagram socket, to be read
+    with MSG_ERRQUEUE.  Otherwise it drops them, and a probe that drew one looks just like a
+    timeout.  Returns True if the errors can be read here, which also needs recvmmsg().
+    """
+    if not batchio.is_supported():
+        return False
+
+    if sock.family == socket.AF_INET6:
+        level, option = socket.IPPROTO_IPV6, receive.IPV6_RECVERR
+    else:
+        level, option = socket.IPPROTO_IP, receive.IP_RECVERR
+
+    try:
+        sock.setsockopt(level, option, 1)
+    except socket.error:
+        return False
+
+    # Done.
+    return True
+
+
+
+def dgram_available(family=None):
+    """
+    Return True if this user may open an ICMP datagram socket.
+    """
+    try:
+        sock = create_engine_socket(dgram=True, family=family)
+    except socket.error:
+        return False
+
+    sock.close()
+
+    # Done.
+    return True
+
+#################################################
+
+
+class SocketManager(object):
+    """
+    One unconnected ICMP socket per address family, opened on first use and kept for the whole
+    run.  Probes go out with sendto() and replies are sorted out in user space, so the cost of
+    setting up sockets no longer grows with the number of hosts and payload sizes.
+
+    dgram: use unprivileged ICMP datagram sockets.
+    pid: echo id for raw sockets, and for datagram sockets where the kernel assigns none.  A BPF
+         filter for this id is attached to each raw socket.
+    """
+    def __init__(self, dgram=False, pid=None, rcvbuf=None):
+        if not pid:
+            pid = os.getpid()
+
+        self.dgram = dgram
+        self.pid = pid & 0xffff
+        self.rcvbuf = rcvbuf
+        self.sockets = {}
+        self.batches = {}
+
+        # Shared by the serial ping_once() callers, or engines run one after another, so late
+        # replies are still recognized.
+        self.table = inflight.InFlightTable()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+
+    def get(self, family=None):
+        """
+        Socket for an address family, default IPv4.
+        """
+        if not family:
+            family = socket.AF_INET
+
+        if family not in (socket.AF_INET, socket.AF_INET6):
+            raise ValueError('Unsupported address family: {}'.format(family))
+
+        sock = self.sockets.get(family)
+        if sock is None:
+            sock = create_engine_socket(rcvbuf=self.rcvbuf, dgram=self.dgram, family=family)
+            if self.dgram:
+                self.pid = socket_echo_id(sock) or self.pid
+            else:
+                bpf.attach_filter(sock, bpf.echo_filter(self.pid, family=family))
+
+            self.sockets[family] = sock
+
+        # Done.
+        return sock
+
+
+
+    def get_batch(self, family=None):
+        """
+        BatchSocket over the socket for an address family, with kernel receive timestamps turned
+        on, for ping_once() callers.  Set up once per socket.  None where kernel timestamps are
+        not supported.
+        """
+        sock = self.get(family)
+        if sock.family not in self.batches:
+            if batchio.is_supported() and timestamps.enable(sock):
+                batch = batchio.BatchSocket(sock, batch_size=1,
+                                            control_size=timestamps.CONTROL_SIZE)
+            else:
+                batch = None
+            self.batches[sock.family] = batch
+
+        # Done.
+        return self.batches[sock.family]
+
+
+
+    def close(self):
+        """
+        Close every socket.
+        """
+        for sock in self.sockets.values():
+            sock.close()
+        self.sockets.clear()
+        self.batches.clear()
+
+
+
+class EngineCounters(object):
+    """
+    Running totals of the engine's own work, for keeping an eye on it.  One set may be handed to
+    several engines in turn, such as the rounds of a monitor, to keep counting across them.
+    """
+    def __init__(self):
+        self.count_sent = 0
+        self.count_recv = 0
+        self.time_parse = 0.   # seconds spent matching received packets to probes.
+
+#################################################
+
+
+class SweepEngine(object):
+    """
+    Send echo requests to many hosts and payload sizes concurrently over one shared socket.
+
+    timeout: milliseconds to wait for each reply.  With adaptive_timeout, the longest wait.
+    adaptive_timeout: wait for each reply according to the round trip times seen so far from its
+                      host (RFC 6298), between min_timeout and timeout.  Lost probes then free
+                      their in-flight slot much sooner.
+    min_timeout: shortest adaptive timeout, milliseconds.
+    stopping: StoppingRule to stop sampling each (host, size) once its statistics have settled,
+              handing the probes saved to the host's noisier sizes.  None to always send
+              count_send probes.
+    time_pause: milliseconds between consecutive probes sent to the same host.
+    rate: global budget in packets per second across all hosts, None for no limit.
+    target_rate: budget in packets per second for each host, None for no limit beyond time_pause.
+    max_in_flight: upper limit on the number of unanswered probes across all hosts.
+    max_hosts: upper limit on the number of hosts from add_source() being swept at once.
+    batch_size: packets per sendmmsg/recvmmsg call, default 1 for one packet at a time.  Larger
+                batches send faster but every probe in a batch shares one send time, so its ping
+                time grows with its place in the batch.  Batches always ask for kernel receive
+                times, where supported, so replies read together still each get their own.
+    kernel_timestamps: take receive times from the kernel (SO_TIMESTAMPNS) instead of from
+                       user space.  Linux only, quietly ignored elsewhere.
+    dgram: use an unprivileged ICMP datagram socket instead of a raw socket.  The echo id is then
+           picked by the kernel, where it does so.  ICMP errors are read from the socket's error
+           queue, where supported, otherwise the probes that drew them time out.
+    socket_filter: on a raw socket, attach a BPF filter so the kernel drops ICMP traffic that
+                   isn't ours.  Foreign replies with other ids are then never seen or counted.
+    keep_results: keep every per-probe result dict in cell.results.  Otherwise only the running
+                  cell.tally is kept and memory does not grow with the number of probes.
+    keep_times: keep every ping time in cell.tally.times, for analysis.
+    family: socket.AF_INET6 to sweep IPv6 hosts with ICMPv6, default IPv4.  A given sock must be
+            of the same family.
+    counters: EngineCounters to add packets sent and received to, default a new set.
+    probe_callback: function called with (cell, result) for every probe as soon as its outcome is
+                    known, such as to stream it out with writers.probe_record().
+    in_flight: inflight.InFlightTable to carry over from an earlier run on the same socket, such
+               as a SocketManager's table, so that replies to its probes coming in late are still
+               recognized.  Default a new one.
+    hosts: dict of address to Host to carry over from an earlier run, so that each host's RTT
+           estimate for adaptive timeouts carries on.  Default a new one.
+    keep_cells: keep every cell in self.cells, to be returned by run().  False to let go of each
+                cell once it is done and handed to the callback, and of its Host once it has no
+                cells left, unless hosts was given.  Memory then follows the hosts being swept
+                rather than the whole target list, and run() returns only unfinished cells.
+    """
+    def __init__(self, timeout=None, time_pause=None, max_in_flight=None, pid=None, sock=None,
+                 batch_size=None, kernel_timestamps=False, dgram=False, socket_filter=True,
+                 keep_results=False, keep_times=False, rate=None, target_rate=None,
+                 max_hosts=None, adaptive_timeout=False, min_timeout=None, stopping=None,
+                 family=None, counters=None, probe_callback=None, in_flight=None, hosts=None,
+                 keep_cells=True):
+        if not timeout:
+            timeout = DEFAULT_TIMEOUT
+
+        if not min_timeout:
+            min_timeout = 20.  # milliseconds
+
+        if time_pause is None:
+            time_pause = 5.  # milliseconds
+
+        if not max_in_flight:
+            max_in_flight = 4096
+
+        if not max_hosts:
+            max_hosts = 1024
+
+        if not pid:
+            pid = os.getpid()
+
+        if not family:
+            family = socket.AF_INET
+
+        if not counters:
+            counters = EngineCounters()
+
+        if in_flight is None:
+            in_flight = inflight.InFlightTable()
+
+        self.own_hosts = hosts is None
+        if hosts is None:
+            hosts = {}
+
+        if not batch_size or not batchio.is_supported():
+            batch_size = 1
+
+        self.timeout = timeout
+        self.adaptive_timeout = adaptive_timeout
+        self.min_timeout = min(min_timeout, timeout)
+        self.stopping = stopping
+        self.time_pause = time_pause
+        self.rate = rate
+        self.target_rate = target_rate
+        self.max_in_flight = min(max_in_flight, 0xffff)
+        self.max_hosts = max_hosts
+        self.pid = pid & 0xffff
+        self.batch_size = batch_size
+        self.kernel_timestamps = kernel_timestamps
+        self.dgram = dgram
+        self.socket_filter = socket_filter
+        self.keep_results = keep_results
+        self.keep_times = keep_times
+        self.family = family
+        self.counters = counters
+        self.probe_callback = probe_callback
+        self.keep_cells = keep_cells
+
+        # Raw ICMPv6 sockets never pass up the IP header.
+        self.ip_header = family == socket.AF_INET
+        self.ttl_default = None
+        self.ttl_current = None
+        self.ttl_control = False
+
+        self.sock = sock
+        self.batch = None
+        self.error_queue = None
+        self.cells = []
+        self.sources = collections.deque()
+        self.cell_index = {}
+        self.hosts = hosts
+
+        self.in_flight = in_flight
+        self.expiry = []
+        self._order = itertools.count()
+        self.outbox = []
+        self.pool = receive.BufferPool(count=1)
+
+
+
+    def add_target(self, host_name, host_addr, size_sweep, count_send=None, pattern=None,
+                   ttl=None):
+        """
+        Queue up probes for one host over a range of payload sizes.  Return the new cells.
+
+        pattern: payload fill pattern, default is random letters.
+        ttl: IP time to live for these probes, for traceroute.  On a datagram socket, time
+             exceeded errors only come through its error queue, see enable_error_queue().
+        """
+        if not count_send:
+            count_send = 25
+
+        host = self.hosts.get(host_addr)
+        if not host:
+            if self.adaptive_timeout:
+                host = Host(host_addr, rtt.RttEstimator(self.min_timeout, self.timeout))
+            else:
+                host = Host(host_addr)
+            self.hosts[host_addr] = host
+        elif not host.cells:
+            # Back for another run, only the RTT estimate carries over.
+            host.count_spare = 0
+
+        cells = []
+        for data_size in size_sweep:
+            cell = Cell(host_name, host_addr, data_size, count_send, pattern=pattern,
+                        keep_results=self.keep_results, keep_times=self.keep_times, ttl=ttl,
+                        family=self.family)
+            host.cells.append(cell)
+            host.count_live += 1
+            if ttl is None:
+                self.cell_index[(host_addr, data_size)] = cell
+            cells.append(cell)
+
+        self.cells.extend(cells)
+
+        # Done.
+        return cells
+
+
+
+    def add_source(self, targets, size_sweep, count_send=None, pattern=None):
+        """
+        Queue up a lazy source of hosts, an iterable of (host_name, host_addr).  Hosts are pulled
+        from it only as room opens up, at most max_hosts being swept at once, so the source may be
+        as long as a whole subnet.
+        """
+        self.sources.append((iter(targets), size_sweep, count_send, pattern))
+
+
+
+    def _refill(self, ready, time_now):
+        """
+        Top up the scheduler with new hosts from the sources.
+        """
+        while self.sources and len(ready) < self.max_hosts:
+            targets, size_sweep, count_send, pattern = self.sources[0]
+            try:
+                host_name, host_addr = next(targets)
+            except StopIteration:
+                self.sources.popleft()
+                continue
+
+            self.add_target(host_name, host_addr, size_sweep, count_send=count_send, pattern=pattern)
+
+            host = self.hosts[host_addr]
+            if host not in ready:
+                ready.add(host, time_now)
+
+
+
+    def run(self, callback=None):
+        """
+        Run until every queued probe has been answered or has timed out.
+
+        callback: optional function called with each Cell as soon as it is complete.
+        """
+        own_socket = self.sock is None
+        if own_socket:
+            self.sock = create_engine_socket(dgram=self.dgram, family=self.family)
+
+        if is_dgram(self.sock):
+            # Kernel owns the echo id, where it picks one, and strips the IP header from replies.
+            self.pid = socket_echo_id(self.sock) or self.pid
+            self.ip_header = False
+
+            # ICMP errors never come in with the replies, only through the error queue.
+            if enable_error_queue(self.sock):
+                self.error_queue = batchio.BatchSocket(self.sock, batch_size=self.batch_size,
+                                                       buf_size=256,
+                                                       control_size=receive.ERROR_CONTROL_SIZE)
+
+        elif self.socket_filter:
+            # Quietly carry on without it where not supported.
+            bpf.attach_filter(self.sock, bpf.echo_filter(self.pid, family=self.family))
+
+        # Kernel timestamps arrive as ancillary data, which needs the recvmmsg() path even when
+        # sending one packet at a time.  A batch read in user space would give all its replies the
+        # same receive time, so batches use kernel timestamps whether asked for or not.
+        if self.kernel_timestamps or self.batch_size > 1:
+            self.kernel_timestamps = batchio.is_supported() and timestamps.enable(self.sock)
+
+        if self.kernel_timestamps:
+            self.batch = batchio.BatchSocket(self.sock, batch_size=self.batch_size,
+                                             control_size=timestamps.CONTROL_SIZE)
+        elif self.batch_size > 1 or any(cell.ttl is not None for cell in self.cells):
+            # Traceroute probes carry their TTL with them, instead of a setsockopt() each.
+            self.batch = batchio.BatchSocket(self.sock, batch_size=self.batch_size)
+
+        self.ttl_control = self.batch is not None
+
+        if self.family == socket.AF_INET6:
+            self._ttl_option = socket.IPPROTO_IPV6, socket.IPV6_UNICAST_HOPS
+        else:
+            self._ttl_option = socket.IPPROTO_IP, socket.IP_TTL
+        self.ttl_default = self.ttl_current = self.sock.getsockopt(*self._ttl_option)
+
+        # A whole batch may go out at once within the global budget.
+        ready = scheduler.Scheduler(interval=self.time_pause / 1000., rate=self.rate,
+                                    target_rate=self.target_rate, burst=self.batch_size)
+        time_start = clock()
+        for host in self.hosts.values():
+            if host.cells:
+                ready.add(host, time_start)
+
+        try:
+            while ready or self.in_flight or self.outbox or self.sources:
+                time_now = clock()
+                self._refill(ready, time_now)
+
+                # Lost probes give up their in-flight slot before anything new is sent.
+                self._expire(time_now, callback)
+
+                if not (ready or self.in_flight or self.outbox):
+                    # Last probes timed out, or sources ran dry, nothing left to wait for.
+                    break
+
+                # Send as much as the schedule and the in-flight limit allow.
+                while len(self.in_flight) + len(self.outbox) < self.max_in_flight:
+                    host = ready.pop(time_now)
+                    if host is None:
+                        break
+
+                    self._queue_next(host)
+
+                    if host.cells:
+                        ready.push(host, time_now)
+                    else:
+                        ready.discard(host)
+
+                    if len(self.outbox) >= self.batch_size:
+                        if not self._flush():
+                            # Socket is full, try again after draining some replies.
+                            break
+
+                        # Read replies as they come in, a long burst of sends would otherwise
+                        # hold back their receive times.
+                        readable, _, _ = select.select([self.sock], [], [], 0)
+                        if readable:
+                            self._drain(callback)
+
+                self._flush()
+
+                if not (ready or self.in_flight or self.outbox or self.sources):
+                    # Last replies were read between sends, nothing left to wait for.
+                    break
+
+                # Sleep until next reply, next scheduled send, or next expiry, whichever comes first.
+                time_wake = []
+                if self.outbox:
+                    time_wake.append(time_now)
+                elif self.sources and len(ready) < self.max_hosts:
+                    # Replies read between sends may have made room for more hosts already.
+                    time_wake.append(time_now)
+                elif ready and len(self.in_flight) < self.max_in_flight:
+                    time_wake.append(ready.time_next())
+                if self.expiry:
+                    time_wake.append(self.expiry[0][0])
+
+                if time_wake:
+                    wait = max(min(time_wake) - clock(), 0.)
+                else:
+                    wait = None
+
+                readable, _, _ = select.select([self.sock], [], [], wait)
+                if readable:
+                    self._drain(callback)
+
+        finally:
+            self.batch = None
+            if own_socket:
+                self.sock.close()
+                self.sock = None
+            else:
+                # Shared socket, leave it the way it was found.
+                self._set_ttl(None)
+
+        # Done.
+        return self.cells
+
+
+
+    def _queue_next(self, host):
+        """
+        Queue the next probe for this host, rotating over its cells.
+        """
+        cell = host.cells[0]
+        seq = self.in_flight.next_seq(self.pid)
+
+        probe = Probe(cell, host, seq, len(cell.template), None, None)
+        self.outbox.append(probe)
+
+        cell.count_queued += 1
+        host.cells.rotate(-1)
+        if not self._keep_sampling(host, cell):
+            host.cells.remove(cell)
+
+
+
+    def _keep_sampling(self, host, cell):
+        """
+        Decide whether a cell gets another probe after the one just queued.
+        """
+        if not self.stopping:
+            return cell.count_queued < cell.count_send
+
+        count = cell.count_queued
+        if count < min(self.stopping.min_count, cell.count_budget):
+            return True
+
+        if count >= self.stopping.max_factor * cell.count_budget:
+            cell.count_send = count
+            return False
+
+        if self.stopping.is_converged(cell.tally):
+            # Whatever is in flight is all this cell gets, the rest goes to the spare pool.
+            host.count_spare += max(cell.count_send - count, 0)
+            cell.count_send = count
+            return False
+
+        if count < cell.count_send:
+            return True
+
+        if host.count_spare:
+            host.count_spare -= 1
+            cell.count_send += 1
+            return True
+
+        # Done.
+        return False
+
+
+
+    def _flush(self):
+        """
+        Send queued probes, in batches where supported.  Return False if the socket filled up
+        before everything went out.
+        """
+        while self.outbox:
+            if self.ttl_control:
+                # Each packet carries its own TTL.
+                probes = self.outbox[:self.batch_size]
+            else:
+                # TTL is set on the socket, so each call only sends probes sharing the first one's
+                # TTL.  They are picked from the whole outbox, a host rotates over its hops.
+                ttl = self.outbox[0].cell.ttl
+                probes = [probe for probe in self.outbox if probe.cell.ttl == ttl]
+                del probes[self.batch_size:]
+                self._set_ttl(ttl)
+
+            # Send times are taken as late as possible, right before the packets go to the kernel.
+            # Probes sent in one call share a send time.
+            if self.batch:
+                for k, probe in enumerate(probes):
+                    cell = probe.cell
+                    self.batch.stage(k, cell.template.patch(self.pid, probe.seq), cell.host_addr,
+                                     ttl=cell.ttl if self.ttl_control else None)
+
+                time_send = clock()
+                try:
+                    num_sent = self.batch.send_staged(len(probes))
+                except socket.error as e:
+                    if self.error_queue and e.errno in ICMP_ERRNOS:
+                        # Only says an earlier probe's error is queued, nothing went out.  Read
+                        # it and try again, same as for a full socket.
+                        num_sent = 0
+                    elif e.errno != errno.EINVAL or not self.ttl_control:
+                        raise
+                    else:
+                        # Older kernels take no TTL with the packet, set it on the socket instead.
+                        self.ttl_control = False
+                        continue
+
+                for probe in probes[:num_sent]:
+                    self._sent(probe, time_send)
+
+            else:
+                num_sent = 0
+                for probe in probes:
+                    cell = probe.cell
+                    packet = cell.template.patch(self.pid, probe.seq)
+                    try:
+                        time_send = clock()
+                        self.sock.sendto(packet, (cell.host_addr, 0))
+                    except socket.error as e:
+                        if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK, errno.ENOBUFS):
+                            break
+                        if self.error_queue and e.errno in ICMP_ERRNOS:
+                            break
+                        raise
+
+                    self._sent(probe, time_send)
+                    num_sent += 1
+
+            if self.ttl_control:
+                del self.outbox[:num_sent]
+            elif num_sent:
+                sent = set(id(probe) for probe in probes[:num_sent])
+                self.outbox = [probe for probe in self.outbox if id(probe) not in sent]
+            self.counters.count_sent += num_sent
+            if num_sent < len(probes):
+                return False
+
+        # Done.
+        return True
+
+
+
+    def _set_ttl(self, ttl):
+        """
+        Set the socket's IP time to live, or IPv6 hop limit, None for the default it had when the
+        run started.
+        """
+        if ttl is None:
+            ttl = self.ttl_default
+
+        if ttl != self.ttl_current:
+            level, option = self._ttl_option
+            self.sock.setsockopt(level, option, ttl)
+            self.ttl_current = ttl
+
+
+
+    def _sent(self, probe, time_send):
+        """
+        Probe is on its way, start waiting for the reply.
+        """
+        host = probe.host
+        if host.rtt:
+            probe.timeout = host.rtt.timeout
+        else:
+            probe.timeout = self.timeout
+
+        probe.time_send = time_send
+        probe.deadline = time_send + probe.timeout / 1000.
+        self.in_flight.add((self.pid, probe.seq), probe)
+        heapq.heappush(self.expiry, (probe.deadline, next(self._order), probe))
+
+
+
+    def _expire(self, time_now, callback):
+        """
+        Declare lost every probe whose deadline has passed.
+        """
+        while self.expiry and self.expiry[0][0] <= time_now:
+            deadline, order, probe = heapq.heappop(self.expiry)
+            key = (self.pid, probe.seq)
+            if self.in_flight.get(key) is probe:
+                self.in_flight.expire(key)
+
+                if probe.host.rtt:
+                    probe.host.rtt.backoff()
+
+                self._finish(probe, None, False, None, callback)
+
+
+
+    def _drain(self, callback):
+        """
+        Read every packet currently waiting on the socket and match replies to probes.  Then any
+        ICMP errors queued up on a datagram socket.
+        """
+        if self.batch:
+            self._drain_batch(callback)
+        else:
+            self._drain_single(callback)
+
+        if self.error_queue:
+            self._drain_errors(callback)
+
+
+
+    def _drain_batch(self, callback):
+        """
+        Read replies a batch at a time with recvmmsg().
+        """
+        while True:
+            try:
+                num_recv = self.batch.recv_batch()
+            except socket.error as e:
+                if self.error_queue and e.errno in ICMP_ERRNOS:
+                    # Only says an error is queued, it is read below.
+                    continue
+                raise
+
+            time_batch = clock()
+            if self.kernel_timestamps:
+                offset = timestamps.realtime_offset()
+
+            for k in range(num_recv):
+                time_recv = time_batch
+                if self.kernel_timestamps:
+                    time_kernel = timestamps.parse_control(self.batch.control(k))
+                    if time_kernel:
+                        time_recv = time_kernel - offset
+
+                # Without an IP header the sender is only known from the socket address.
+                if self.ip_header:
+                    source = None
+                else:
+                    source = self.batch.source(k)
+
+                size = self._handle_reply(self.batch.buffers[k], self.batch.length(k), time_recv,
+                                          callback, source)
+                if size is not None:
+                    self._foreign(source or self.batch.source(k), size)
+
+            self.counters.count_recv += num_recv
+            self.counters.time_parse += clock() - time_batch
+
+            if num_recv < self.batch_size:
+                break
+
+
+
+    def _drain_single(self, callback):
+        """
+        Read replies one at a time.
+        """
+        buf = self.pool.acquire()
+        try:
+            while True:
+                try:
+                    nbytes, addr = self.sock.recvfrom_into(buf)
+                except socket.error as e:
+                    if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                        break
+                    if self.error_queue and e.errno in ICMP_ERRNOS:
+                        continue
+                    raise
+                time_recv = clock()
+
+                size = self._handle_reply(buf, nbytes, time_recv, callback, addr[0])
+                if size is not None:
+                    self._foreign(addr[0], size)
+
+                self.counters.count_recv += 1
+                self.counters.time_parse += clock() - time_recv
+
+        finally:
+            self.pool.release(buf)
+
+
+
+    def _drain_errors(self, callback):
+        """
+        Read the ICMP errors queued up on a datagram socket, where the kernel puts them instead of
+        passing them up with the replies.
+        """
+        queue = self.error_queue
+        while True:
+            num_recv = queue.recv_batch(errqueue=True)
+            time_recv = clock()
+
+            for k in range(num_recv):
+                error = receive.parse_error_queue(queue.buffers[k], queue.length(k),
+                                                  queue.control(k), family=self.family)
+                if error:
+                    # Whoever sent the error, e.g. the hop where a traceroute probe's TTL ran out.
+                    self._handle_error(error[:4], None, time_recv, callback, source=error[4])
+
+            self.counters.count_recv += num_recv
+
+            if num_recv < queue.batch_size:
+                break
+
+
+
+    def _handle_reply(self, buf, nbytes, time_recv, callback, source=None):
+        """
+        Match one received packet to its probe.  Returns the payload size of a foreign echo reply
+        so the caller can look up where it came from, otherwise None.
+
+        source: sender's address, where known.
+        """
+        reply = receive.parse_echo_reply(buf, nbytes, ip_header=self.ip_header, family=self.family)
+        if not reply:
+            error = receive.parse_icmp_error(buf, nbytes, ip_header=self.ip_header,
+                                             family=self.family)
+            if error:
+                self._handle_error(error, buf, time_recv, callback, source)
+            return None
+        echo_id, echo_seq, offset, size = reply
+
+        status, probe = self.in_flight.match((echo_id, echo_seq))
+        if status == inflight.LATE:
+            probe.cell.tally.count_late += 1
+
+            # Came back after all, the timeout for this host was too short.  The probe holds on
+            # to its own cell and host, so this still counts after both have been let go of.
+            if probe.host.rtt:
+                probe.host.rtt.sample((time_recv - probe.time_send) * 1000.)
+            return None
+        elif status == inflight.DUPLICATE:
+            probe.cell.tally.count_duplicate += 1
+            return None
+        elif status == inflight.FOREIGN:
+            return size
+
+        template = probe.cell.template
+        is_same_data = (size == template.data_size and
+                        receive.payload_digest(buf, offset, size) == template.digest)
+        time_ping = (time_recv - probe.time_send) * 1000.    # convert from seconds to milliseconds
+
+        if probe.host.rtt:
+            probe.host.rtt.sample(time_ping)
+
+        if probe.cell.ttl is None:
+            hop_addr = None
+        else:
+            hop_addr = probe.cell.host_addr
+
+        self._finish(probe, time_ping, is_same_data, echo_id, callback, hop_addr=hop_addr)
+
+        # Done.
+        return None
+
+
+
+    def _handle_error(self, error, buf, time_recv, callback, source=None):
+        """
+        An ICMP error quoting one of our probes still waiting for its reply.  No reply is coming,
+        finish the probe now rather than wait for it to time out.  For a traceroute probe, time
+        exceeded is the reply, from the hop where its TTL ran out.
+        """
+        icmp_type, icmp_code, echo_id, echo_seq = error
+
+        key = (echo_id, echo_seq)
+        if key not in self.in_flight:
+            return
+
+        status, probe = self.in_flight.match(key)
+
+        if probe.cell.ttl is None:
+            hop_addr = None
+        elif self.ip_header:
+            hop_addr = socket.inet_ntoa(bytes(buf[12:16]))
+        else:
+            hop_addr = source
+
+        if probe.cell.ttl is not None and receive.is_time_exceeded(icmp_type, self.family):
+            # Router quotes only the first few bytes of the payload, take it as intact.  The hop's
+            # times say nothing about the host's, so they are left out of its timeout.
+            time_ping = (time_recv - probe.time_send) * 1000.
+            self._finish(probe, time_ping, True, echo_id, callback, hop_addr=hop_addr)
+            return
+
+        self._finish(probe, None, False, None, callback,
+                     error=receive.error_name(icmp_type, icmp_code, self.family), hop_addr=hop_addr)
+
+
+
+    def _foreign(self, host_addr, size):
+        """
+        Not one of ours.  Pin it on a cell if it looks like it came from one of our targets.
+        Late and duplicate replies never get here, they are credited through their own probe,
+        released cell or not.
+        """
+        cell = self.cell_index.get((host_addr, size))
+        if cell:
+            cell.tally.count_foreign += 1
+
+
+
+    def _finish(self, probe, time_ping, is_same_data, echo_id, callback, error=None,
+                hop_addr=None):
+        """
+        Record outcome of one probe in the same form as ping_once().
+
+        error: description of the ICMP error that came back instead of a reply.
+        hop_addr: address that answered a traceroute probe.
+        """
+        cell = probe.cell
+        result = {'time_ping': time_ping,
+                  'data_size': cell.data_size,
+                  'packet_size': probe.packet_size,
+                  'timeout': probe.timeout,
+                  'is_same_data': is_same_data,
+                  'id': self.pid,
+                  'echo_id': echo_id,
+                  'seq': probe.seq,
+                  'error': error}
+
+        if cell.ttl is not None:
+            result['ttl'] = cell.ttl
+            result['hop_addr'] = hop_addr
+            if hop_addr:
+                cell.hop_addrs[hop_addr] += 1
+
+        cell.tally.add_result(result)
+        if cell.results is not None:
+            cell.results.append(result)
+
+        if self.probe_callback:
+            self.probe_callback(cell, result)
+
+        if cell.is_done:
+            if callback:
+                callback(cell)
+            if not self.keep_cells:
+                self._release(cell)
+
+
+
+    def _release(self, cell):
+        """
+        Let go of a finished cell, and of its host once nothing is left for it.
+        """
+        key = (cell.host_addr, cell.data_size)
+        if self.cell_index.get(key) is cell:
+            del self.cell_index[key]
+
+        self.cells.remove(cell)
+
+        host = self.hosts.get(cell.host_addr)
+        if host:
+            host.count_live -= 1
+            if not host.count_live and self.own_hosts:
+                del self.hosts[cell.host_addr]
@@ -0,0 +1,344 @@
+#!/usr/bin/env python
+
+#
+# Copyright 2011 Pierre V. Villeneuve
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+
+"""
+Prometheus metrics for long running sweeps.
+
+MetricsExporter keeps a running total for every (host, size) and renders them in the Prometheus
+text exposition format, which OpenMetrics scrapers read as well:
+
+    ping_sweep_rtt_seconds              histogram of ping times
+    ping_sweep_probes_sent_total        probes sent
+    ping_sweep_probes_lost_total        probes lost, by reason: timeout, corrupt or error
+
+plus the engine's own in-flight probe count, send rate, packets handled and time spent parsing
+them.  Each series' text is kept from one scrape to the next and only redone for the series that
+changed since.  Series are joined up in blocks, again only redone where something changed, and
+the blocks are written out as they are, so a scrape over tens of thousands of series is mostly
+the socket write.
+
+Histogram buckets are made from the Tally's log-bucketed histogram, each of its buckets counted
+under the first bound at or above its middle.  Counts near a bound may land one bucket off, by
+no more than the histogram's precision.
+"""
+
+from __future__ import division, print_function #, unicode_literals
+
+import threading
+
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+except ImportError:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+
+import accumulator
+import engine
+
+
+BUCKETS = (0.1, 0.25, 0.5, 1., 2.5, 5., 10., 25., 50., 100., 250., 500., 1000., 2500.)  # ms
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+BLOCK = 256   # series per block of rendered text.
+
+# Metric families with a line per (host, size), in the order rendered.
+SERIES_METRICS = (('ping_sweep_rtt_seconds', 'histogram', 'Ping round trip times.'),
+                  ('ping_sweep_probes_sent_total', 'counter', 'Probes sent.'),
+                  ('ping_sweep_probes_lost_total', 'counter',
+                   'Probes lost, by reason: timeout, corrupt reply or ICMP error.'))
+
+
+#################################################
+
+def escape(value):
+    """
+    Label value with backslashes, double quotes and newlines escaped.
+    """
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+
+def header(name, kind, text):
+    """
+    HELP and TYPE lines for one metric family.
+    """
+    return '# HELP {0} {1}\n# TYPE {0} {2}\n'.format(name, text, kind)
+
+
+
+def bucket_counts(histogram, bounds):
+    """
+    Cumulative counts at or below each bound, in the same units, for an accumulator.LogHistogram.
+    """
+    counts = [0] * len(bounds)
+
+    k_bound = 0
+    seen = 0
+    for k in sorted(histogram.counts):
+        value = histogram.value(k)
+        while k_bound < len(bounds) and bounds[k_bound] < value:
+            counts[k_bound] = seen
+            k_bound += 1
+        seen += histogram.counts[k]
+
+    while k_bound < len(bounds):
+        counts[k_bound] = seen
+        k_bound += 1
+
+    # Done.
+    return counts
+
+#################################################
+
+
+class MetricsExporter(object):
+    """
+    Running totals per (host, size), rendered for Prometheus.  Tallies may be added from the
+    sweep's thread while scrapes come in on others.
+
+    buckets: histogram bucket bounds, milliseconds.
+    """
+    def __init__(self, buckets=None):
+        if not buckets:
+            buckets = BUCKETS
+
+        self.buckets = tuple(sorted(buckets))
+        self._bounds = ['{:g}'.format(bound / 1000.) for bound in self.buckets] + ['+Inf']
+
+        self.series = {}
+        self.order = []
+        self.position = {}
+        self.dirty = set()
+        self.lock = threading.Lock()
+
+        # Rendered text for each metric family, per series and joined up in blocks of series.
+        # Only touched by render(), one scrape at a time.
+        self.chunks = dict((name, {}) for name, kind, text in SERIES_METRICS)
+        self.blocks = dict((name, []) for name, kind, text in SERIES_METRICS)
+        self._render_lock = threading.Lock()
+
+        self.sweep = None
+        self._rate_mark = None
+
+    def __len__(self):
+        return len(self.series)
+
+
+
+    def add(self, key, tally):
+        """
+        Add a finished Tally to the running total for key, a (host_name, data_size).
+        """
+        with self.lock:
+            total = self.series.get(key)
+            if total is None:
+                total = self.series[key] = accumulator.Tally()
+                self.position[key] = len(self.order)
+                self.order.append(key)
+
+            total.merge(tally)
+            self.dirty.add(key)
+
+
+
+    def watch(self, sweep):
+        """
+        Report on this SweepEngine's in-flight probes and counters, such as the current round of
+        a monitor.
+        """
+        self.sweep = sweep
+
+
+
+    def _render_series(self, key, tally):
+        """
+        Text for one series, one string per metric family.
+        """
+        host_name, data_size = key
+        labels = 'host="{:s}",size="{:d}"'.format(escape(host_name), data_size)
+
+        acc = tally.accumulator
+        counts = bucket_counts(acc.histogram, self.buckets) + [acc.count]
+
+        template = 'ping_sweep_rtt_seconds_bucket{{{:s},le="{:s}"}} {:d}\n'
+        lines = [template.format(labels, bound, count)
+                 for bound, count in zip(self._bounds, counts)]
+
+        time_sum = acc.mean * acc.count / 1000.
+        lines.append('ping_sweep_rtt_seconds_sum{{{:s}}} {!r}\n'.format(labels, time_sum))
+        lines.append('ping_sweep_rtt_seconds_count{{{:s}}} {:d}\n'.format(labels, acc.count))
+
+        sent = 'ping_sweep_probes_sent_total{{{:s}}} {:d}\n'.format(labels, tally.count_send)
+
+        template = 'ping_sweep_probes_lost_total{{{:s},reason="{:s}"}} {:d}\n'
+        lost = ''.join(template.format(labels, reason, count)
+                       for reason, count in (('timeout', tally.count_timeout),
+                                             ('corrupt', tally.count_corrupt),
+                                             ('error', tally.count_error)))
+
+        # Done.
+        return ''.join(lines), sent, lost
+
+
+
+    def _render_engine(self, time_now):
+        """
+        Text for the engine's own metrics.
+        """
+        sweep = self.sweep
+        if sweep is None:
+            return ''
+
+        counters = sweep.counters
+
+        # Send rate since the previous scrape, starting over if the counters were swapped.
+        rate = 0.
+        if self._rate_mark and self._rate_mark[0] is counters:
+            time_last, count_last = self._rate_mark[1:]
+            if time_now > time_last:
+                rate = (counters.count_sent - count_last) / (time_now - time_last)
+        self._rate_mark = counters, time_now, counters.count_sent
+
+        metrics = (('ping_sweep_engine_in_flight', 'gauge', 'Probes waiting for a reply.',
+                    len(sweep.in_flight)),
+                   ('ping_sweep_engine_send_rate', 'gauge',
+                    'Packets per second sent since the previous scrape.', rate),
+                   ('ping_sweep_engine_sent_packets_total', 'counter', 'Packets sent.',
+                    counters.count_sent),
+                   ('ping_sweep_engine_received_packets_total', 'counter', 'Packets received.',
+                    counters.count_recv),
+                   ('ping_sweep_engine_parse_seconds_total', 'counter',
+                    'Time spent matching received packets to probes.', counters.time_parse))
+
+        # Done.
+        return ''.join(header(name, kind, text) + '{:s} {!r}\n'.format(name, value)
+                       for name, kind, text, value in metrics)
+
+
+
+    def render_parts(self, time_now=None):
+        """
+        Every metric in the Prometheus text format, as a list of strings to be written out one
+        after the other.  Only the series that changed since the last call are rendered again.
+
+        time_now: engine.clock() time, for the send rate.
+        """
+        if time_now is None:
+            time_now = engine.clock()
+
+        with self._render_lock:
+            with self.lock:
+                dirty = self.dirty
+                self.dirty = set()
+                order = list(self.order)
+                stale = set(self.position[key] // BLOCK for key in dirty)
+
+            # Lock taken per series, so adding tallies is never held up for long.
+            for key in dirty:
+                with self.lock:
+                    texts = self._render_series(key, self.series[key])
+
+                for (name, kind, text), chunk in zip(SERIES_METRICS, texts):
+                    self.chunks[name][key] = chunk
+
+            parts = []
+            for name, kind, text in SERIES_METRICS:
+                chunks = self.chunks[name]
+                blocks = self.blocks[name]
+                for index in sorted(stale):
+                    while len(blocks) <= index:
+                        blocks.append('')
+                    keys = order[index*BLOCK:(index + 1)*BLOCK]
+                    blocks[index] = ''.join(chunks[key] for key in keys)
+
+                parts.append(header(name, kind, text))
+                parts.extend(blocks)
+
+            parts.append(self._render_engine(time_now))
+
+        # Done.
+        return parts
+
+
+
+    def render(self, time_now=None):
+        """
+        Every metric in the Prometheus text format, as one string.
+        """
+        return ''.join(self.render_parts(time_now))
+
+#################################################
+
+
+class _Handler(BaseHTTPRequestHandler):
+    """
+    Serve the exporter's metrics at /metrics.
+    """
+    def do_GET(self):
+        if self.path.split('?', 1)[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+
+        parts = [part if isinstance(part, bytes) else part.encode('utf-8')
+                 for part in self.server.exporter.render_parts()]
+
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(sum(len(part) for part in parts)))
+        self.end_headers()
+        for part in parts:
+            self.wfile.write(part)
+
+    def log_message(self, format, *args):
+        # Scrapes come every few seconds, keep them off the console.
+        pass
+
+
+
+class MetricsServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, exporter, address):
+        HTTPServer.__init__(self, address, _Handler)
+        self.exporter = exporter
+
+
+
+def start_server(exporter, port, host=None):
+    """
+    Serve an exporter's metrics over HTTP from a background thread.  Returns the MetricsServer,
+    call its shutdown() to stop.  Port 0 picks a free port, see server.server_address.
+
+    host: address to listen on, default every interface.
+    """
+    if not host:
+        host = ''
+
+    server = MetricsServer(exporter, (host, port))
+
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+
+    # Done.
+    return server
@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+
+#
+# Copyright 2011 Pierre V. Villeneuve
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Table of echo requests in flight on one socket, keyed by (icmp id, seq).
+"""
+
+from __future__ import division, print_function #, unicode_literals
+
+import collections
+import random
+
+
+# Reply classifications.
+MATCHED = 'matched'      # first reply to a probe still waiting for one
+LATE = 'late'            # reply to a probe already declared lost
+DUPLICATE = 'duplicate'  # another reply to a probe already answered
+FOREIGN = 'foreign'      # not ours, or never sent
+
+
+class InFlightTable(object):
+    """
+    Keep track of unanswered echo requests, plus a bounded memory of recently finished ones so
+    that stray replies can be told apart.
+
+    Entries are whatever the caller wants to attach to a probe, typically something holding the
+    send time.
+
+    history: number of finished probes to remember.  The default covers the whole 16 bit
+    sequence number space for one id.
+    """
+    def __init__(self, history=None):
+        if not history:
+            history = 0x10000
+
+        self.history = history
+
+        self.pending = {}
+        self.finished = collections.OrderedDict()
+        self.seq = random.randint(0, 0xffff)
+
+        self.count_late = 0
+        self.count_duplicate = 0
+        self.count_foreign = 0
+
+    def __len__(self):
+        return len(self.pending)
+
+    def __contains__(self, key):
+        return key in self.pending
+
+
+
+    def next_seq(self, pid):
+        """
+        Next sequence number for this id that is not attached to an unanswered probe.
+        """
+        while True:
+            self.seq = (self.seq + 1) & 0xffff
+            if (pid, self.seq) not in self.pending:
+                return self.seq
+
+
+
+    def add(self, key, entry):
+        """
+        Register a probe that was just sent.
+        """
+        self.finished.pop(key, None)
+        self.pending[key] = entry
+
+
+
+    def get(self, key):
+        """
+        Return entry for an unanswered probe, or None.
+        """
+        return self.pending.get(key)
+
+
+
+    def match(self, key):
+        """
+        Classify a reply carrying this (id, seq).  Returns (status, entry).  The entry is None for
+        foreign replies.
+        """
+        entry = self.pending.pop(key, None)
+        if entry is not None:
+            self._remember(key, entry, MATCHED)
+            return MATCHED, entry
+
+        if key not in self.finished:
+            self.count_foreign += 1
+            return FOREIGN, None
+
+        entry, status = self.finished[key]
+        if status is None:
+            # Declared lost, answered after the fact.  Anything more is a duplicate.
+            status = LATE
+            self.finished[key] = (entry, status)
+            self.count_late += 1
+        else:
+            status = DUPLICATE
+            self.count_duplicate += 1
+
+        # Done.
+        return status, entry
+
+
+
+    def expire(self, key):
+        """
+        Declare a probe lost.  Returns its entry, or None if it was not pending.
+        """
+        entry = self.pending.pop(key, None)
+        if entry is not None:
+            self._remember(key, entry, None)
+
+        # Done.
+        return entry
+
+
+
+    def _remember(self, key, entry, status):
+        self.finished[key] = (entry, status)
+        while len(self.finished) > self.history:
+            self.finished.popitem(last=False)
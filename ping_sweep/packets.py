@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+
+#
+# Copyright 2011 Pierre V. Villeneuve
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Pre-built ICMP echo request packets.
+
+A template holds a complete packet in a preallocated bytearray.  Sending another probe only
+patches the id and seq fields and updates the checksum incrementally (RFC 1624), so the cost per
+probe does not depend on the payload size.
+
+ICMPv6 echo requests are built the same way, but their checksum covers a pseudo header with the
+source address, which only the kernel knows.  It is left for the kernel to fill in.
+"""
+
+from __future__ import division, print_function #, unicode_literals
+
+import random
+import socket
+import struct
+
+import dpkt
+
+import receive
+
+
+ICMP_HEADER_SIZE = 8
+
+
+#################################################
+
+def make_payload(data_size, pattern=None):
+    """
+    Make a payload of the requested size.  Default is a random sequence of upper case letters,
+    otherwise the pattern string is repeated to fill.
+    """
+    if pattern is None:
+        payload = bytearray(random.randint(65, 65+25) for k in range(data_size))
+    else:
+        count = data_size // len(pattern) + 1
+        payload = bytearray(pattern * count)[:data_size]
+
+    # Done.
+    return bytes(payload)
+
+
+
+def cksum_update(cksum, old, new):
+    """
+    Incremental update of an Internet checksum after one 16 bit word changes from old to new.
+    RFC 1624, eqn. 3: HC' = ~(~HC + ~m + m')
+    """
+    s = (~cksum & 0xffff) + (~old & 0xffff) + new
+    s = (s & 0xffff) + (s >> 16)
+    s = (s & 0xffff) + (s >> 16)
+
+    # Done.
+    return ~s & 0xffff
+
+#################################################
+
+
+class PacketTemplate(object):
+    """
+    ICMP echo request for one (size, pattern) combination, stored in a preallocated bytearray.
+
+    The buffer is patched in place by each call to patch(), so send it before patching again.
+
+    checksum: fill in the checksum.  False to leave it zero for the kernel, as for ICMPv6.
+    """
+    def __init__(self, data_size, pattern=None, icmp_type=None, checksum=True):
+        if icmp_type is None:
+            icmp_type = dpkt.icmp.ICMP_ECHO
+
+        self.data_size = data_size
+        self.pattern = pattern
+        self.payload = make_payload(data_size, pattern)
+        self.digest = receive.payload_digest(self.payload)
+
+        self.packet = bytearray(ICMP_HEADER_SIZE + data_size)
+        struct.pack_into('>BBHHH', self.packet, 0, icmp_type, 0, 0, 0, 0)
+        self.packet[ICMP_HEADER_SIZE:] = self.payload
+
+        # Full checksum just once, with id and seq both zero.
+        self.id = 0
+        self.seq = 0
+        self.checksum = checksum
+        if checksum:
+            self.cksum = dpkt.in_cksum(bytes(self.packet))
+        else:
+            self.cksum = 0
+        struct.pack_into('>H', self.packet, 2, self.cksum)
+
+    def __len__(self):
+        return len(self.packet)
+
+
+
+    def patch(self, pid, seq):
+        """
+        Set id and seq, update checksum to match.  Returns the packet buffer.
+        """
+        cksum = self.cksum
+        if self.checksum:
+            cksum = cksum_update(cksum, self.id, pid)
+            cksum = cksum_update(cksum, self.seq, seq)
+
+        struct.pack_into('>HHH', self.packet, 2, cksum, pid, seq)
+
+        self.cksum = cksum
+        self.id = pid
+        self.seq = seq
+
+        # Done.
+        return self.packet
+
+#################################################
+
+
+_templates = {}
+
+def get_template(data_size, pattern=None, family=None):
+    """
+    Return the cached template for this payload size and pattern, building it the first time.
+
+    family: socket.AF_INET6 for an ICMPv6 echo request, default IPv4.
+    """
+    is_ipv6 = family == socket.AF_INET6
+    key = (data_size, pattern, is_ipv6)
+
+    template = _templates.get(key)
+    if template is None:
+        if is_ipv6:
+            template = PacketTemplate(data_size, pattern=pattern,
+                                      icmp_type=dpkt.icmp6.ICMP6_ECHO_REQUEST, checksum=False)
+        else:
+            template = PacketTemplate(data_size, pattern=pattern)
+        _templates[key] = template
+
+    # Done.
+    return template
@@ -24,13 +24,29 @@ Perform a sequence of pings over a range of payload sizes
 from __future__ import division, print_function #, unicode_literals
 
 import argparse
+import errno
+import itertools
 import os
-import sys
 import time
 import socket
-import random
-
-import dpkt
+import select
+
+import accumulator
+import batchio
+import dnscache
+import engine
+import exporter
+import inflight
+import packets
+import pmtu
+import receive
+import rolling
+import rtt
+import shards
+import stopping
+import targets
+import timestamps
+import writers
 
 
 #################################################
@@ -98,31 +114,33 @@ class PingSweepNameError(PingSweepError):
 
 #################################################
 
-def create_socket(host_name, timeout=None):
+def create_socket(host_name, timeout=None, dgram=False, family=None):
     """
     Make the socket and connect to remote host.
 
     NOTE: This function requires the user to be running as admin or root since
-    we are creating a raw socket.
+    we are creating a raw socket, unless dgram is set.
 
     timeout: seconds
+    dgram: use an unprivileged ICMP datagram socket (Linux).
+    family: socket.AF_INET6 for an ICMPv6 socket to an IPv6 host, default IPv4.
     """
     if not timeout:
         timeout = 1.0  # seconds.
 
     # Make the socket.
-    s_family = socket.AF_INET
-    s_type = socket.SOCK_RAW
-    s_proto = dpkt.ip.IP_PROTO_ICMP
-
-    sock = socket.socket(s_family, s_type, s_proto)
+    sock = engine.create_engine_socket(dgram=dgram, family=family)
     sock.setblocking(True)
     sock.settimeout(timeout)
 
     # Connect to remote host.  This will raise socket.error if can't resolve name.
     try:
-        host_addr = socket.gethostbyname(host_name)
-        port = 1  # dummy value
+        if family == socket.AF_INET6:
+            host_addr = socket.getaddrinfo(host_name, None, family, socket.SOCK_RAW)[0][4][0]
+            port = 0  # raw ICMPv6 sockets only take zero or the protocol number.
+        else:
+            host_addr = socket.gethostbyname(host_name)
+            port = 1  # dummy value
     except socket.error:
         raise PingSweepNameError('Unable to create socket with name: {:s}'.format(host_name))
 
@@ -132,32 +150,18 @@ def create_socket(host_name, timeout=None):
     return sock
 
 
-def create_packet(pid, seq, data_size):
-    """
-    Create a data packet from scratch.  Stored as a string.
+def create_packet(pid, seq, data_size, pattern=None):
     """
+    Return payload and ICMP echo request packet for this id and seq.
 
-    # Random sequence of characters.
-    payload = ''
-    for k in range(data_size):
-        payload += chr(random.randint(65, 65+25))
-
-    # Build the ICMP echo payload.
-    echo = dpkt.icmp.ICMP.Echo()
-    echo.id = pid
-    echo.seq = seq
-    echo.data = payload
-
-    # Build the ICMP packet.
-    icmp = dpkt.icmp.ICMP()
-    icmp.type = dpkt.icmp.ICMP_ECHO
-    icmp.data = echo
-
-    # Return data packet as string representation.
-    packet = str(icmp)
+    The packet comes from a cached template and is only patched in place, so it is good until the
+    next call for the same payload size and pattern.
+    """
+    template = packets.get_template(data_size, pattern=pattern)
+    packet = template.patch(pid, seq)
 
     # Done.
-    return payload, packet
+    return template.payload, packet
 
 
 
@@ -179,82 +183,175 @@ def send(sock, msg):
 
 def recv(sock, num_bytes):
     """
-    Receive message over socket.
+    Receive message over socket.  Reads straight into one preallocated buffer.
     """
-    msg = ''
-    while len(msg) < num_bytes:
-        msg_chunk = sock.recv(8192)
-        if msg_chunk == '':
+    msg = bytearray(num_bytes)
+    view = memoryview(msg)
+
+    num_recv = 0
+    while num_recv < num_bytes:
+        count = sock.recv_into(view[num_recv:])
+        if not count:
             raise RuntimeError('connection ended')
-        msg = msg + msg_chunk
+        num_recv += count
 
     # Done.
-    return msg
+    return bytes(msg)
 
 
 
-def ping_once(sock, data_size=None, pid=None):
+def ping_once(sock, data_size=None, pid=None, table=None, pool=None, host_addr=None, timeout=None,
+              kernel_timestamps=False, batch=None):
     """
     One ping, just one ping.
 
     sock = socket created by caller.
+    table = in-flight table belonging to the socket.  The reply is matched by (id, seq), and any
+            late, duplicate or foreign packets showing up in the meantime are counted there.
+    pool = receive buffer pool, default is one shared by all callers.
+    host_addr = destination address, for an unconnected socket such as from a SocketManager.
+    timeout = seconds to wait for the reply, default engine.DEFAULT_TIMEOUT.  The socket's own
+              timeout is not used, a SocketManager socket is non-blocking.
+    kernel_timestamps = take the receive time from the kernel (SO_TIMESTAMPNS) instead of from
+                        user space.  Linux only, quietly ignored elsewhere.
+    batch = batchio.BatchSocket over sock with timestamps already turned on, such as from
+            SocketManager.get_batch(), to receive with.  Implies kernel_timestamps.  Otherwise
+            one is set up on every call that asks for kernel timestamps.
     """
 
-    # from IPython import embed
-    # embed()
-
     if not data_size:
         data_size = 64
 
+    # Datagram sockets get their echo id from the kernel, and replies come without an IP header.
+    # ICMPv6 replies never come with one.
+    family = sock.family
+    is_dgram = engine.is_dgram(sock)
+    ip_header = family == socket.AF_INET and not is_dgram
+    if is_dgram:
+        pid = engine.socket_echo_id(sock) or pid
+
     if not pid:
-        pid = 1
+        pid = os.getpid() & 0xffff
+
+    if table is None:
+        table = inflight.InFlightTable()
+
+    if pool is None:
+        pool = receive.get_pool()
+
+    seq = table.next_seq(pid)
+    key = (pid, seq)
 
-    seq = 1999 # not really used here, but the TV show "Space 1999!"" was pretty awesome when I was a kid.
+    template = packets.get_template(data_size, family=family)
+    packet = template.patch(pid, seq)
 
-    payload, packet = create_packet(pid, seq, data_size)
+    # Kernel timestamps arrive as ancillary data, which needs recvmmsg().
+    if kernel_timestamps and not batch:
+        if batchio.is_supported() and timestamps.enable(sock):
+            batch = batchio.BatchSocket(sock, batch_size=1, control_size=timestamps.CONTROL_SIZE)
+
+    if batch:
+        buf = batch.buffers[0]
+    else:
+        buf = pool.acquire()
+
+    if not timeout:
+        timeout = engine.DEFAULT_TIMEOUT / 1000.   # seconds, not milliseconds.
+
+    is_same_data = False
+    time_ping = None
+    echo_id = None
+    error = None
 
     try:
-        # Send it, record the time.
-        send(sock, packet)
-        time_send = now()
-
-        # Wait and receive response, record the time.
-        # msg_recv = sock.recv(0xffff)
-        # msg_recv = sock.recv(4096)
-        # buf_size = 8192
-        # msg_recv = sock.recv(buf_size)
-        msg_recv = recv(sock, len(packet))
-        time_recv = now()
-
-        # Extract packet data.
-        ip = dpkt.ip.IP(msg_recv)
-
-        # Process results.
-        is_same_data = (payload == ip.icmp.echo.data)
-        time_ping = (time_recv - time_send) * 1000.    # convert from seconds to milliseconds
-        echo_id = ip.icmp.echo.id
+        # Record the time, as late as possible, and send it.
+        time_send = engine.clock()
+        if host_addr:
+            sock.sendto(packet, (host_addr, 0))
+        else:
+            send(sock, packet)
+        table.add(key, time_send)
+
+        # Wait and receive response, record the time.  Keep going until our own reply shows up or
+        # the timeout runs out.  Works the same for blocking and non-blocking sockets.
+        time_left = timeout
+        while True:
+            readable, _, _ = select.select([sock], [], [], time_left)
+            if not readable:
+                raise socket.timeout('timed out')
+
+            if batch:
+                nbytes = 0
+                if batch.recv_batch():
+                    nbytes = batch.length(0)
+                time_recv = engine.clock()
+
+                time_kernel = nbytes and timestamps.parse_control(batch.control(0))
+                if time_kernel:
+                    time_recv = time_kernel - timestamps.realtime_offset()
+
+            else:
+                try:
+                    nbytes = sock.recv_into(buf)   # raw socket, one datagram per call.
+                except socket.error as e:
+                    if e.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                        raise
+                    nbytes = 0
+                time_recv = engine.clock()
+
+            # Extract packet data straight from the buffer.
+            reply = receive.parse_echo_reply(buf, nbytes, ip_header=ip_header, family=family)
+            if reply:
+                reply_id, reply_seq, offset, size = reply
+                status, entry = table.match((reply_id, reply_seq))
+                if status == inflight.MATCHED:
+                    # Process results.
+                    is_same_data = (size == data_size and
+                                    receive.payload_digest(buf, offset, size) == template.digest)
+                    time_ping = (time_recv - entry) * 1000.    # convert from seconds to milliseconds
+                    echo_id = reply_id
+                    break
+
+            else:
+                # Some router or the host itself may say why no reply is coming.
+                reply = receive.parse_icmp_error(buf, nbytes, ip_header=ip_header, family=family)
+                if reply and reply[2:] == key:
+                    table.match(key)
+                    error = receive.error_name(reply[0], reply[1], family)
+                    break
+
+            # Something else, keep waiting for whatever is left of the timeout.
+            time_left = time_send + timeout - engine.clock()
+            if time_left <= 0:
+                raise socket.timeout('timed out')
 
     except socket.timeout:
-        is_same_data = False
-        time_ping = None
-        echo_id = None
+        table.expire(key)
+
+    finally:
+        if not batch:
+            pool.release(buf)
 
 
     # Finish.
     result = {'time_ping': time_ping,
               'data_size': data_size,
               'packet_size': len(packet),
-              'timeout': sock.gettimeout()*1000.,  # convert from seconds to milliseconds
+              'timeout': timeout*1000.,  # convert from seconds to milliseconds
               'is_same_data': is_same_data,
               'id': pid,
-              'echo_id': echo_id}
+              'echo_id': echo_id,
+              'seq': seq,
+              'error': error}
 
     # Done.
     return result
 
 
 
-def ping_repeat(host_name, data_size=None, time_pause=None, count_send=None, timeout=None):
+def ping_repeat(host_name, data_size=None, time_pause=None, count_send=None, timeout=None, dgram=False,
+                manager=None, adaptive_timeout=False, min_timeout=None, family=None,
+                kernel_timestamps=False):
     """
     Ping remote host.  Repeat for better statistics.
 
@@ -262,6 +359,13 @@ def ping_repeat(host_name, data_size=None, time_pause=None, count_send=None, tim
     count_send: number of ping repetitions.
     time_pause: milliseconds between repetitions.
     timeout: socket timeout period, milliseconds.
+    dgram: use an unprivileged ICMP datagram socket (Linux).
+    manager: engine.SocketManager to reuse across calls.  Default is a new one just for this call.
+    adaptive_timeout: wait for each reply according to the ping times so far, between min_timeout
+                      and timeout.
+    min_timeout: shortest adaptive timeout, milliseconds.
+    family: socket.AF_INET6 to ping the host's IPv6 address, default IPv4.
+    kernel_timestamps: measure receive times with kernel timestamps (Linux).
     """
 
     if not time_pause:
@@ -276,101 +380,609 @@ def ping_repeat(host_name, data_size=None, time_pause=None, count_send=None, tim
     if not data_size:
         data_size = 64   # number of bytes.
 
-    # Make a socket, send a sequence of pings.
-    sock = create_socket(host_name, timeout=timeout/1000.)   # note: timeout in seconds, not milliseconds.
-    if not sock:
-        return None, 0
+    if not min_timeout:
+        min_timeout = 20.  # milliseconds
+
+    if adaptive_timeout:
+        estimator = rtt.RttEstimator(min(min_timeout, timeout), timeout)
+    else:
+        estimator = None
+
+    # Shared unconnected socket, send a sequence of pings.
+    own_manager = manager is None
+    if own_manager:
+        manager = engine.SocketManager(dgram=dgram)
+
+    host_addr = resolve_host(host_name, family=family)
+    sock = manager.get(family)
+    pid = manager.pid
+
+    # Table outlives this call, only count what happens from here on.
+    table = manager.table
+    counts_start = table.count_late, table.count_duplicate, table.count_foreign
+
+    # Set up once for the whole sequence, not for every ping.
+    if kernel_timestamps:
+        batch = manager.get_batch(family)
+    else:
+        batch = None
 
     # Main loop over pings.
     time_sweep_start = now()
     results = []
+    time_next = engine.clock()
     for k in range(count_send):
         if k > 0:
-            # Little pause between sending packets.  Try to be a little nice.
-            time.sleep(time_pause / 1000.)   # sleep in seconds, not milliseconds.
+            # Little pause between sending packets.  Try to be a little nice.  Keep to an absolute
+            # timeline so time spent waiting for replies doesn't add to the pause.
+            time_next += time_pause / 1000.   # seconds, not milliseconds.
+            wait = time_next - engine.clock()
+            if wait > 0:
+                time.sleep(wait)
+
+        if estimator:
+            time_wait = estimator.timeout
+        else:
+            time_wait = timeout
 
-        res = ping_once(sock, data_size=data_size)
+        res = ping_once(sock, data_size=data_size, pid=pid, table=table, host_addr=host_addr,
+                        timeout=time_wait/1000.,   # note: timeout in seconds, not milliseconds.
+                        batch=batch)
         if not res:
             raise Exception('Problem calling ping_once.')
 
+        if estimator:
+            if res['time_ping'] is None:
+                estimator.backoff()
+            else:
+                estimator.sample(res['time_ping'])
+
         results.append(res)
 
 
-    # Close the socket.
-    sock.shutdown(socket.SHUT_RDWR)
-    sock.close()
+    if own_manager:
+        manager.close()
 
-    # Process the accumulated results.
-    count_timeout = 0
-    count_corrupt = 0
+    count_late, count_duplicate, count_foreign = [count - start for count, start in
+                                                  zip((table.count_late, table.count_duplicate,
+                                                       table.count_foreign), counts_start)]
 
-    times = []
+    stats, count_recv = summarize_results(host_name, data_size, results, timeout, time_pause,
+                                          count_late=count_late,
+                                          count_duplicate=count_duplicate,
+                                          count_foreign=count_foreign)
+
+    # Done.
+    return stats, count_recv
+
+
+
+def summarize_results(host_name, data_size, results, timeout, time_pause,
+                      count_late=0, count_duplicate=0, count_foreign=0):
+    """
+    Process a list of ping_once() style results for one payload size into a stats dict.
+
+    count_late: replies that arrived after their probe was declared lost.
+    count_duplicate: extra replies to probes already answered.
+    count_foreign: echo replies that did not belong to any of our probes.
+    """
+    tally = accumulator.Tally(keep_times=True)
     for res in results:
-        if res['is_same_data']:
-            times.append(res['time_ping'])
-        else:
-            if res['time_ping']:
-                # Packet is corrupt, but at least it still came back.
-                # Still considered lost since returned payload did not match original.
-                count_corrupt += 1
-            else:
-                # No return time recorded, packet never came back.  Most likely a timeout.
-                count_timeout += 1
+        tally.add_result(res)
+
+    tally.count_late = count_late
+    tally.count_duplicate = count_duplicate
+    tally.count_foreign = count_foreign
+
+    # Done.
+    return summarize_tally(host_name, data_size, tally, timeout, time_pause)
 
 
-    count_lost = count_timeout + count_corrupt
-    count_recv = count_send - count_lost
-    packet_size = res['packet_size']
+
+def summarize_tally(host_name, data_size, tally, timeout, time_pause):
+    """
+    Turn the running Tally for one payload size into a stats dict.
+
+    Ping time statistics come from stats['accumulator'].  stats['times'] holds every ping time
+    only if the tally kept them, otherwise it is None.
+    """
     stats = {'host_name': host_name,
              'data_size': data_size,
-             'packet_size': packet_size,
-             'times': times,
+             'packet_size': tally.packet_size,
+             'times': tally.times,
+             'accumulator': tally.accumulator,
              'timeout': timeout,
              'time_pause': time_pause,
-             'count_send': count_send,
-             'count_timeout': count_timeout,
-             'count_corrupt': count_corrupt,
-             'count_lost': count_lost}
+             'count_send': tally.count_send,
+             'count_timeout': tally.count_timeout,
+             'count_corrupt': tally.count_corrupt,
+             'count_error': tally.count_error,
+             'count_lost': tally.count_lost,
+             'count_late': tally.count_late,
+             'count_duplicate': tally.count_duplicate,
+             'count_foreign': tally.count_foreign}
 
     # Done.
-    return stats, count_recv
+    return stats, tally.count_recv
+
 
 
+def ping_sweep(host_name, timeout=None, size_sweep=None, time_pause=None, count_send=None, verbosity=False,
+               max_in_flight=None, batch_size=None, kernel_timestamps=False, dgram=False,
+               keep_times=True, rate=None, target_rate=None, manager=None):
+    """
+    Perform a sequence of pings over a range of payload sizes.  Raises PingSweepNameError if
+    host_name can't be resolved.
+
+    keep_times: keep every ping time in stats['times'], as always.  False to keep only the
+                running statistics in stats['accumulator'], which are fixed in size.
+    """
+    # One host, nothing to sweep without it.  The answer is cached for the sweep itself.
+    resolve_host(host_name)
+
+    stats_sweep = ping_sweep_hosts([host_name], timeout=timeout, size_sweep=size_sweep,
+                                   time_pause=time_pause, count_send=count_send,
+                                   verbosity=verbosity, max_in_flight=max_in_flight,
+                                   batch_size=batch_size, kernel_timestamps=kernel_timestamps,
+                                   dgram=dgram, keep_times=keep_times, rate=rate,
+                                   target_rate=target_rate, manager=manager)
+
+    # Done.
+    return stats_sweep
 
-def ping_sweep(host_name, timeout=None, size_sweep=None, time_pause=None, count_send=None, verbosity=False):
+
+
+def ping_sweep_hosts(host_names, timeout=None, size_sweep=None, time_pause=None, count_send=None,
+                     verbosity=False, max_in_flight=None, batch_size=None, kernel_timestamps=False,
+                     dgram=False, keep_times=False, rate=None, target_rate=None, manager=None,
+                     resolver=None, workers=None, adaptive_timeout=False, min_timeout=None,
+                     stopping=None, family=None, probe_writer=None, cell_writer=None,
+                     keep_stats=True):
     """
-    Perform a sequence of pings over a range of payload sizes.
+    Perform a sequence of pings over a range of payload sizes, for many hosts at once.
+
+    All probes go through one shared socket and are kept in flight concurrently by the sweep
+    engine.  Returns a list of stats dicts, one per (host, size), ordered by host then size.
+
+    host_names: any iterable of names or addresses, such as from targets.iter_targets().  It is
+                only read as the sweep goes along.  Names that can't be resolved are reported
+                and left out, rather than raised, so one bad name doesn't stop a whole sweep.
+
+    max_in_flight: upper limit on number of unanswered probes across all hosts.
+    batch_size: packets per system call on Linux, 1 for one packet at a time.
+    kernel_timestamps: measure receive times with kernel timestamps (Linux).
+    dgram: use an unprivileged ICMP datagram socket instead of a raw socket (Linux).
+    keep_times: keep every ping time in stats['times'], as needed by the analysis module.
+    rate: global limit in pings per second across all hosts.
+    target_rate: limit in pings per second to any one host.
+    manager: engine.SocketManager whose socket to use, so that it can be reused across sweeps.
+             Default is a socket just for this sweep.
+    resolver: dnscache.Resolver for host names, e.g. with a cache file.  Default keeps answers in
+              memory only.
+    workers: number of processes to shard the sweep across, each with its own socket.  The
+             manager is not used then.
+    adaptive_timeout: wait for each reply according to the ping times seen so far from its host,
+                      between min_timeout and timeout.  Lost packets are given up on much
+                      sooner.
+    min_timeout: shortest adaptive timeout, milliseconds.
+    stopping: stopping.StoppingRule to stop sampling a size once its median ping time and loss
+              rate are known well enough, with count_send then a budget per size rather than
+              a fixed count.
+    family: socket.AF_INET6 to sweep the hosts' IPv6 addresses with ICMPv6, default IPv4.  Each
+            stats dict says which in stats['family'].  A given resolver must look up the same
+            family.
+    probe_writer: writers.RecordWriter to stream a writers.probe_record() for every probe to as
+                  the sweep goes.  Not available with workers, the probes are in other processes.
+    cell_writer: writers.RecordWriter for a writers.cell_record() for every (host, size), as soon
+                 as it is done.  With workers, written at the end.
+    keep_stats: return the stats for every (host, size).  False to only stream them to
+                cell_writer and return an empty list, so that a sweep without workers can cover
+                a whole subnet in memory that follows the hosts in flight.
     """
     if not size_sweep:
         size_sweep = [16, 64, 256, 1024]
 
-    try:
-        stats_sweep = []
-        for s in size_sweep:
-            stats, count_recv = ping_repeat(host_name, data_size=s,
-                                            timeout=timeout,
-                                            time_pause=time_pause,
-                                            count_send=count_send)
+    if not family:
+        family = socket.AF_INET
+
+    if not resolver:
+        resolver = _default_resolver(family)
+
+    options = dict(timeout=timeout, time_pause=time_pause, max_in_flight=max_in_flight,
+                   batch_size=batch_size, kernel_timestamps=kernel_timestamps, dgram=dgram,
+                   keep_times=keep_times, rate=rate, target_rate=target_rate,
+                   adaptive_timeout=adaptive_timeout, min_timeout=min_timeout,
+                   stopping=stopping, family=family)
+
+    if workers and workers > 1 and probe_writer:
+        raise ValueError('Probe records are not available from worker processes')
+
+    # Targets are resolved and fed to the engine a chunk at a time, as it makes room for them.
+    host_addrs = resolve_targets(host_names, resolver=resolver)
 
+    if workers and workers > 1:
+        result = shards.run_sharded(host_addrs, workers, size_sweep, count_send=count_send,
+                                    **options)
+        tallies, timeout, time_pause, interrupted = result
+        if interrupted:
+            print('\nUser stop!')
+        else:
+            print('\nDone.')
+
+        if cell_writer:
+            for (host_name, data_size), tally in tallies:
+                cell_writer.write(writers.cell_record(host_name, data_size, tally))
+
+    else:
+        if manager:
+            options.update(sock=manager.get(family), pid=manager.pid)
+
+        if probe_writer:
+            def record_probe(cell, result):
+                probe_writer.write(writers.probe_record(cell, result))
+            options['probe_callback'] = record_probe
+
+        def finished(cell):
+            if cell_writer:
+                cell_writer.write(writers.cell_record(cell.host_name, cell.data_size, cell.tally))
+
+        sweep = engine.SweepEngine(keep_cells=keep_stats, **options)
+        sweep.add_source(host_addrs, size_sweep, count_send=count_send)
+
+        try:
+            sweep.run(callback=finished)
+            print('\nDone.')
+
+        except KeyboardInterrupt:
+            print('\nUser stop!')
+
+        # After a user stop, whatever the unfinished cells got so far.
+        if cell_writer:
+            for cell in sweep.cells:
+                if cell.tally.count_send and not cell.is_done:
+                    finished(cell)
+
+        tallies = [((cell.host_name, cell.data_size), cell.tally) for cell in sweep.cells]
+        timeout, time_pause = sweep.timeout, sweep.time_pause
+
+    if not keep_stats:
+        tallies = []
+
+    # Summarize whatever made it back, even after a user stop.
+    stats_sweep = []
+    for (host_name, data_size), tally in tallies:
+        if tally.count_send:
+            stats, count_recv = summarize_tally(host_name, data_size, tally, timeout, time_pause)
+            stats['family'] = family
             stats_sweep.append(stats)
 
+    if verbosity:
+        display_results(stats_sweep)
+
+    # Done.
+    return stats_sweep
+
+
+
+def path_mtu_hosts(host_names, timeout=None, size_max=None, verbosity=False, resolver=None):
+    """
+    Find the path MTU to each host by binary search over payload sizes with the don't fragment
+    bit set, instead of sweeping a fixed list of sizes.  Returns a list of result dicts as from
+    pmtu.PathMtu.search(), plus the host name.
+
+    timeout: milliseconds to wait for each probe.
+    size_max: largest payload to try, bytes.  Default is the largest an IPv4 datagram can carry.
+    """
+    finder = pmtu.PathMtu(timeout=timeout)
+
+    results = []
+    try:
+        for host_name, host_addr in resolve_targets(host_names, resolver=resolver):
+            try:
+                result = finder.search(host_addr, size_max=size_max)
+            except pmtu.PmtuError as e:
+                print('Skipping {:s}: {}'.format(host_name, e))
+                continue
+
+            result['host_name'] = host_name
+            results.append(result)
+
             if verbosity:
-                if count_recv:
-                    if len(stats_sweep) == 1:
-                        # Display the header first time through.
-                        display_results_header(stats)
+                print(' {:s}: path MTU {:d} bytes, largest payload {:d} bytes, {:d} probes'.format(
+                      host_name, result['mtu'], result['data_size'], result['count_send']))
 
-                    # Display line of results.
-                    display_results_line(stats)
+    finally:
+        finder.close()
+
+    # Done.
+    return results
 
+
+
+def traceroute_hosts(host_names, max_ttl=None, size_sweep=None, count_send=None, timeout=None,
+                     time_pause=None, verbosity=False, max_in_flight=None, batch_size=None,
+                     rate=None, target_rate=None, resolver=None, family=None):
+    """
+    Traceroute with a payload size sweep at every hop.  Probes for every TTL from 1 to max_ttl go
+    out at once for each host, and time exceeded errors from the routers along the way count as
+    their replies.  Returns a list of stats dicts as from ping_sweep_hosts(), one per (host, hop,
+    size), each also with the 'ttl' and the 'hop_addr' that answered, None if nothing did.  Hops
+    past the first to reach the host itself are left out.
+
+    Loss that shows up at one hop and carries on to every later one is the path's.  Loss at a
+    single hop is more likely the router limiting how many time exceeded errors it sends.
+
+    max_ttl: highest TTL to probe, default 30.  For IPv6, the hop limit.
+    family: socket.AF_INET6 to trace the hosts' IPv6 addresses, default IPv4.
+    """
+    if not max_ttl:
+        max_ttl = 30
+
+    if not size_sweep:
+        size_sweep = [16, 64, 256, 1024]
+
+    if not family:
+        family = socket.AF_INET
+
+    if not resolver:
+        resolver = _default_resolver(family)
+
+    sweep = engine.SweepEngine(timeout=timeout, time_pause=time_pause, max_in_flight=max_in_flight,
+                               batch_size=batch_size, rate=rate, target_rate=target_rate,
+                               family=family)
+
+    for host_name, host_addr in resolve_targets(host_names, resolver=resolver):
+        for ttl in range(1, max_ttl + 1):
+            sweep.add_target(host_name, host_addr, size_sweep, count_send=count_send, ttl=ttl)
+
+    try:
+        sweep.run()
         print('\nDone.')
 
     except KeyboardInterrupt:
         print('\nUser stop!')
 
+    # Lowest TTL that got through to each host.
+    ttl_reached = {}
+    for cell in sweep.cells:
+        if cell.host_addr in cell.hop_addrs:
+            ttl_reached[cell.host_name] = min(cell.ttl, ttl_reached.get(cell.host_name, max_ttl))
+
+    # Cells were added by host, then TTL, then size, already the order to show them in.
+    cells = [cell for cell in sweep.cells if cell.ttl <= ttl_reached.get(cell.host_name, max_ttl)]
+
+    stats_sweep = []
+    for cell in cells:
+        if cell.tally.count_send:
+            stats, count_recv = summarize_tally(cell.host_name, cell.data_size, cell.tally,
+                                                sweep.timeout, sweep.time_pause)
+            stats['family'] = family
+            stats['ttl'] = cell.ttl
+            if cell.hop_addrs:
+                stats['hop_addr'] = cell.hop_addrs.most_common(1)[0][0]
+            else:
+                stats['hop_addr'] = None
+            stats_sweep.append(stats)
+
+    if verbosity:
+        display_results(stats_sweep)
+
+    # Done.
+    return stats_sweep
+
+
+
+def monitor_hosts(host_names, size_sweep=None, count_send=None, interval=None, rounds=None,
+                  report=None, rolling_stats=None, stop=None, timeout=None, time_pause=None,
+                  max_in_flight=None, batch_size=None, kernel_timestamps=False, dgram=False,
+                  rate=None, target_rate=None, resolver=None, adaptive_timeout=False,
+                  min_timeout=None, stopping=None, family=None, metrics=None, probe_writer=None,
+                  cell_writer=None):
+    """
+    Sweep the same hosts over and over, keeping rolling window statistics for every (host, size)
+    as each one finishes.  Runs until stop is set, the rounds are done or a user stop.  Returns
+    the rolling.RollingStats.
+
+    One socket, in-flight table and set of per-host RTT estimates are kept for the whole run, so
+    replies to one round's probes that come in during the next are still known for late, and
+    adaptive timeouts carry on.  Each round gets a fresh sweep engine with new cells, so nothing
+    else builds up from one round to the next besides the fixed size rings.
+
+    host_names: names or addresses walked afresh every round, such as a list or a
+                targets.TargetSet.  A one shot generator only lasts one round.
+    interval: least seconds from the start of one round to the start of the next.  Default is
+              back to back.
+    rounds: number of rounds, default no limit.
+    report: seconds between displays of the shortest window, None for no display.
+    rolling_stats: rolling.RollingStats to keep the figures in, so that other threads can read
+                   them while probing goes on.  Default is 1 minute, 5 minute and 1 hour windows.
+    stop: threading.Event to end the run once the round in progress is done.
+    metrics: exporter.MetricsExporter to keep up to date with running totals and the engine's
+             own counters, for Prometheus to scrape.
+    probe_writer, cell_writer: writers.RecordWriter to stream every probe or every finished
+                               (host, size) of every round to.
+    Other options as for ping_sweep_hosts().
+    """
+    if not size_sweep:
+        size_sweep = [16, 64, 256, 1024]
+
+    if not interval:
+        interval = 0.
+
+    if not family:
+        family = socket.AF_INET
+
+    if not resolver:
+        resolver = _default_resolver(family)
+
+    if rolling_stats is None:
+        rolling_stats = rolling.RollingStats()
+
+    def finished(cell):
+        key = cell.host_name, cell.data_size
+        rolling_stats.add(key, cell.tally, engine.clock())
+        if metrics is not None:
+            metrics.add(key, cell.tally)
+        if cell_writer:
+            cell_writer.write(writers.cell_record(cell.host_name, cell.data_size, cell.tally))
+
+    # Engine counters, probes in flight and hosts carry on from one round to the next.
+    manager = engine.SocketManager(dgram=dgram)
+    options = dict(timeout=timeout, time_pause=time_pause, max_in_flight=max_in_flight,
+                   batch_size=batch_size, kernel_timestamps=kernel_timestamps, dgram=dgram,
+                   rate=rate, target_rate=target_rate, adaptive_timeout=adaptive_timeout,
+                   min_timeout=min_timeout, stopping=stopping, family=family,
+                   counters=engine.EngineCounters(), in_flight=manager.table, hosts={},
+                   keep_cells=False)
+
+    if probe_writer:
+        def record_probe(cell, result):
+            probe_writer.write(writers.probe_record(cell, result))
+        options['probe_callback'] = record_probe
+
+    count_rounds = 0
+    time_report = None
+    try:
+        while not (stop and stop.is_set()):
+            time_round = engine.clock()
+            if report and time_report is None:
+                time_report = time_round + report
+
+            # Engine per round, socket for the whole run.
+            sweep = engine.SweepEngine(sock=manager.get(family), pid=manager.pid, **options)
+            sweep.add_source(resolve_targets(host_names, resolver=resolver), size_sweep,
+                             count_send=count_send)
+            if metrics is not None:
+                metrics.watch(sweep)
+            sweep.run(callback=finished)
+
+            count_rounds += 1
+            time_now = engine.clock()
+            rolling_stats.prune(time_now)
+
+            if report and time_now >= time_report:
+                window = min(rolling_stats.windows)
+                display_results(summarize_rolling(rolling_stats, window, time_now, sweep.timeout,
+                                                  sweep.time_pause, family=family))
+                time_report = max(time_report + report, time_now)
+
+            if rounds and count_rounds >= rounds:
+                break
+
+            time_wait = time_round + interval - engine.clock()
+            if time_wait > 0:
+                if stop:
+                    stop.wait(time_wait)
+                else:
+                    time.sleep(time_wait)
+
+    except KeyboardInterrupt:
+        print('\nUser stop!')
+
+    finally:
+        manager.close()
+
+    # Done.
+    return rolling_stats
+
+
+
+def summarize_rolling(rolling_stats, window, time_now, timeout, time_pause, family=None):
+    """
+    Stats dicts as from ping_sweep_hosts() for one window of a rolling.RollingStats, one per
+    (host, size) with anything sent in the window.  Each also has the 'window' in seconds.
+
+    time_now: engine.clock() time the window ends.
+    """
+    stats_sweep = []
+    for (host_name, data_size), tally in rolling_stats.snapshot(window, time_now):
+        if tally.count_send:
+            stats, count_recv = summarize_tally(host_name, data_size, tally, timeout, time_pause)
+            stats['family'] = family
+            stats['window'] = window
+            stats_sweep.append(stats)
+
     # Done.
     return stats_sweep
 
+
+
+def merge_by_host(stats_sweeps):
+    """
+    Merge the stats lists from several sweeps over the same hosts, such as one over IPv4 and one
+    over IPv6, so that each host's results come together.  Hosts are in the order first seen,
+    and each host's results in the order of the sweeps.
+    """
+    order = {}
+    for stats_sweep in stats_sweeps:
+        for stats in stats_sweep:
+            order.setdefault(stats['host_name'], len(order))
+
+    # Sort is stable, each host's results stay in sweep order.
+    merged = [stats for stats_sweep in stats_sweeps for stats in stats_sweep]
+    merged.sort(key=lambda stats: order[stats['host_name']])
+
+    # Done.
+    return merged
+
+
+
+# Answers are kept in memory for the life of the process, as long as their TTL allows.
+_resolver = dnscache.Resolver()
+_resolver6 = dnscache.Resolver(family=socket.AF_INET6)
+
+def _default_resolver(family=None):
+    if family == socket.AF_INET6:
+        return _resolver6
+
+    # Done.
+    return _resolver
+
+
+def resolve_targets(host_names, resolver=None, chunk_size=None):
+    """
+    Generate (host_name, host_addr) for an iterable of names.  Names are resolved in parallel a
+    chunk at a time.  Names that don't resolve are reported and left out, the rest of the sweep
+    goes ahead.
+    """
+    if not resolver:
+        resolver = _resolver
+
+    if not chunk_size:
+        chunk_size = 256
+
+    host_names = iter(host_names)
+    while True:
+        chunk = list(itertools.islice(host_names, chunk_size))
+        if not chunk:
+            break
+
+        host_addrs, errors = resolver.resolve_all(chunk)
+        for host_name in chunk:
+            if host_name in errors:
+                print('Skipping {:s}: {:s}'.format(host_name, errors[host_name]))
+                continue
+
+            yield host_name, host_addrs[host_name]
+
+
+
+
+def resolve_host(host_name, resolver=None, family=None):
+    """
+    Look up the IPv4 address for a host name, or the IPv6 address with family socket.AF_INET6.
+    """
+    if not resolver:
+        resolver = _default_resolver(family)
+
+    try:
+        host_addr = resolver.resolve(host_name)
+    except dnscache.ResolverError:
+        raise PingSweepNameError('Unable to resolve host name: {:s}'.format(host_name))
+
+    # Done.
+    return host_addr
+
 #################################################
 
 
@@ -382,15 +994,22 @@ def display_results_header(stats):
     # Print.
     print('\n Ping Sweep')
     print(' ==========')
-    print(' target name: %s' % stats['host_name'])
+    if stats.get('family') == socket.AF_INET6:
+        print(' target name: %s (IPv6)' % stats['host_name'])
+    else:
+        print(' target name: %s' % stats['host_name'])
     print(' ping count:  %d' % stats['count_send'])
     print(' timeout:     %d ms' % stats['timeout'])
     print(' pause time:  %d ms' % stats['time_pause'])
+    if stats.get('ttl'):
+        print(' hop:         %d  %s' % (stats['ttl'], stats['hop_addr'] or '*'))
+    if stats.get('window'):
+        print(' window:      %d s' % stats['window'])
     print()
 
     # Header strings.
-    head_A = '  Size (bytes)  |       Ping Times (ms)         | Lost Packets'
-    head_B = ' Payload Packet |  min    avg    [std]     max  | All  T   C '
+    head_A = '  Size (bytes)  |       Ping Times (ms)         |     Percentiles (ms)       | Lost Packets'
+    head_B = ' Payload Packet |  min    avg    [std]     max  |   p50    p90    p99  p99.9 | All  T   C   E '
 
     print(head_A)
     print(head_B)
@@ -407,20 +1026,41 @@ def display_results_line(stats):
     Generate line of text for current set of results.
     """
 
-    template = ' {:5d}  {:5d}   |{:6.2f} {:6.2f} [{:6.2f}] {:7.2f} |{:3d} {:3d} {:3d}'
+    template = (' {:5d}  {:5d}   |{:6.2f} {:6.2f} [{:6.2f}] {:7.2f} |{:6.2f} {:6.2f} {:6.2f} {:6.2f} '
+                '|{:3d} {:3d} {:3d} {:3d}')
 
-    t_min = min(stats['times'])
-    t_avg = mean(stats['times'])
-    t_std = std(stats['times'])
-    t_max = max(stats['times'])
+    acc = stats['accumulator']
 
-    values = stats['data_size'], stats['packet_size'], t_min, t_avg, t_std, t_max, \
-             stats['count_lost'], stats['count_timeout'], stats['count_corrupt']
+    values = stats['data_size'], stats['packet_size'], acc.min, acc.mean, acc.std, acc.max, \
+             acc.percentile(50), acc.percentile(90), acc.percentile(99), acc.percentile(99.9), \
+             stats['count_lost'], stats['count_timeout'], stats['count_corrupt'], \
+             stats['count_error']
 
     print(template.format(*values))
 
     # Done.
 
+def display_results(stats_sweep):
+    """
+    Display a results table for each host in a sweep, or for each hop of a traceroute.
+    """
+    key = None
+    for stats in stats_sweep:
+        is_silent = stats['count_send'] == stats['count_lost']
+        if is_silent and not stats.get('ttl'):
+            # Nothing came back, no times to show.
+            continue
+
+        if (stats['host_name'], stats.get('family'), stats.get('ttl')) != key:
+            # New host, family or hop, new header.  Silent hops still get theirs, to show the gap.
+            key = stats['host_name'], stats.get('family'), stats.get('ttl')
+            display_results_header(stats)
+
+        if not is_silent:
+            display_results_line(stats)
+
+    # Done.
+
 #################################################
 
 
@@ -462,21 +1102,102 @@ def main():
     # Parse command line arguments.
     parser = argparse.ArgumentParser()
 
-    parser.add_argument('host_name', action='store',
-                        help='Name or IP address of host to ping')
+    parser.add_argument('host_names', action='store', nargs='+',
+                        help='Hosts to ping: names, addresses, CIDR blocks (10.0.0.0/24), '
+                             'address ranges (10.0.0.1-50) or @file with more of the same')
+
+    parser.add_argument('-s', '--shuffle', action='store_true', default=False,
+                        help='Ping addresses in CIDR blocks and ranges in random order')
+
+    parser.add_argument('--seed', action='store', type=int, default=None,
+                        help='Random seed for a repeatable --shuffle order')
 
     parser.add_argument( '-c', '--count', action='store', type=int, default=25,
                         help='Number of pings at each packet payload size')
 
+    parser.add_argument('-e', '--early-stop', action='store_true', default=False,
+                        help='Stop pinging a size once its results settle, --count is then a '
+                             'budget shared with the noisier sizes')
+
     parser.add_argument('-p', '--pause', action='store', type=float, default=5.,
                         help='Pause time between individual pings (ms)')
 
     parser.add_argument('-t' ,'--timeout', action='store', type=float, default=1000.,
-                        help='Socket timeout (ms)')
+                        help='Socket timeout (ms), the longest wait with --adaptive')
+
+    parser.add_argument('-a' ,'--adaptive', action='store_true', default=False,
+                        help='Adapt timeout to the ping times seen from each host')
+
+    parser.add_argument('--min-timeout', action='store', type=float, default=20.,
+                        help='Shortest timeout with --adaptive (ms)')
 
     parser.add_argument('-L' ,'--large', action='store_true', default=False,
                         help='Use additional payloads larger than 1024 bytes.')
 
+    parser.add_argument('-f' ,'--in-flight', action='store', type=int, default=4096,
+                        help='Maximum number of unanswered pings across all hosts')
+
+    parser.add_argument('-b' ,'--batch', action='store', type=int, default=1,
+                        help='Pings per system call where supported (Linux).  Pings sent in one '
+                             'call share a send time, so larger batches skew ping times')
+
+    parser.add_argument('-r' ,'--rate', action='store', type=float, default=None,
+                        help='Maximum pings per second across all hosts')
+
+    parser.add_argument('--target-rate', action='store', type=float, default=None,
+                        help='Maximum pings per second to any one host')
+
+    parser.add_argument('--resolve-cache', action='store', default=dnscache.default_cache_path(),
+                        help='File to keep resolved host names in between runs, empty for none')
+
+    parser.add_argument('-w' ,'--workers', action='store', type=int, default=1,
+                        help='Number of processes to share the sweep, each with its own socket')
+
+    parser.add_argument('-m', '--pmtu', action='store_true', default=False,
+                        help='Find the path MTU to each host instead of a size sweep (Linux)')
+
+    parser.add_argument('-T', '--traceroute', action='store_true', default=False,
+                        help='Sweep sizes at every hop on the way to each host')
+
+    parser.add_argument('--max-ttl', action='store', type=int, default=30,
+                        help='Most hops to probe with --traceroute')
+
+    parser.add_argument('-D', '--daemon', action='store_true', default=False,
+                        help='Keep sweeping until stopped, showing rolling statistics over the '
+                             'last minute every --report seconds')
+
+    parser.add_argument('--interval', action='store', type=float, default=0.,
+                        help='Least seconds from the start of one --daemon round to the next')
+
+    parser.add_argument('--report', action='store', type=float, default=60.,
+                        help='Seconds between --daemon reports')
+
+    parser.add_argument('--metrics-port', action='store', type=int, default=None,
+                        help='With --daemon, serve Prometheus metrics over HTTP on this port')
+
+    parser.add_argument('--probes-out', action='store', default=None,
+                        help='Stream a record of every ping to this file as the sweep goes: '
+                             '.jsonl, .csv, .parquet or .arrow (these two need pyarrow), or a '
+                             'compact binary .plog, added to if it exists')
+
+    parser.add_argument('--cells-out', action='store', default=None,
+                        help='Stream a summary of every host and payload size to this file, as '
+                             'soon as each is done: .jsonl, .csv, .parquet or .arrow.  They are '
+                             'then not kept for a table at the end, so whole subnets fit in memory')
+
+    parser.add_argument('-4', '--ipv4', action='store_true', default=False,
+                        help='Ping IPv4 addresses, the default without -6')
+
+    parser.add_argument('-6', '--ipv6', action='store_true', default=False,
+                        help='Ping IPv6 addresses.  With -4 as well, each host\'s results over '
+                             'both come together')
+
+    parser.add_argument('-k' ,'--kernel-timestamps', action='store_true', default=False,
+                        help='Use kernel receive timestamps for ping times (Linux)')
+
+    parser.add_argument('-u' ,'--unprivileged', action='store_true', default=False,
+                        help='Use an ICMP datagram socket, no admin rights needed (Linux)')
+
     args = parser.parse_args()
 
     # Use large packets?
@@ -486,22 +1207,184 @@ def main():
         size_sweep = [32, 64, 128, 256, 512, 1024, 1472]
         # size_sweep = [2048, 4090, 4093, 4096, 4099, 4102]
 
-    # This tools only runs with elevated privileges because we need access to a raw socket.
-    if is_admin():
+    # A raw socket needs elevated privileges.  Without them, fall back to an unprivileged ICMP
+    # datagram socket if this system allows it.
+    dgram = args.unprivileged
+    if not dgram and not is_admin():
+        dgram = engine.dgram_available()
+
+    if args.early_stop:
+        stopping_rule = stopping.StoppingRule()
+    else:
+        stopping_rule = None
+
+    families = []
+    if args.ipv4 or not args.ipv6:
+        families.append(socket.AF_INET)
+    if args.ipv6:
+        families.append(socket.AF_INET6)
+
+    def resolver(family):
+        return dnscache.Resolver(cache_path=dnscache.family_cache_path(args.resolve_cache, family),
+                                 family=family)
+
+    if args.pmtu:
+        # ICMP errors only show up on a raw socket.
+        if not is_admin():
+            print('\nOops!  Path MTU discovery requires elevated privileges.')
+            return
+
+        if args.ipv6:
+            print('\nOops!  Path MTU discovery is for IPv4 only.')
+            return
+
+        try:
+            host_names = targets.iter_targets(args.host_names, shuffle=args.shuffle, seed=args.seed)
+            path_mtu_hosts(host_names, timeout=args.timeout,
+                           resolver=dnscache.Resolver(cache_path=args.resolve_cache),
+                           verbosity=True)
+        except (targets.TargetError, pmtu.PmtuError) as e:
+            print('\nOoops!  There was a problem: {}'.format(e))
+
+        return
+
+    if args.traceroute:
+        # Time exceeded errors only show up on a raw socket.
+        if not is_admin():
+            print('\nOops!  Traceroute requires elevated privileges.')
+            return
+
+        try:
+            stats_sweeps = []
+            for family in families:
+                host_names = targets.iter_targets(args.host_names, shuffle=args.shuffle,
+                                                  seed=args.seed)
+                stats_sweeps.append(traceroute_hosts(host_names,
+                                                     max_ttl=args.max_ttl,
+                                                     size_sweep=size_sweep,
+                                                     count_send=args.count,
+                                                     time_pause=args.pause,
+                                                     timeout=args.timeout,
+                                                     max_in_flight=args.in_flight,
+                                                     batch_size=args.batch,
+                                                     rate=args.rate,
+                                                     target_rate=args.target_rate,
+                                                     resolver=resolver(family),
+                                                     family=family))
+            display_results(merge_by_host(stats_sweeps))
+        except targets.TargetError as e:
+            print('\nOoops!  There was a problem: {}'.format(e))
+
+        return
+
+    if dgram or is_admin():
         # Ok good.
         # Run the application: sequence of pings over a range of packet sizes.
+        if args.daemon and len(families) > 1:
+            print('\nOops!  Daemon mode sweeps one address family at a time.')
+            return
+
+        if args.probes_out and args.workers > 1:
+            print('\nOops!  Probe records are not available from worker processes.')
+            return
+
+        probe_writer = cell_writer = None
         try:
-            stats_sweep = ping_sweep(args.host_name,
-                                     size_sweep=size_sweep,
-                                     count_send=args.count,
-                                     time_pause=args.pause,
-                                     timeout=args.timeout,
-                                     verbosity=True)
-        except PingSweepNameError as e:
-            print('\nOoops!  There was a problem: {:s}'.format(e.msg))
+            if args.probes_out:
+                probe_writer = writers.create_writer(args.probes_out, writers.PROBE_FIELDS)
+            if args.cells_out:
+                cell_writer = writers.create_writer(args.cells_out, writers.CELL_FIELDS)
+        except writers.WriterError as e:
+            print('\nOoops!  There was a problem: {}'.format(e))
+            if probe_writer:
+                probe_writer.close()
+            return
+
+        try:
+            if args.daemon:
+                metrics = server = None
+                if args.metrics_port is not None:
+                    metrics = exporter.MetricsExporter()
+                    try:
+                        server = exporter.start_server(metrics, args.metrics_port)
+                    except socket.error as e:
+                        print('\nOoops!  Unable to serve metrics: {}'.format(e))
+                        return
+
+                family = families[0]
+                monitor_hosts(targets.TargetSet(args.host_names, shuffle=args.shuffle,
+                                                seed=args.seed),
+                              size_sweep=size_sweep,
+                              count_send=args.count,
+                              interval=args.interval,
+                              report=args.report,
+                              time_pause=args.pause,
+                              timeout=args.timeout,
+                              max_in_flight=args.in_flight,
+                              batch_size=args.batch,
+                              kernel_timestamps=args.kernel_timestamps,
+                              dgram=dgram,
+                              rate=args.rate,
+                              target_rate=args.target_rate,
+                              resolver=resolver(family),
+                              adaptive_timeout=args.adaptive,
+                              min_timeout=args.min_timeout,
+                              stopping=stopping_rule,
+                              family=family,
+                              metrics=metrics,
+                              probe_writer=probe_writer,
+                              cell_writer=cell_writer)
+                if server:
+                    server.shutdown()
+                return
+
+            stats_sweeps = []
+            for family in families:
+                host_names = targets.iter_targets(args.host_names, shuffle=args.shuffle,
+                                                  seed=args.seed)
+                stats_sweeps.append(ping_sweep_hosts(host_names,
+                                                     size_sweep=size_sweep,
+                                                     count_send=args.count,
+                                                     time_pause=args.pause,
+                                                     timeout=args.timeout,
+                                                     max_in_flight=args.in_flight,
+                                                     batch_size=args.batch,
+                                                     kernel_timestamps=args.kernel_timestamps,
+                                                     dgram=dgram,
+                                                     rate=args.rate,
+                                                     target_rate=args.target_rate,
+                                                     resolver=resolver(family),
+                                                     workers=args.workers,
+                                                     adaptive_timeout=args.adaptive,
+                                                     min_timeout=args.min_timeout,
+                                                     stopping=stopping_rule,
+                                                     family=family,
+                                                     probe_writer=probe_writer,
+                                                     cell_writer=cell_writer,
+                                                     keep_stats=not cell_writer))
+            if cell_writer:
+                print('Results written to {:s}'.format(args.cells_out))
+            else:
+                display_results(merge_by_host(stats_sweeps))
+        except targets.TargetError as e:
+            print('\nOoops!  There was a problem: {}'.format(e))
+        except shards.ShardError as e:
+            print('\nOoops!  There was a problem: {}'.format(e))
+        except writers.WriterError as e:
+            print('\nOoops!  There was a problem: {}'.format(e))
+
+        finally:
+            # Whatever is still buffered goes out, even after a problem.
+            for writer in (probe_writer, cell_writer):
+                if writer:
+                    try:
+                        writer.close()
+                    except writers.WriterError as e:
+                        print('\nOoops!  There was a problem: {}'.format(e))
 
     else:
         print('\nOops!  This application requires elevated privileges.')
+        print('On Linux, adding your group to net.ipv4.ping_group_range works too.')
         print('Please try again.')
 
     # Done.
@@ -0,0 +1,288 @@
+#!/usr/bin/env python
+
+#
+# Copyright 2011 Pierre V. Villeneuve
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+
+"""
+Path MTU discovery.
+
+A size sweep over a fixed list of payloads can't tell a path that fragments large packets from
+one that passes them whole.  Here the socket sets the don't fragment bit on every probe, and the
+largest payload that makes it through unfragmented is found by binary search.
+
+Each probe has three ways to come out too big: the local interface refuses it (EMSGSIZE), a
+router along the way drops it and says so with ICMP fragmentation needed, or it simply vanishes
+into a black hole.  Routers following RFC 1191 report the MTU of the next hop, in which case the
+search jumps straight to it rather than halving its way down.
+
+Linux only, needs a raw socket so the ICMP errors can be read.
+"""
+
+from __future__ import division, print_function #, unicode_literals
+
+import errno
+import os
+import select
+import socket
+import struct
+
+import dpkt
+
+import engine
+import packets
+
+
+# From linux/in.h, not all exposed by the socket module.
+IP_MTU_DISCOVER = getattr(socket, 'IP_MTU_DISCOVER', 10)
+IP_PMTUDISC_PROBE = 3   # set DF, ignore the kernel's cached path MTU.
+
+HEADER_SIZE = 28   # bytes, IPv4 header without options plus ICMP echo header.
+
+# Probe outcomes.
+OK = 'ok'
+TOO_BIG = 'too big'
+LOST = 'lost'
+
+
+#################################################
+
+class PmtuError(Exception):
+    pass
+
+
+
+def set_dont_fragment(sock):
+    """
+    Have every packet on the socket go out with the DF bit set, whatever size the kernel thinks
+    the path takes.
+    """
+    try:
+        sock.setsockopt(socket.IPPROTO_IP, IP_MTU_DISCOVER, IP_PMTUDISC_PROBE)
+    except socket.error as e:
+        raise PmtuError('Unable to set the don\'t fragment bit: {}'.format(e))
+
+
+
+def parse_packet(buf, pid):
+    """
+    Classify a packet from a raw ICMP socket.  Returns (seq, outcome, mtu) for an echo reply to
+    us or for fragmentation needed quoting one of our requests, otherwise None.  mtu is the next
+    hop MTU reported by the router, None if it didn't say.
+    """
+    try:
+        ip = dpkt.ip.IP(buf)
+    except dpkt.UnpackError:
+        return None
+
+    icmp = ip.data
+    if not isinstance(icmp, dpkt.icmp.ICMP):
+        return None
+
+    if icmp.type == dpkt.icmp.ICMP_ECHOREPLY:
+        echo = icmp.data
+        if isinstance(echo, dpkt.icmp.ICMP.Echo) and echo.id == pid:
+            return echo.seq, OK, None
+
+    elif icmp.type == dpkt.icmp.ICMP_UNREACH and icmp.code == dpkt.icmp.ICMP_UNREACH_NEEDFRAG:
+        unreach = icmp.data
+        if not isinstance(unreach, dpkt.icmp.ICMP.Unreach):
+            return None
+
+        # Quoted original datagram, our echo request's header at least.
+        quote = unreach.ip.data
+        if isinstance(quote, dpkt.icmp.ICMP) and isinstance(quote.data, dpkt.icmp.ICMP.Echo):
+            if quote.data.id == pid:
+                return quote.data.seq, TOO_BIG, unreach.mtu or None
+
+    # Done.
+    return None
+
+#################################################
+
+
+class PathMtu(object):
+    """
+    Binary search for the largest payload that reaches a host without being fragmented.
+
+    sock: raw ICMP socket, default is a new one just for this search.
+    pid: echo id.
+    timeout: milliseconds to wait for each probe.
+    retries: times to repeat a probe that got no answer before counting its size as too big.
+    """
+    def __init__(self, sock=None, pid=None, timeout=None, retries=None):
+        if not pid:
+            pid = os.getpid()
+
+        if not timeout:
+            timeout = 1000.  # milliseconds
+
+        if retries is None:
+            retries = 2
+
+        self.own_socket = sock is None
+        if self.own_socket:
+            sock = engine.create_engine_socket()
+        set_dont_fragment(sock)
+
+        self.sock = sock
+        self.pid = pid & 0xffff
+        self.timeout = timeout
+        self.retries = retries
+        self.seq = 0
+        self.count_send = 0
+        self.buf = bytearray(0x10000)
+
+        # One payload, as big as the largest probe so far, cut down to size for each probe.
+        self.payload = b''
+
+
+
+    def close(self):
+        if self.own_socket:
+            self.sock.close()
+
+
+
+    def _packet(self, data_size):
+        """
+        Echo request with this payload size.  Not one of the shared templates, a search goes
+        through far too many sizes to keep one of each.
+        """
+        if len(self.payload) < data_size:
+            self.payload = packets.make_payload(data_size)
+
+        packet = bytearray(packets.ICMP_HEADER_SIZE) + self.payload[:data_size]
+        struct.pack_into('>BBHHH', packet, 0, dpkt.icmp.ICMP_ECHO, 0, 0, self.pid, self.seq)
+        struct.pack_into('>H', packet, 2, dpkt.in_cksum(bytes(packet)))
+
+        # Done.
+        return packet
+
+
+
+    def probe(self, host_addr, data_size):
+        """
+        Send one probe with DF set.  Returns (outcome, mtu).
+        """
+        self.seq = (self.seq + 1) & 0xffff
+        self.count_send += 1
+        packet = self._packet(data_size)
+
+        try:
+            self.sock.sendto(packet, (host_addr, 0))
+        except socket.error as e:
+            if e.errno == errno.EMSGSIZE:
+                # Too big for our own interface.
+                return TOO_BIG, None
+            raise
+
+        deadline = engine.clock() + self.timeout / 1000.
+        while True:
+            wait = deadline - engine.clock()
+            if wait <= 0:
+                return LOST, None
+
+            readable, _, _ = select.select([self.sock], [], [], wait)
+            if not readable:
+                return LOST, None
+
+            try:
+                nbytes = self.sock.recv_into(self.buf)
+            except socket.error as e:
+                if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    continue
+                raise
+
+            packet = parse_packet(bytes(self.buf[:nbytes]), self.pid)
+            if packet:
+                seq, outcome, mtu = packet
+                if seq == self.seq:
+                    return outcome, mtu
+
+
+
+    def search(self, host_addr, size_min=None, size_max=None):
+        """
+        Find the largest payload between size_min and size_max that gets through.  Returns a
+        dict with the payload size, the path MTU it makes, and the number of probes sent.
+        """
+        if not size_min:
+            size_min = 0
+
+        if not size_max:
+            size_max = 0xffff - HEADER_SIZE
+
+        self.count_send = 0
+
+        def attempt(data_size):
+            for k in range(self.retries + 1):
+                outcome, mtu = self.probe(host_addr, data_size)
+                if outcome != LOST:
+                    return outcome, mtu
+            return LOST, None
+
+        # The smallest size has to make it, or there is nothing to search.
+        outcome, mtu = attempt(size_min)
+        if outcome != OK:
+            raise PmtuError('No reply from {:s} even at {:d} bytes'.format(host_addr, size_min))
+
+        lo, hi = size_min, size_max
+        size_next = None
+        while lo < hi:
+            if size_next is None:
+                size_next = (lo + hi + 1) // 2
+
+            outcome, mtu = attempt(size_next)
+
+            if outcome == OK:
+                lo = size_next
+                size_next = None
+
+            else:
+                hi = size_next - 1
+                size_next = None
+
+                if mtu:
+                    # Router told us the next hop MTU, try exactly that next.
+                    size_hint = mtu - HEADER_SIZE
+                    if lo < size_hint <= hi:
+                        hi = size_hint
+                        size_next = size_hint
+
+        result = {'host_addr': host_addr,
+                  'data_size': lo,
+                  'mtu': lo + HEADER_SIZE,
+                  'count_send': self.count_send}
+
+        # Done.
+        return result
+
+
+
+def discover(host_addr, size_min=None, size_max=None, timeout=None, retries=None):
+    """
+    Path MTU to one host, see PathMtu.search().
+    """
+    finder = PathMtu(timeout=timeout, retries=retries)
+    try:
+        result = finder.search(host_addr, size_min=size_min, size_max=size_max)
+    finally:
+        finder.close()
+
+    # Done.
+    return result
@@ -0,0 +1,369 @@
+#!/usr/bin/env python
+
+#
+# Copyright 2011 Pierre V. Villeneuve
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+
+"""
+Compact binary log of every probe, read back with mmap and NumPy.
+
+A log is a 16 byte header followed by fixed size 24 byte little endian records, one per probe:
+
+    timestamp   float64   seconds since the epoch, when the outcome was known.
+    target      uint32    index into the log's target table.
+    data_size   uint16    payload size, bytes.
+    seq         uint16    echo sequence number.
+    rtt_us      uint32    ping time, microseconds.  RTT_NONE if there was no good reply.
+    status      uint8     index into STATUSES.
+    ttl         uint8     IP time to live for traceroute probes, 0 otherwise.
+    (2 bytes padding)
+
+Host names and addresses are kept once each in a small text file next to the log, path +
+'.targets', one tab separated "name address" line per target, its index being its line number.
+
+The log is only ever appended to, a buffer at a time.  A log left with part of a record at the end
+by a crash is cut back to its last whole record when opened again, and likewise its target table
+to its last whole line.  read_log() maps the file into memory and hands back a NumPy structured
+array over it without copying or parsing anything, so weeks of probes can be filtered and
+aggregated as whole arrays.  NumPy is only needed for reading, iter_log() does without.
+"""
+
+from __future__ import division, print_function #, unicode_literals
+
+import io
+import mmap
+import os
+import struct
+import warnings
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+MAGIC = b'PSWPLOG\x00'
+VERSION = 1
+
+HEADER = struct.Struct('<8sII')         # magic, version, record size.
+RECORD = struct.Struct('<dIHHIBB2x')
+
+STATUSES = ('ok', 'timeout', 'corrupt', 'error')
+
+STATUS_CODES = dict((status, code) for code, status in enumerate(STATUSES))
+
+RTT_NONE = 0xffffffff
+
+RECORD_NAMES = ('timestamp', 'target', 'data_size', 'seq', 'rtt_us', 'status', 'ttl')
+
+if np is not None:
+    DTYPE = np.dtype({'names': list(RECORD_NAMES),
+                      'formats': ['<f8', '<u4', '<u2', '<u2', '<u4', 'u1', 'u1'],
+                      'offsets': [0, 8, 12, 14, 16, 20, 21],
+                      'itemsize': RECORD.size})
+else:
+    DTYPE = None
+
+
+#################################################
+
+class ProbeLogError(Exception):
+    pass
+
+
+
+def targets_path(path):
+    """
+    Target table file for a log.
+    """
+    return path + '.targets'
+
+
+
+def read_targets(path):
+    """
+    Target table of a log, a list of (host_name, host_addr) by target index.  A last line cut
+    short by a crash is left out, no record refers to it yet.  Any other line that does not
+    hold a name and an address keeps its index as (None, None), with a warning.
+    """
+    targets = []
+    try:
+        with io.open(targets_path(path), encoding='utf-8', errors='replace') as fi:
+            for number, line in enumerate(fi, 1):
+                if not line.endswith('\n'):
+                    break
+
+                fields = line.rstrip('\n').split('\t')
+                if len(fields) != 2:
+                    warnings.warn('Malformed target on line {:d} of {:s}'.format(
+                        number, targets_path(path)))
+                    fields = None, None
+                targets.append(tuple(fields))
+    except IOError:
+        pass
+
+    # Done.
+    return targets
+
+
+
+def _text(value):
+    """
+    Unicode for a host name or address, whether it came in as bytes or text.
+    """
+    if isinstance(value, bytes):
+        return value.decode('utf-8')
+
+    # Done.
+    return value
+
+
+
+def _check_header(data, path):
+    """
+    Raise ProbeLogError unless data starts with a good header.
+    """
+    if len(data) < HEADER.size:
+        raise ProbeLogError('Not a probe log: {:s}'.format(path))
+
+    magic, version, record_size = HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise ProbeLogError('Not a probe log: {:s}'.format(path))
+
+    if version != VERSION or record_size != RECORD.size:
+        raise ProbeLogError('Unsupported probe log version {:d}: {:s}'.format(version, path))
+
+#################################################
+
+
+class ProbeLog(object):
+    """
+    Append-only writer for a probe log.  Records are packed into a buffer that is written out
+    whenever it fills up.
+
+    path: log file.  An existing log is added to.
+    buffer_size: bytes to gather before each write.
+    """
+    def __init__(self, path, buffer_size=None):
+        if not buffer_size:
+            buffer_size = 1 << 16
+
+        self.path = path
+        self.buffer_size = buffer_size
+        self.buffer = bytearray()
+
+        targets = read_targets(path)
+        self.targets = dict((target, index) for index, target in enumerate(targets))
+        self.count_targets = len(targets)
+
+        self.fo = open(path, 'ab')
+        try:
+            self._start()
+        except Exception:
+            self.fo.close()
+            raise
+
+        self._cut_targets()
+        self.fo_targets = io.open(targets_path(path), 'a', encoding='utf-8')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+
+    def _start(self):
+        """
+        Write the header of a new log, or check an old one's and cut off any partial record.
+        """
+        size = os.fstat(self.fo.fileno()).st_size
+        if not size:
+            self.fo.write(HEADER.pack(MAGIC, VERSION, RECORD.size))
+            self.fo.flush()
+            return
+
+        with open(self.path, 'rb') as fi:
+            _check_header(fi.read(HEADER.size), self.path)
+
+        extra = (size - HEADER.size) % RECORD.size
+        if extra:
+            self.fo.truncate(size - extra)
+
+
+
+    def _cut_targets(self):
+        """
+        Cut the target table back to its last whole line, so new targets start on a line of
+        their own.
+        """
+        try:
+            with open(targets_path(self.path), 'rb+') as fo:
+                data = fo.read()
+                end = data.rfind(b'\n') + 1
+                if end < len(data):
+                    fo.truncate(end)
+        except IOError:
+            pass
+
+
+
+    def target_index(self, host_name, host_addr):
+        """
+        Index of a target in the log's table, adding it if new.  New targets are written out
+        right away, before any record that refers to them.  Names and addresses are looked up as
+        text, the same whether they came from the command line or from the table on disk.
+        """
+        target = _text(host_name), _text(host_addr)
+        index = self.targets.get(target)
+        if index is None:
+            index = self.targets[target] = self.count_targets
+            self.count_targets += 1
+            self.fo_targets.write(u'{:s}\t{:s}\n'.format(*target))
+            self.fo_targets.flush()
+
+        # Done.
+        return index
+
+
+
+    def append(self, timestamp, host_name, host_addr, data_size, seq, time_ping, status, ttl=None):
+        """
+        Add one probe.
+
+        time_ping: milliseconds, None if there was no good reply.
+        status: one of STATUSES.
+        """
+        if time_ping is None:
+            rtt_us = RTT_NONE
+        else:
+            rtt_us = min(int(round(time_ping * 1000.)), RTT_NONE - 1)
+
+        self.buffer += RECORD.pack(timestamp, self.target_index(host_name, host_addr), data_size,
+                                   seq, rtt_us, STATUS_CODES[status], ttl or 0)
+
+        if len(self.buffer) >= self.buffer_size:
+            self.flush()
+
+
+
+    def flush(self):
+        """
+        Write out the buffer.
+        """
+        if self.buffer:
+            self.fo.write(self.buffer)
+            self.fo.flush()
+            self.buffer = bytearray()
+
+
+
+    def close(self):
+        """
+        Write out the buffer and close the log.
+        """
+        if self.fo.closed:
+            return
+
+        try:
+            self.flush()
+        finally:
+            self.fo.close()
+            self.fo_targets.close()
+
+#################################################
+
+
+def _map(path):
+    """
+    Map a log into memory.  Returns (mmap, record count), the mmap None for an empty log.
+    """
+    with open(path, 'rb') as fi:
+        size = os.fstat(fi.fileno()).st_size
+        _check_header(fi.read(HEADER.size), path)
+
+        count = (size - HEADER.size) // RECORD.size
+        if not count:
+            return None, 0
+
+        data = mmap.mmap(fi.fileno(), 0, access=mmap.ACCESS_READ)
+
+    # Done.
+    return data, count
+
+
+
+def read_log(path):
+    """
+    Read a probe log without copying it.  Returns (records, targets): records a read-only NumPy
+    structured array of DTYPE over the mapped file, targets the list of (host_name, host_addr)
+    that records['target'] indexes.  Needs NumPy.
+    """
+    if np is None:
+        raise ProbeLogError('Reading probe logs as arrays needs NumPy, which is not installed')
+
+    data, count = _map(path)
+    if data is None:
+        records = np.zeros(0, dtype=DTYPE)
+    else:
+        # The array keeps the mapping open for as long as it is in use.
+        records = np.frombuffer(data, dtype=DTYPE, count=count, offset=HEADER.size)
+
+    # Done.
+    return records, read_targets(path)
+
+
+
+def iter_log(path):
+    """
+    Generate each record of a probe log as a dict, plus 'host_name', 'host_addr' and 'time_ping'
+    in milliseconds, None if there was no good reply.  Slow, but needs nothing beyond Python.
+    """
+    targets = read_targets(path)
+
+    data, count = _map(path)
+    if data is None:
+        return
+
+    try:
+        for k in range(count):
+            values = RECORD.unpack_from(data, HEADER.size + k * RECORD.size)
+            record = dict(zip(RECORD_NAMES, values))
+
+            record['status'] = STATUSES[record['status']]
+            record['host_name'], record['host_addr'] = targets[record['target']]
+            if record['rtt_us'] == RTT_NONE:
+                record['time_ping'] = None
+            else:
+                record['time_ping'] = record['rtt_us'] / 1000.
+
+            yield record
+    finally:
+        data.close()
+
+
+
+def time_ping(records):
+    """
+    Ping times in milliseconds from an array of records, NaN where there was no good reply.
+    """
+    times = records['rtt_us'] / 1000.
+    times[records['rtt_us'] == RTT_NONE] = np.nan
+
+    # Done.
+    return times
@@ -0,0 +1,364 @@
+#!/usr/bin/env python
+
+#
+# Copyright 2011 Pierre V. Villeneuve
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Receive path without allocation churn.
+
+Packets are read with recv_into() into preallocated buffers, and echo replies are picked apart
+straight from the buffer instead of building dpkt IP and ICMP objects for every packet.
+
+IPv6 works the same way with ICMPv6 type numbers.  Raw ICMPv6 sockets never pass up the IP
+header, so ip_header is always False for them.
+"""
+
+from __future__ import division, print_function #, unicode_literals
+
+import socket
+import struct
+import zlib
+
+import dpkt
+
+
+BUFFER_SIZE = 0x10000   # big enough for any IPv4 datagram.
+
+ICMP_ECHOREPLY = dpkt.icmp.ICMP_ECHOREPLY
+ICMP6_ECHO_REPLY = dpkt.icmp6.ICMP6_ECHO_REPLY
+IP_PROTO_ICMP = dpkt.ip.IP_PROTO_ICMP
+
+# ICMP errors that mean a probe won't be answered.
+ICMP_ERROR_TYPES = (dpkt.icmp.ICMP_UNREACH, dpkt.icmp.ICMP_TIMEXCEED)
+
+ERROR_NAMES = {
+    (dpkt.icmp.ICMP_UNREACH, dpkt.icmp.ICMP_UNREACH_NET): 'net unreachable',
+    (dpkt.icmp.ICMP_UNREACH, dpkt.icmp.ICMP_UNREACH_HOST): 'host unreachable',
+    (dpkt.icmp.ICMP_UNREACH, dpkt.icmp.ICMP_UNREACH_PROTO): 'protocol unreachable',
+    (dpkt.icmp.ICMP_UNREACH, dpkt.icmp.ICMP_UNREACH_PORT): 'port unreachable',
+    (dpkt.icmp.ICMP_UNREACH, dpkt.icmp.ICMP_UNREACH_NEEDFRAG): 'fragmentation needed',
+    (dpkt.icmp.ICMP_UNREACH, dpkt.icmp.ICMP_UNREACH_NET_PROHIB): 'net prohibited',
+    (dpkt.icmp.ICMP_UNREACH, dpkt.icmp.ICMP_UNREACH_HOST_PROHIB): 'host prohibited',
+    (dpkt.icmp.ICMP_UNREACH, dpkt.icmp.ICMP_UNREACH_FILTER_PROHIB): 'filtered',
+    (dpkt.icmp.ICMP_TIMEXCEED, dpkt.icmp.ICMP_TIMEXCEED_INTRANS): 'ttl exceeded',
+    (dpkt.icmp.ICMP_TIMEXCEED, dpkt.icmp.ICMP_TIMEXCEED_REASS): 'reassembly timeout',
+}
+
+ICMP6_ERROR_TYPES = (dpkt.icmp6.ICMP6_DST_UNREACH, dpkt.icmp6.ICMP6_PACKET_TOO_BIG,
+                     dpkt.icmp6.ICMP6_TIME_EXCEEDED)
+
+# RFC 4443, section 3.
+ERROR6_NAMES = {
+    (dpkt.icmp6.ICMP6_DST_UNREACH, 0): 'no route',
+    (dpkt.icmp6.ICMP6_DST_UNREACH, 1): 'prohibited',
+    (dpkt.icmp6.ICMP6_DST_UNREACH, 2): 'beyond scope',
+    (dpkt.icmp6.ICMP6_DST_UNREACH, 3): 'address unreachable',
+    (dpkt.icmp6.ICMP6_DST_UNREACH, 4): 'port unreachable',
+    (dpkt.icmp6.ICMP6_DST_UNREACH, 5): 'source policy failed',
+    (dpkt.icmp6.ICMP6_DST_UNREACH, 6): 'reject route',
+    (dpkt.icmp6.ICMP6_PACKET_TOO_BIG, 0): 'packet too big',
+    (dpkt.icmp6.ICMP6_TIME_EXCEEDED, 0): 'hop limit exceeded',
+    (dpkt.icmp6.ICMP6_TIME_EXCEEDED, 1): 'reassembly timeout',
+}
+
+# ICMP errors on a datagram socket, from linux/in.h, linux/in6.h and linux/errqueue.h.
+IP_RECVERR = 11
+IPV6_RECVERR = 25
+SO_EE_ORIGIN_ICMP = 2
+SO_EE_ORIGIN_ICMP6 = 3
+
+ERROR_CONTROL_SIZE = 128   # bytes, room for the struct sock_extended_err and who sent it.
+
+_CMSG_HEADER = struct.Struct('@Lii')        # struct cmsghdr: cmsg_len, cmsg_level, cmsg_type
+_EXTENDED_ERR = struct.Struct('@IBBBBII')   # struct sock_extended_err
+_ALIGN = struct.calcsize('@L')              # size_t on Linux
+
+try:
+    # Python 2: zero-copy read-only slice, which is what zlib.crc32 wants.
+    _readonly = buffer
+except NameError:
+    def _readonly(buf, offset, size):
+        return memoryview(buf)[offset:offset+size]
+
+
+#################################################
+
+def payload_digest(buf, offset=0, size=None):
+    """
+    CRC32 digest of a payload, computed in place.
+    """
+    if size is None:
+        size = len(buf) - offset
+
+    # Done.
+    return zlib.crc32(_readonly(buf, offset, size)) & 0xffffffff
+
+
+
+def parse_echo_reply(buf, nbytes, ip_header=True, family=None):
+    """
+    Pick apart an ICMP echo reply sitting in a receive buffer.
+
+    Returns (id, seq, payload offset, payload size), or None if the packet is anything other than
+    a well formed echo reply.
+
+    ip_header: True for raw IPv4 sockets, where the kernel hands over the IP header as well.
+    family: socket.AF_INET6 for an ICMPv6 echo reply, default IPv4.
+    """
+    if family == socket.AF_INET6:
+        reply_type = ICMP6_ECHO_REPLY
+    else:
+        reply_type = ICMP_ECHOREPLY
+
+    offset = 0
+    if ip_header:
+        if nbytes < 20:
+            return None
+
+        v_hl = buf[0]
+        if v_hl >> 4 != 4 or buf[9] != IP_PROTO_ICMP:
+            return None
+
+        offset = (v_hl & 0x0f) << 2
+
+    if nbytes < offset + 8 or buf[offset] != reply_type:
+        return None
+
+    echo_id, echo_seq = struct.unpack_from('>HH', buf, offset + 4)
+
+    # Done.
+    return echo_id, echo_seq, offset + 8, nbytes - offset - 8
+
+
+
+def parse_icmp_error(buf, nbytes, ip_header=True, family=None):
+    """
+    Pick apart an ICMP error quoting one of our echo requests.  Errors are rare, so unlike echo
+    replies they are decoded with dpkt, whose ICMP.Quote classes unpack the quoted datagram.
+
+    Returns (type, code, id, seq) with the id and seq of the quoted echo request, or None if the
+    packet is anything else.
+
+    family: socket.AF_INET6 for an ICMPv6 error, default IPv4.
+    """
+    data = bytes(buf[:nbytes])
+    if family == socket.AF_INET6:
+        return _parse_icmp6_error(data)
+    try:
+        if ip_header:
+            icmp = dpkt.ip.IP(data).data
+        else:
+            icmp = dpkt.icmp.ICMP(data)
+    except dpkt.UnpackError:
+        return None
+
+    if not isinstance(icmp, dpkt.icmp.ICMP) or icmp.type not in ICMP_ERROR_TYPES:
+        return None
+
+    # Quote.unpack() turned the quoted bytes into an IP packet, if they were whole enough.
+    if not isinstance(icmp.data, dpkt.icmp.ICMP.Quote):
+        return None
+
+    quoted = icmp.data.ip.data
+    if not isinstance(quoted, dpkt.icmp.ICMP) or quoted.type != dpkt.icmp.ICMP_ECHO:
+        return None
+
+    if not isinstance(quoted.data, dpkt.icmp.ICMP.Echo):
+        return None
+
+    # Done.
+    return icmp.type, icmp.code, quoted.data.id, quoted.data.seq
+
+
+
+def _parse_icmp6_error(data):
+    try:
+        icmp = dpkt.icmp6.ICMP6(data)
+    except dpkt.UnpackError:
+        return None
+
+    if icmp.type not in ICMP6_ERROR_TYPES or not isinstance(icmp.data, dpkt.icmp6.ICMP6.Error):
+        return None
+
+    # Quoted request straight after the quoted IPv6 header, extension headers are not followed.
+    quoted = icmp.data.ip6.data
+    if not isinstance(quoted, dpkt.icmp6.ICMP6) or quoted.type != dpkt.icmp6.ICMP6_ECHO_REQUEST:
+        return None
+
+    if not isinstance(quoted.data, dpkt.icmp6.ICMP6.Echo):
+        return None
+
+    # Done.
+    return icmp.type, icmp.code, quoted.data.id, quoted.data.seq
+
+
+
+def parse_error_queue(buf, nbytes, control, family=None):
+    """
+    Pick apart an ICMP error read from a datagram socket's error queue with MSG_ERRQUEUE.  The
+    kernel hands over the quoted echo request's ICMP header as the data, with the echo id it put
+    there, and the error itself as a struct sock_extended_err in the ancillary data.
+
+    Returns (type, code, id, seq, offender), offender being the address that sent the error, or
+    None if it is anything else.
+
+    control: ancillary data that came with it.
+    family: socket.AF_INET6 for an ICMPv6 error, default IPv4.
+    """
+    if family == socket.AF_INET6:
+        level, option, origin = socket.IPPROTO_IPV6, IPV6_RECVERR, SO_EE_ORIGIN_ICMP6
+        request, error_types = dpkt.icmp6.ICMP6_ECHO_REQUEST, ICMP6_ERROR_TYPES
+    else:
+        level, option, origin = socket.IPPROTO_IP, IP_RECVERR, SO_EE_ORIGIN_ICMP
+        request, error_types = dpkt.icmp.ICMP_ECHO, ICMP_ERROR_TYPES
+
+    if nbytes < 8 or buf[0] != request:
+        return None
+
+    offset = 0
+    while offset + _CMSG_HEADER.size <= len(control):
+        cmsg_len, cmsg_level, cmsg_type = _CMSG_HEADER.unpack_from(control, offset)
+        if cmsg_len < _CMSG_HEADER.size:
+            break
+
+        if (cmsg_level, cmsg_type) == (level, option):
+            start = offset + _CMSG_HEADER.size
+            ee_errno, ee_origin, ee_type, ee_code, _, _, _ = _EXTENDED_ERR.unpack_from(control,
+                                                                                      start)
+            if ee_origin != origin or ee_type not in error_types:
+                return None
+
+            echo_id, echo_seq = struct.unpack_from('>HH', buf, 4)
+            offender = _unpack_offender(control[start + _EXTENDED_ERR.size:offset + cmsg_len])
+            return ee_type, ee_code, echo_id, echo_seq, offender
+
+        offset += (cmsg_len + _ALIGN - 1) & ~(_ALIGN - 1)
+
+    # Done.
+    return None
+
+
+
+def _unpack_offender(raw):
+    """
+    Address from the struct sockaddr after a struct sock_extended_err, None if there isn't one.
+    """
+    if len(raw) < 8:
+        return None
+
+    family = struct.unpack_from('@H', raw)[0]
+    if family == socket.AF_INET:
+        return socket.inet_ntoa(raw[4:8])
+
+    if family == socket.AF_INET6 and len(raw) >= 24:
+        return socket.inet_ntop(socket.AF_INET6, raw[8:24])
+
+    # Done.
+    return None
+
+
+
+def is_time_exceeded(icmp_type, family=None):
+    """
+    Return True for a time exceeded (IPv4) or hop limit exceeded (IPv6) error type.
+    """
+    if family == socket.AF_INET6:
+        return icmp_type == dpkt.icmp6.ICMP6_TIME_EXCEEDED
+
+    # Done.
+    return icmp_type == dpkt.icmp.ICMP_TIMEXCEED
+
+
+
+def error_name(icmp_type, icmp_code, family=None):
+    """
+    Short description of an ICMP error, e.g. 'host unreachable'.
+    """
+    if family == socket.AF_INET6:
+        name = ERROR6_NAMES.get((icmp_type, icmp_code))
+        if name:
+            return name
+        return 'icmp6 type {:d} code {:d}'.format(icmp_type, icmp_code)
+
+    name = ERROR_NAMES.get((icmp_type, icmp_code))
+    if name:
+        return name
+
+    if icmp_type == dpkt.icmp.ICMP_UNREACH:
+        return 'unreachable code {:d}'.format(icmp_code)
+
+    # Done.
+    return 'time exceeded code {:d}'.format(icmp_code)
+
+#################################################
+
+
+class BufferPool(object):
+    """
+    Preallocated receive buffers, handed out and returned instead of allocating per packet.
+
+    count: number of buffers.
+    size: bytes per buffer.
+    """
+    def __init__(self, count=None, size=None):
+        if not count:
+            count = 8
+
+        if not size:
+            size = BUFFER_SIZE
+
+        self.size = size
+        self.free = [bytearray(size) for k in range(count)]
+
+    def __len__(self):
+        return len(self.free)
+
+
+
+    def acquire(self):
+        """
+        Take a buffer from the pool, or make a new one if the pool is empty.
+        """
+        if self.free:
+            return self.free.pop()
+
+        # Done.
+        return bytearray(self.size)
+
+
+
+    def release(self, buf):
+        """
+        Give a buffer back to the pool.
+        """
+        self.free.append(buf)
+
+#################################################
+
+
+_pool = None
+
+def get_pool():
+    """
+    Buffer pool shared by callers that do not keep their own.
+    """
+    global _pool
+    if _pool is None:
+        _pool = BufferPool()
+
+    # Done.
+    return _pool
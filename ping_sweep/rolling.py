@@ -0,0 +1,176 @@
+#!/usr/bin/env python
+
+#
+# Copyright 2011 Pierre V. Villeneuve
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+
+"""
+Rolling window statistics for long running sweeps.
+
+Each (host, size) series keeps one ring of Tallies per window, e.g. the last minute, five minutes
+and hour.  A ring is a fixed number of slots, each covering an equal slice of the window, so
+memory stays bounded however long the monitor runs.  Finished tallies are merged into the current
+slot, and a window's figures are the merge of its live slots.  The window covered is therefore
+between (slots - 1)/slots of its span and all of it.
+
+RollingStats may be read from other threads while the sweep goes on.  One lock covers every
+series, but a snapshot takes it afresh for each series it reads and lets go in between, so a
+reader walking many series never holds up probing for long.
+"""
+
+from __future__ import division, print_function #, unicode_literals
+
+import threading
+
+import accumulator
+
+
+WINDOWS = (60., 300., 3600.)   # seconds
+
+SLOTS = 12
+
+
+#################################################
+
+class RollingTally(object):
+    """
+    Tally of everything added over the last span seconds, as a ring of slot Tallies.
+
+    span: window length, seconds.
+    slots: number of slices the window is kept in.
+    """
+    def __init__(self, span, slots=None):
+        if not slots:
+            slots = SLOTS
+
+        self.span = span
+        self.slots = slots
+        self.width = span / slots
+
+        # Slot k holds epoch self.epochs[k], the count of slot widths since time zero.
+        self.tallies = [None] * slots
+        self.epochs = [None] * slots
+        self.time_last = None
+
+
+
+    def add(self, tally, time_now):
+        """
+        Merge a Tally into the slot for time_now.
+        """
+        epoch = int(time_now // self.width)
+        k = epoch % self.slots
+
+        if self.epochs[k] != epoch:
+            # Slot last used a whole ring ago, start it over.
+            self.tallies[k] = accumulator.Tally()
+            self.epochs[k] = epoch
+
+        self.tallies[k].merge(tally)
+        self.time_last = time_now
+
+
+
+    def total(self, time_now):
+        """
+        New Tally merging every slot still inside the window at time_now.
+        """
+        epoch_now = int(time_now // self.width)
+
+        total = accumulator.Tally()
+        for tally, epoch in zip(self.tallies, self.epochs):
+            if epoch is not None and epoch_now - self.slots < epoch <= epoch_now:
+                total.merge(tally)
+
+        # Done.
+        return total
+
+#################################################
+
+
+class RollingStats(object):
+    """
+    Rolling windows for many series, keyed by the caller, e.g. (host_name, data_size).
+
+    windows: window spans, seconds.
+    slots: slices per window.
+    """
+    def __init__(self, windows=None, slots=None):
+        if not windows:
+            windows = WINDOWS
+
+        self.windows = tuple(windows)
+        self.slots = slots
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.series)
+
+
+
+    def add(self, key, tally, time_now):
+        """
+        Add a finished Tally to every window of a series.
+        """
+        with self.lock:
+            rings = self.series.get(key)
+            if rings is None:
+                rings = [RollingTally(span, slots=self.slots) for span in self.windows]
+                self.series[key] = rings
+
+            for ring in rings:
+                ring.add(tally, time_now)
+
+
+
+    def prune(self, time_now):
+        """
+        Forget series with nothing left in even the longest window, such as hosts no longer
+        swept.  Returns the number forgotten.
+        """
+        span = max(self.windows)
+        with self.lock:
+            stale = [key for key, rings in self.series.items()
+                     if time_now - rings[0].time_last > span]
+            for key in stale:
+                del self.series[key]
+
+        # Done.
+        return len(stale)
+
+
+
+    def snapshot(self, window, time_now):
+        """
+        Current figures for one window across every series.  Returns a list of (key, Tally) in
+        key order.  Safe to call from another thread while tallies are being added.
+
+        window: one of the window spans, seconds.
+        """
+        index = self.windows.index(window)
+
+        with self.lock:
+            items = sorted(self.series.items())
+
+        totals = []
+        for key, rings in items:
+            with self.lock:
+                totals.append((key, rings[index].total(time_now)))
+
+        # Done.
+        return totals
@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+
+#
+# Copyright 2011 Pierre V. Villeneuve
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+
+"""
+Adaptive reply timeouts from observed round trip times, after RFC 6298.
+
+A fixed timeout has to be long enough for the slowest target, so a lost probe to a fast one
+sits waiting for far longer than any reply could take.  Here each target keeps a smoothed round
+trip time SRTT and its mean deviation RTTVAR, and waits SRTT + 4 RTTVAR for each reply, within a
+floor and a ceiling.  A timeout doubles the wait for the next probe, so a target that suddenly
+slows down is not counted as losing everything.
+
+All times are milliseconds.
+"""
+
+from __future__ import division, print_function #, unicode_literals
+
+
+# RFC 6298 gains and deviation multiplier.
+ALPHA = 1 / 8
+BETA = 1 / 4
+K = 4
+
+
+#################################################
+
+class RttEstimator(object):
+    """
+    Retransmission timeout for one target.
+
+    floor: shortest timeout allowed.
+    ceiling: longest timeout allowed.
+    timeout_initial: timeout until the first round trip time is measured.  Default is the
+                     ceiling.
+    granularity: least margin above SRTT, covers clock and scheduling resolution.
+    """
+    def __init__(self, floor, ceiling, timeout_initial=None, granularity=None):
+        if not timeout_initial:
+            timeout_initial = ceiling
+
+        if not granularity:
+            granularity = 1.  # milliseconds
+
+        self.floor = floor
+        self.ceiling = ceiling
+        self.granularity = granularity
+
+        self.srtt = None
+        self.rttvar = None
+        self.timeout = self._clamp(timeout_initial)
+
+
+
+    def _clamp(self, timeout):
+        return min(max(timeout, self.floor), self.ceiling)
+
+
+
+    def sample(self, time_ping):
+        """
+        Fold in one measured round trip time.  Every probe carries its own sequence number, so
+        unlike TCP retransmissions there is no ambiguity and late replies count too.
+        """
+        if self.srtt is None:
+            self.srtt = time_ping
+            self.rttvar = time_ping / 2
+        else:
+            self.rttvar = (1 - BETA) * self.rttvar + BETA * abs(self.srtt - time_ping)
+            self.srtt = (1 - ALPHA) * self.srtt + ALPHA * time_ping
+
+        self.timeout = self._clamp(self.srtt + max(self.granularity, K * self.rttvar))
+
+
+
+    def backoff(self):
+        """
+        A probe timed out, wait twice as long for the next one.
+        """
+        self.timeout = self._clamp(2 * self.timeout)
@@ -0,0 +1,226 @@
+#!/usr/bin/env python
+
+#
+# Copyright 2011 Pierre V. Villeneuve
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Probe scheduling with token bucket rate limits.
+
+Scheduler decides which target may send next.  Each target gets send slots on an absolute
+timeline, spaced by a fixed interval and optionally limited by its own token bucket.  A global
+token bucket caps the packet rate across all targets.  Slots follow from the previous slot, not
+from when the previous probe actually went out, so time spent sending and receiving does not
+make the schedule drift.
+
+All times are seconds on the caller's monotonic clock.
+"""
+
+from __future__ import division, print_function #, unicode_literals
+
+import heapq
+import itertools
+
+
+# Slack for floating point round off when a bucket is due to refill to exactly one token.
+_EPSILON = 1e-9
+
+
+#################################################
+
+class TokenBucket(object):
+    """
+    Tokens trickle in at a steady rate up to a maximum.  Each packet sent takes one.
+
+    rate: tokens per second.
+    burst: most tokens the bucket will hold, i.e. largest burst allowed.
+    time_start: clock time the bucket starts, full.  Default is the first refill.
+    """
+    def __init__(self, rate, burst=None, time_start=None):
+        if not burst:
+            burst = 1
+
+        self.rate = float(rate)
+        self.burst = burst
+        self.tokens = float(burst)
+        self.time_last = time_start
+
+
+
+    def refill(self, time_now):
+        """
+        Add the tokens earned since the last refill.
+        """
+        if self.time_last is None:
+            self.time_last = time_now
+
+        if time_now > self.time_last:
+            self.tokens = min(self.burst, self.tokens + (time_now - self.time_last) * self.rate)
+            self.time_last = time_now
+
+
+
+    def take(self, time_now, count=1):
+        """
+        Take count tokens if there are that many.  Return True if they were taken.
+        """
+        self.refill(time_now)
+        if self.tokens + _EPSILON < count:
+            return False
+
+        self.tokens = max(self.tokens - count, 0.)
+
+        # Done.
+        return True
+
+
+
+    def time_available(self, count=1):
+        """
+        Clock time at which count tokens will be in the bucket.  None if the bucket has not
+        been used yet, it starts out full.
+        """
+        if self.time_last is None or self.tokens >= count:
+            return self.time_last
+
+        # Done.
+        return self.time_last + (count - self.tokens) / self.rate
+
+#################################################
+
+
+class _Entry(object):
+    __slots__ = ('slot', 'bucket')
+
+    def __init__(self, slot, bucket):
+        self.slot = slot
+        self.bucket = bucket
+
+
+
+class Scheduler(object):
+    """
+    Interleave probes across many targets within per-target and global rate limits.
+
+    Targets are any hashable objects.  pop() hands out the next target due to send, the caller
+    sends one probe to it and then push()es it back if it has more to send.
+
+    interval: minimum seconds between probes to the same target.
+    rate: global packets per second across all targets, None for no limit.
+    target_rate: packets per second for each target, None for no limit beyond interval.
+    burst: largest global burst, packets.
+    target_burst: largest burst to one target, packets.
+    """
+    def __init__(self, interval=0., rate=None, target_rate=None, burst=None, target_burst=None):
+        self.interval = interval
+        self.target_rate = target_rate
+        self.target_burst = target_burst
+
+        if rate:
+            self.bucket = TokenBucket(rate, burst=burst)
+        else:
+            self.bucket = None
+
+        self.entries = {}
+        self.heap = []
+        self._order = itertools.count()
+
+    def __len__(self):
+        return len(self.heap)
+
+    def __contains__(self, target):
+        return target in self.entries
+
+
+
+    def add(self, target, time_start):
+        """
+        Add a target, first due to send at time_start.
+        """
+        if self.target_rate:
+            bucket = TokenBucket(self.target_rate, burst=self.target_burst, time_start=time_start)
+        else:
+            bucket = None
+
+        self.entries[target] = _Entry(time_start, bucket)
+        heapq.heappush(self.heap, (time_start, next(self._order), target))
+
+
+
+    def pop(self, time_now):
+        """
+        Return the target due to send now, or None if no target may send yet.  The target stays
+        registered, push() it back for its next probe or discard() it when finished.
+        """
+        if not self.heap or self.heap[0][0] > time_now:
+            return None
+
+        if self.bucket and not self.bucket.take(time_now):
+            return None
+
+        slot, order, target = heapq.heappop(self.heap)
+
+        entry = self.entries[target]
+        entry.slot = slot
+        if entry.bucket:
+            entry.bucket.take(time_now)
+
+        # Done.
+        return target
+
+
+
+    def push(self, target, time_now):
+        """
+        Schedule the next probe for a target that was just handed out by pop().
+        """
+        entry = self.entries[target]
+
+        # Next slot follows on from the last one.  Running more than a whole interval late means
+        # we were held up elsewhere, restart the timeline from now rather than catch up in a
+        # burst.
+        slot = entry.slot + self.interval
+        if slot < time_now:
+            slot = time_now + self.interval
+
+        if entry.bucket:
+            slot = max(slot, entry.bucket.time_available())
+
+        heapq.heappush(self.heap, (slot, next(self._order), target))
+
+
+
+    def discard(self, target):
+        """
+        Forget a target that was handed out by pop() and has nothing more to send.
+        """
+        self.entries.pop(target, None)
+
+
+
+    def time_next(self):
+        """
+        Earliest clock time at which pop() could return a target, or None if there are none.
+        """
+        if not self.heap:
+            return None
+
+        time_next = self.heap[0][0]
+        if self.bucket and self.bucket.time_last is not None:
+            time_next = max(time_next, self.bucket.time_available())
+
+        # Done.
+        return time_next
@@ -0,0 +1,260 @@
+#!/usr/bin/env python
+
+#
+# Copyright 2011 Pierre V. Villeneuve
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Sweeps sharded across worker processes.
+
+One process runs out of CPU in packet parsing and bookkeeping long before a fast link runs out
+of bandwidth.  Here the targets are handed out to several worker processes, each running its own
+sweep engine with its own socket and its own echo id.  Targets go out in chunks over a shared
+queue, so busy workers simply take fewer.  Each worker streams the Tally for every finished
+(host, size) back to the parent as soon as it is done, where they are merged.
+"""
+
+from __future__ import division, print_function #, unicode_literals
+
+import itertools
+import multiprocessing
+import os
+import threading
+import traceback
+
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+import engine
+
+
+POLL_INTERVAL = 0.5   # seconds between checks that the workers are still alive.
+
+
+#################################################
+
+class ShardError(Exception):
+    pass
+
+
+
+def _receive(inbox):
+    """
+    Generate (host_name, host_addr) from chunks arriving on the queue, until the end marker.
+    """
+    while True:
+        chunk = inbox.get()
+        if chunk is None:
+            return
+
+        for target in chunk:
+            yield target
+
+
+
+def _worker(index, inbox, outbox, size_sweep, count_send, options):
+    """
+    Body of one worker process.  Messages back to the parent are tuples tagged with the worker
+    index: 'cell' with a finished tally, 'error' with a traceback, and finally 'done'.
+    """
+    sweep = None
+    try:
+        # Finished cells are streamed back and let go of, only unfinished ones stay.
+        sweep = engine.SweepEngine(keep_cells=False, **options)
+
+        def finished(cell):
+            outbox.put((index, 'cell', cell.host_name, cell.data_size, cell.tally))
+
+        sweep.add_source(_receive(inbox), size_sweep, count_send=count_send)
+
+        try:
+            sweep.run(callback=finished)
+        except KeyboardInterrupt:
+            # The parent got the same interrupt, send back whatever made it so far.
+            pass
+
+        for cell in sweep.cells:
+            if cell.tally.count_send:
+                outbox.put((index, 'cell', cell.host_name, cell.data_size, cell.tally))
+
+    except Exception:
+        outbox.put((index, 'error', traceback.format_exc()))
+
+    if sweep:
+        outbox.put((index, 'done', sweep.timeout, sweep.time_pause))
+    else:
+        outbox.put((index, 'done', None, None))
+
+
+
+def _put(inbox, item, stop):
+    """
+    Put an item on the queue, waiting for room until stop is set.  Returns False if stopped.
+    """
+    while not stop.is_set():
+        try:
+            inbox.put(item, timeout=POLL_INTERVAL)
+        except queue.Full:
+            continue
+
+        return True
+
+    # Done.
+    return False
+
+
+
+def _feed(targets, inbox, workers, chunk_size, host_order, failures, stop):
+    """
+    Hand out targets in chunks, then one end marker per worker.  The order host names went out
+    in is kept in host_order.  An exception from the targets iterable, such as a bad target spec,
+    is kept in failures for the parent to raise.  Gives up once stop is set, such as when no
+    worker is left to take anything.
+    """
+    try:
+        targets = iter(targets)
+        while True:
+            chunk = list(itertools.islice(targets, chunk_size))
+            if not chunk:
+                break
+
+            for host_name, host_addr in chunk:
+                host_order.setdefault(host_name, len(host_order))
+            if not _put(inbox, chunk, stop):
+                return
+
+    except Exception as e:
+        failures.append(e)
+
+    finally:
+        for k in range(workers):
+            if not _put(inbox, None, stop):
+                break
+
+#################################################
+
+
+def run_sharded(targets, workers, size_sweep, count_send=None, chunk_size=None, **options):
+    """
+    Sweep targets, an iterable of (host_name, host_addr), on several worker processes.
+
+    Every worker gets its own socket and echo id.  A global rate limit is split evenly between
+    them.  Other keyword options are passed on to each worker's SweepEngine.
+
+    Returns (tallies, timeout, time_pause, interrupted).  tallies is a list of
+    ((host_name, data_size), Tally), in the order the hosts came in, then by size.  interrupted
+    is True after a user stop, with tallies holding whatever made it back.  Raises ShardError if
+    a worker fails, including one that dies without a word, once the others are done.
+    """
+    if not chunk_size:
+        chunk_size = 64
+
+    if options.get('rate'):
+        options['rate'] = options['rate'] / workers
+
+    # Distinct echo ids, so each worker's BPF filter only lets its own replies through.
+    pid_base = os.getpid()
+
+    inbox = multiprocessing.Queue(maxsize=4*workers)
+    outbox = multiprocessing.Queue()
+
+    # Targets left over after a user stop or a failed worker are simply dropped at exit.
+    inbox.cancel_join_thread()
+
+    procs = []
+    for index in range(workers):
+        options_worker = dict(options, pid=(pid_base + 1 + index) & 0xffff)
+        proc = multiprocessing.Process(target=_worker,
+                                       args=(index, inbox, outbox, size_sweep, count_send,
+                                             options_worker))
+        proc.daemon = True
+        proc.start()
+        procs.append(proc)
+
+    host_order = {}
+    failures = []
+    stop = threading.Event()
+    feeder = threading.Thread(target=_feed,
+                              args=(targets, inbox, workers, chunk_size, host_order, failures,
+                                    stop))
+    feeder.daemon = True
+    feeder.start()
+
+    # Merge as results stream in.
+    tallies = {}
+    errors = []
+    timeout = time_pause = None
+    interrupted = False
+
+    done = set()
+    silent = set()
+    while len(done) < workers:
+        try:
+            message = outbox.get(timeout=POLL_INTERVAL)
+        except KeyboardInterrupt:
+            # Workers got the interrupt too and are wrapping up, keep collecting.
+            interrupted = True
+            continue
+        except queue.Empty:
+            # A worker flushes its messages before it exits, so one found dead and then still
+            # silent for a whole poll has nothing more to say.
+            for index, proc in enumerate(procs):
+                if index in done or proc.is_alive():
+                    continue
+
+                if index in silent:
+                    errors.append('Worker {:d} exited with code {} before it was done, its '
+                                  'targets are lost'.format(index, proc.exitcode))
+                    done.add(index)
+                else:
+                    silent.add(index)
+            continue
+
+        kind = message[1]
+        if kind == 'cell':
+            host_name, data_size, tally = message[2:]
+            key = (host_name, data_size)
+            if key in tallies:
+                tallies[key].merge(tally)
+            else:
+                tallies[key] = tally
+
+        elif kind == 'error':
+            errors.append(message[2])
+
+        elif kind == 'done':
+            done.add(message[0])
+            if message[2] is not None:
+                timeout, time_pause = message[2:]
+
+    stop.set()
+    for proc in procs:
+        proc.join()
+
+    if failures:
+        raise failures[0]
+
+    if errors:
+        raise ShardError('Worker failed:\n{:s}'.format(errors[0]))
+
+    # Feeder may still be blocked on a full inbox after a user stop, take a copy.
+    host_order = dict(host_order)
+    results = sorted(tallies.items(), key=lambda item: (host_order[item[0][0]], item[0][1]))
+
+    # Done.
+    return results, timeout, time_pause, interrupted
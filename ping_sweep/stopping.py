@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+
+#
+# Copyright 2011 Pierre V. Villeneuve
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+
+"""
+Statistical stopping rule for sweeps.
+
+Rather than a fixed number of probes for every (host, size), sampling stops once two confidence
+intervals are narrow enough: the one on the median ping time, and the one on the loss rate.
+Probes saved on cells that settle quickly can then go to noisier cells of the same host.
+
+The median interval is distribution free, from the order statistics around the middle rank, read
+off the accumulator's histogram.  The loss rate interval is the Wilson score interval, which
+behaves well near zero loss where the textbook normal interval collapses.
+"""
+
+from __future__ import division, print_function #, unicode_literals
+
+import math
+
+
+#################################################
+
+def normal_quantile(confidence):
+    """
+    z such that a standard normal lies within +/- z with the given probability.  Found by
+    bisection on math.erf, which is plenty fast for something computed once.
+    """
+    if not 0. < confidence < 1.:
+        raise ValueError('Confidence must be between 0 and 1: {}'.format(confidence))
+
+    lo, hi = 0., 10.
+    while hi - lo > 1e-9:
+        mid = (lo + hi) / 2
+        if math.erf(mid / math.sqrt(2.)) < confidence:
+            lo = mid
+        else:
+            hi = mid
+
+    # Done.
+    return (lo + hi) / 2
+
+
+
+def wilson_interval(count_lost, count_send, z):
+    """
+    Wilson score interval (lo, hi) on the loss rate.
+    """
+    if not count_send:
+        return 0., 1.
+
+    p = count_lost / count_send
+    n = count_send
+    denom = 1 + z*z / n
+    center = (p + z*z / (2*n)) / denom
+    half = z * math.sqrt(p * (1 - p) / n + z*z / (4*n*n)) / denom
+
+    # Done.
+    return max(center - half, 0.), min(center + half, 1.)
+
+#################################################
+
+
+class StoppingRule(object):
+    """
+    Decide when a (host, size) cell has been sampled enough.
+
+    confidence: confidence level of both intervals.
+    median_precision: stop once the interval on the median is narrower than this fraction of the
+                      median.
+    loss_precision: stop once the interval on the loss rate is narrower than this.
+    min_count: fewest probes for any cell.
+    max_factor: most probes for any cell, as a multiple of its count_send.
+    """
+    def __init__(self, confidence=None, median_precision=None, loss_precision=None, min_count=None,
+                 max_factor=None):
+        if not confidence:
+            confidence = 0.95
+
+        if not median_precision:
+            median_precision = 0.1
+
+        if not loss_precision:
+            loss_precision = 0.2
+
+        if not min_count:
+            min_count = 10
+
+        if not max_factor:
+            max_factor = 4
+
+        self.confidence = confidence
+        self.median_precision = median_precision
+        self.loss_precision = loss_precision
+        self.min_count = min_count
+        self.max_factor = max_factor
+
+        self.z = normal_quantile(confidence)
+
+
+
+    def median_interval(self, tally):
+        """
+        Confidence interval (lo, hi) on the median ping time in milliseconds, or None with fewer
+        than two replies.
+        """
+        n = tally.accumulator.count
+        if n < 2:
+            return None
+
+        # Ranks of the order statistics bracketing the median, as percentiles.
+        half = self.z * 0.5 / math.sqrt(n)
+        lo = tally.accumulator.percentile(max(0.5 - half, 0.) * 100.)
+        hi = tally.accumulator.percentile(min(0.5 + half, 1.) * 100.)
+
+        # Done.
+        return lo, hi
+
+
+
+    def loss_interval(self, tally):
+        """
+        Confidence interval (lo, hi) on the loss rate.
+        """
+        return wilson_interval(tally.count_lost, tally.count_send, self.z)
+
+
+
+    def is_converged(self, tally):
+        """
+        Return True once both intervals are narrow enough.  A host that never answers has no
+        median to pin down, only its loss rate counts.
+        """
+        lo, hi = self.loss_interval(tally)
+        if hi - lo > self.loss_precision:
+            return False
+
+        if tally.accumulator.count:
+            interval = self.median_interval(tally)
+            if interval is None:
+                return False
+
+            lo, hi = interval
+            median = tally.accumulator.percentile(50.)
+            if hi - lo > self.median_precision * median:
+                return False
+
+        # Done.
+        return True
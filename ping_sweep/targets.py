@@ -0,0 +1,272 @@
+#!/usr/bin/env python
+
+#
+# Copyright 2011 Pierre V. Villeneuve
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Target list expansion.
+
+A target may be a host name or address, a CIDR block (10.0.0.0/16), an address range
+(10.1.2.10-200 or 10.1.2.10-10.1.3.20), or @file naming a file of further targets, one or more
+per line.  Everything is expanded lazily by generators, so even a /8 never sits in memory all at
+once.
+
+Blocks and ranges can be walked in random order.  A full period linear congruential generator
+over the next power of two visits every address exactly once without having to hold a shuffled
+list, the same trick used by large scale scanners.
+"""
+
+from __future__ import division, print_function #, unicode_literals
+
+import random
+import socket
+import struct
+
+
+_ADDRESS = struct.Struct('>I')
+
+
+#################################################
+
+class TargetError(Exception):
+    pass
+
+
+
+def address_to_int(host_addr):
+    """
+    Dotted quad IPv4 address to integer.
+    """
+    try:
+        packed = socket.inet_aton(host_addr)
+    except (socket.error, UnicodeError, TypeError):
+        raise TargetError('Not an IPv4 address: {:s}'.format(host_addr))
+
+    if host_addr.count('.') != 3:
+        raise TargetError('Not an IPv4 address: {:s}'.format(host_addr))
+
+    # Done.
+    return _ADDRESS.unpack(packed)[0]
+
+
+
+def int_to_address(value):
+    """
+    Integer to dotted quad IPv4 address.
+    """
+    return socket.inet_ntoa(_ADDRESS.pack(value))
+
+
+
+def is_address(host_addr):
+    """
+    Return True for a dotted quad IPv4 address.
+    """
+    try:
+        address_to_int(host_addr)
+    except TargetError:
+        return False
+
+    # Done.
+    return True
+
+
+
+def _count_up(first, count):
+    value = first
+    while value < first + count:
+        yield value
+        value += 1
+
+#################################################
+
+
+def parse_cidr(spec):
+    """
+    Parse 'a.b.c.d/n' into (first, count) integers.  The network and broadcast addresses are left
+    out of blocks with room for them.
+    """
+    host_addr, prefix = spec.split('/', 1)
+    try:
+        prefix = int(prefix)
+    except ValueError:
+        raise TargetError('Bad CIDR prefix length: {:s}'.format(spec))
+
+    if not 0 <= prefix <= 32:
+        raise TargetError('Bad CIDR prefix length: {:s}'.format(spec))
+
+    mask = (0xffffffff << (32 - prefix)) & 0xffffffff
+    first = address_to_int(host_addr) & mask
+    count = 1 << (32 - prefix)
+
+    if prefix <= 30:
+        first += 1
+        count -= 2
+
+    # Done.
+    return first, count
+
+
+
+def parse_range(spec):
+    """
+    Parse 'a.b.c.x-y' or 'a.b.c.d-e.f.g.h' into (first, count) integers.
+    """
+    start, stop = spec.split('-', 1)
+    first = address_to_int(start)
+
+    if '.' in stop:
+        last = address_to_int(stop)
+    else:
+        try:
+            octet = int(stop)
+        except ValueError:
+            raise TargetError('Bad address range: {:s}'.format(spec))
+
+        if not 0 <= octet <= 255:
+            raise TargetError('Bad address range: {:s}'.format(spec))
+
+        last = (first & 0xffffff00) | octet
+
+    if last < first:
+        raise TargetError('Address range runs backwards: {:s}'.format(spec))
+
+    # Done.
+    return first, last - first + 1
+
+
+
+def shuffled_range(count, rng=None):
+    """
+    Generate the integers 0 to count-1 once each, in random order, in constant memory.
+
+    x -> (a*x + c) mod m has full period when m is a power of two, c is odd and a = 1 mod 4
+    (Hull-Dobell).  The low bits of such a sequence repeat quickly, so each value is passed
+    through a xorshift-multiply mix, which is one to one and keeps every value visited once.
+    Values past the end are skipped, which costs at most a factor of two.
+    """
+    if rng is None:
+        rng = random.Random()
+
+    if count <= 0:
+        return
+
+    bits = 2
+    while (1 << bits) < count:
+        bits += 1
+    m = 1 << bits
+    shift = bits // 2 + 1
+
+    a = 4 * rng.randrange(m // 4) + 1
+    c = 2 * rng.randrange(m // 2) + 1
+    odd = 2 * rng.randrange(m // 2) + 1
+    x = rng.randrange(m)
+
+    # Plain loop, range() would build the whole list on Python 2.
+    k = 0
+    while k < m:
+        x = (a * x + c) % m
+
+        y = x ^ (x >> shift)
+        y = (y * odd) % m
+        y ^= y >> shift
+
+        if y < count:
+            yield y
+        k += 1
+
+#################################################
+
+
+def expand(spec, shuffle=False, rng=None):
+    """
+    Generate the individual targets named by one spec.
+
+    shuffle: walk CIDR blocks and ranges in random order.  Files are read in order, but the blocks
+             and ranges inside them are shuffled too.
+    """
+    spec = spec.strip()
+    if not spec:
+        return
+
+    if spec.startswith('@'):
+        for target in expand_file(spec[1:], shuffle=shuffle, rng=rng):
+            yield target
+        return
+
+    if '/' in spec:
+        first, count = parse_cidr(spec)
+    elif '-' in spec and is_address(spec.split('-', 1)[0]):
+        first, count = parse_range(spec)
+    else:
+        # Plain host name or address.
+        yield spec
+        return
+
+    if shuffle:
+        for offset in shuffled_range(count, rng=rng):
+            yield int_to_address(first + offset)
+    else:
+        for value in _count_up(first, count):
+            yield int_to_address(value)
+
+
+
+def expand_file(path, shuffle=False, rng=None):
+    """
+    Generate targets from a file, one or more specs per line.  Anything after # is a comment.
+    """
+    try:
+        fi = open(path)
+    except IOError as e:
+        raise TargetError('Unable to read target file: {:s} ({})'.format(path, e))
+
+    with fi:
+        for line in fi:
+            for spec in line.split('#', 1)[0].split():
+                for target in expand(spec, shuffle=shuffle, rng=rng):
+                    yield target
+
+
+
+def iter_targets(specs, shuffle=False, seed=None):
+    """
+    Generate every target from a list of specs, in order, expanded lazily.
+
+    seed: random seed for a repeatable shuffled order.
+    """
+    rng = random.Random(seed)
+    for spec in specs:
+        for target in expand(spec, shuffle=shuffle, rng=rng):
+            yield target
+
+
+
+class TargetSet(object):
+    """
+    Target specs that can be walked again and again, such as by a monitor sweeping the same
+    targets every round.  Each walk expands them afresh, lazily, so files are re-read.
+
+    seed: random seed, each walk then has the same shuffled order.
+    """
+    def __init__(self, specs, shuffle=False, seed=None):
+        self.specs = list(specs)
+        self.shuffle = shuffle
+        self.seed = seed
+
+    def __iter__(self):
+        return iter_targets(self.specs, shuffle=self.shuffle, seed=self.seed)
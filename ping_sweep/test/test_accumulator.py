@@ -0,0 +1,91 @@
+from __future__ import division, print_function, unicode_literals
+
+import math
+import random
+import unittest
+
+import accumulator
+import ping_sweep
+
+class Test_Accumulator(unittest.TestCase):
+
+    def setUp(self):
+        rng = random.Random(1234)
+        self.data = [rng.lognormvariate(0., 1.) for k in range(5000)]
+
+
+    def test_mean_std(self):
+        acc = accumulator.Accumulator()
+        for value in self.data:
+            acc.add(value)
+
+        self.assertEqual(acc.count, len(self.data))
+        self.assertAlmostEqual(acc.mean, ping_sweep.mean(self.data))
+        self.assertAlmostEqual(acc.std, ping_sweep.std(self.data))
+        self.assertEqual(acc.min, min(self.data))
+        self.assertEqual(acc.max, max(self.data))
+
+
+    def test_percentile(self):
+        acc = accumulator.Accumulator()
+        for value in self.data:
+            acc.add(value)
+
+        data = sorted(self.data)
+        for q in [50, 90, 99, 99.9]:
+            exact = data[int(math.ceil(q / 100. * len(data))) - 1]
+            self.assertAlmostEqual(acc.percentile(q) / exact, 1., delta=0.025)
+
+        self.assertEqual(acc.percentile(100), acc.max)
+        self.assertEqual(accumulator.Accumulator().percentile(50), None)
+
+
+    def test_merge(self):
+        acc_all = accumulator.Accumulator()
+        acc_A = accumulator.Accumulator()
+        acc_B = accumulator.Accumulator()
+        for k, value in enumerate(self.data):
+            acc_all.add(value)
+            if k % 3:
+                acc_A.add(value)
+            else:
+                acc_B.add(value)
+
+        acc_A.merge(acc_B)
+        acc_A.merge(accumulator.Accumulator())
+
+        self.assertEqual(acc_A.count, acc_all.count)
+        self.assertAlmostEqual(acc_A.mean, acc_all.mean)
+        self.assertAlmostEqual(acc_A.variance, acc_all.variance)
+        self.assertEqual(acc_A.histogram.counts, acc_all.histogram.counts)
+
+
+    def test_merge_layout(self):
+        acc_A = accumulator.Accumulator()
+        acc_B = accumulator.Accumulator(precision=0.1)
+
+        self.assertRaises(ValueError, acc_A.merge, acc_B)
+
+
+    def test_tally(self):
+        tally_A = accumulator.Tally()
+        tally_A.add_result({'time_ping': 1.0, 'is_same_data': True, 'packet_size': 40})
+        tally_A.add_result({'time_ping': None, 'is_same_data': False, 'packet_size': 40})
+
+        tally_B = accumulator.Tally()
+        tally_B.add_result({'time_ping': 3.0, 'is_same_data': True, 'packet_size': 40})
+        tally_B.count_late = 2
+
+        tally_A.merge(tally_B)
+
+        self.assertEqual(tally_A.count_send, 3)
+        self.assertEqual(tally_A.count_recv, 2)
+        self.assertEqual(tally_A.count_late, 2)
+        self.assertEqual(tally_A.accumulator.mean, 2.0)
+        self.assertEqual(tally_A.times, None)
+
+
+
+# Standalone.
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,89 @@
+from __future__ import division, print_function, unicode_literals
+
+import unittest
+
+import analysis
+
+class Test_Analysis(unittest.TestCase):
+
+    def make_stats(self, host_name, data_size, times, count_lost=0):
+        return {'host_name': host_name,
+                'data_size': data_size,
+                'packet_size': data_size + 8,
+                'times': times,
+                'count_send': len(times) + count_lost,
+                'count_lost': count_lost}
+
+
+    def setUp(self):
+        if analysis.np is None:
+            self.skipTest('NumPy not installed')
+
+        # 1 ms fixed delay plus 1 us/byte each way, i.e. 8 Mbit/s.
+        self.stats_sweep = []
+        for host_name in ['A', 'B']:
+            for data_size in [100, 500, 1000]:
+                rtt = 1. + 2 * (data_size + 8) / 1000.
+                times = [rtt, rtt + 1., rtt, rtt + 1.]
+                self.stats_sweep.append(self.make_stats(host_name, data_size, times))
+
+        self.stats_sweep.append(self.make_stats('C', 100, [5.], count_lost=3))
+
+
+    def test_load(self):
+        sweep = analysis.load(self.stats_sweep)
+
+        self.assertEqual(sweep.host_names, ['A', 'B', 'C'])
+        self.assertEqual(list(sweep.data_sizes), [100, 500, 1000])
+        self.assertEqual(sweep.shape, (3, 3, 4))
+        self.assertEqual(sweep.count_recv[2].tolist(), [1, 0, 0])
+
+
+    def test_load_no_times(self):
+        stats = self.make_stats('A', 100, [1.])
+        stats['times'] = None
+
+        self.assertRaises(analysis.AnalysisError, analysis.load, [stats])
+
+
+    def test_percentiles_loss(self):
+        sweep = analysis.load(self.stats_sweep)
+
+        values = analysis.percentiles(sweep, [0, 100])
+        self.assertEqual(values.shape, (3, 3, 2))
+        self.assertAlmostEqual(values[0, 0, 1] - values[0, 0, 0], 1.)
+
+        rate = analysis.loss_rate(sweep)
+        self.assertEqual(rate[2, 0], 0.75)
+        self.assertEqual(rate[0, 0], 0.)
+
+
+    def test_jitter(self):
+        sweep = analysis.load(self.stats_sweep)
+
+        # Same thing, one step at a time, straight from RFC 3550.
+        J = 0.
+        times = self.stats_sweep[0]['times']
+        for k in range(1, len(times)):
+            J += (abs(times[k] - times[k-1]) - J) / 16.
+
+        values = analysis.jitter(sweep)
+        self.assertAlmostEqual(values[0, 0], J)
+        self.assertEqual(values[2, 0], 0.)
+
+
+    def test_linear_fit(self):
+        sweep = analysis.load(self.stats_sweep)
+
+        slope, intercept, bandwidth = analysis.linear_fit(sweep)
+
+        self.assertAlmostEqual(slope[0], 0.002)
+        self.assertAlmostEqual(intercept[1], 1.)
+        self.assertAlmostEqual(bandwidth[0] / 1e6, 8.)
+        self.assertTrue(analysis.np.isnan(slope[2]))
+
+
+
+# Standalone.
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
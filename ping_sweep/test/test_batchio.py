@@ -0,0 +1,86 @@
+from __future__ import division, print_function, unicode_literals
+
+import select
+import socket
+import unittest
+
+import batchio
+import engine
+import packets
+import receive
+
+@unittest.skipUnless(batchio.is_supported(), 'sendmmsg/recvmmsg not available')
+class Test_BatchIO(unittest.TestCase):
+
+    def test_sockaddr(self):
+        addr = batchio.pack_sockaddr('10.1.2.3')
+
+        self.assertEqual(batchio.unpack_sockaddr(addr.raw), '10.1.2.3')
+
+        addr = batchio.pack_sockaddr('fd00::1:2')
+        self.assertEqual(len(addr.raw), 28)
+        self.assertEqual(batchio.unpack_sockaddr(addr.raw), 'fd00::1:2')
+
+
+    def test_loopback(self):
+        """
+        Requires admin or root, same as test_is_admin.
+        """
+        sock = engine.create_engine_socket()
+        batch = batchio.BatchSocket(sock, batch_size=8)
+        template = packets.PacketTemplate(100)
+
+        for seq in range(5):
+            batch.stage(seq, template.patch(0x7777, seq), '127.0.0.1')
+        num_sent = batch.send_staged(5)
+        self.assertEqual(num_sent, 5)
+
+        seqs = set()
+        while len(seqs) < 5:
+            readable, _, _ = select.select([sock], [], [], 1.)
+            self.assertTrue(readable)
+
+            for k in range(batch.recv_batch()):
+                reply = receive.parse_echo_reply(batch.buffers[k], batch.length(k))
+                if reply and reply[0] == 0x7777:
+                    seqs.add(reply[1])
+                    self.assertEqual(batch.source(k), '127.0.0.1')
+                    self.assertEqual(reply[3], 100)
+
+        sock.close()
+        self.assertEqual(seqs, set(range(5)))
+
+
+    def test_stage_ttl(self):
+        """
+        Requires admin or root, same as test_is_admin.
+        """
+        sock = engine.create_engine_socket()
+        batch = batchio.BatchSocket(sock, batch_size=8)
+        template = packets.PacketTemplate(32)
+
+        # Raw socket sees our own requests on loopback too, with the TTL they were sent with.
+        ttls = {0: 5, 1: 77, 2: None}
+        for seq, ttl in ttls.items():
+            batch.stage(seq, template.patch(0x7778, seq), '127.0.0.1', ttl=ttl)
+        self.assertEqual(batch.send_staged(3), 3)
+
+        seen = {}
+        while len(seen) < 3:
+            readable, _, _ = select.select([sock], [], [], 1.)
+            self.assertTrue(readable)
+
+            for k in range(batch.recv_batch()):
+                data = bytearray(batch.buffers[k][:batch.length(k)])
+                if data[20] == 8 and data[24:26] == bytearray(b'\x77\x78'):
+                    seen[data[27]] = data[8]
+
+        ttl_default = sock.getsockopt(socket.IPPROTO_IP, socket.IP_TTL)
+        sock.close()
+        self.assertEqual(seen, {0: 5, 1: 77, 2: ttl_default})
+
+
+
+# Standalone.
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,134 @@
+from __future__ import division, print_function, unicode_literals
+
+import select
+import socket
+import unittest
+
+import dpkt
+
+import bpf
+import engine
+import packets
+
+class Test_BPF(unittest.TestCase):
+
+    def setUp(self):
+        self.program = bpf.echo_filter(0x1234)
+
+
+    def make_ip(self, icmp):
+        ip = dpkt.ip.IP(p=dpkt.ip.IP_PROTO_ICMP, data=icmp)
+        ip.len = len(ip)
+        return bytes(ip)
+
+
+    def make_echo(self, icmp_type, pid):
+        echo = dpkt.icmp.ICMP.Echo(id=pid, seq=1, data=b'payload')
+        return dpkt.icmp.ICMP(type=icmp_type, data=echo)
+
+
+    def make_error(self, icmp_type, pid):
+        quoted = self.make_ip(self.make_echo(dpkt.icmp.ICMP_ECHO, pid))
+        error = dpkt.icmp.ICMP.Unreach(data=dpkt.ip.IP(quoted))
+        return dpkt.icmp.ICMP(type=icmp_type, data=error)
+
+
+    def test_echo_reply(self):
+        packet = self.make_ip(self.make_echo(dpkt.icmp.ICMP_ECHOREPLY, 0x1234))
+        self.assertEqual(bpf.simulate(self.program, packet), bpf.ACCEPT)
+
+        packet = self.make_ip(self.make_echo(dpkt.icmp.ICMP_ECHOREPLY, 0x4321))
+        self.assertEqual(bpf.simulate(self.program, packet), bpf.DROP)
+
+        packet = self.make_ip(self.make_echo(dpkt.icmp.ICMP_ECHO, 0x1234))
+        self.assertEqual(bpf.simulate(self.program, packet), bpf.DROP)
+
+
+    def test_errors(self):
+        for icmp_type in (dpkt.icmp.ICMP_UNREACH, dpkt.icmp.ICMP_TIMEXCEED):
+            packet = self.make_ip(self.make_error(icmp_type, 0x1234))
+            self.assertEqual(bpf.simulate(self.program, packet), bpf.ACCEPT)
+
+            packet = self.make_ip(self.make_error(icmp_type, 0x4321))
+            self.assertEqual(bpf.simulate(self.program, packet), bpf.DROP)
+
+
+    def test_truncated(self):
+        packet = self.make_ip(self.make_error(dpkt.icmp.ICMP_UNREACH, 0x1234))
+        self.assertEqual(bpf.simulate(self.program, packet[:40]), bpf.DROP)
+
+
+    def test_no_ip_header(self):
+        program = bpf.echo_filter(0x1234, ip_header=False)
+
+        packet = bytes(self.make_echo(dpkt.icmp.ICMP_ECHOREPLY, 0x1234))
+        self.assertEqual(bpf.simulate(program, packet), bpf.ACCEPT)
+
+        packet = bytes(self.make_error(dpkt.icmp.ICMP_UNREACH, 0x1234))
+        self.assertEqual(bpf.simulate(program, packet), bpf.ACCEPT)
+
+
+    def test_ipv6(self):
+        program = bpf.echo_filter(0x1234, ip_header=False, family=socket.AF_INET6)
+
+        def echo(icmp_type, pid):
+            echo = dpkt.icmp6.ICMP6.Echo(id=pid, seq=1, data=b'payload')
+            return dpkt.icmp6.ICMP6(type=icmp_type, data=echo)
+
+        def error(icmp_type, pid):
+            request = echo(dpkt.icmp6.ICMP6_ECHO_REQUEST, pid)
+            quoted = dpkt.ip6.IP6(nxt=dpkt.ip.IP_PROTO_ICMP6, data=request, plen=len(request),
+                                  src=b'\x00' * 16, dst=b'\x00' * 16)
+            # Bundled dpkt only packs a freshly built IP6 header by itself.
+            quote = quoted.pack_hdr() + bytes(request)
+            return dpkt.icmp6.ICMP6(type=icmp_type, data=dpkt.icmp6.ICMP6.Unreach(data=quote))
+
+        packet = bytes(echo(dpkt.icmp6.ICMP6_ECHO_REPLY, 0x1234))
+        self.assertEqual(bpf.simulate(program, packet), bpf.ACCEPT)
+
+        packet = bytes(echo(dpkt.icmp6.ICMP6_ECHO_REPLY, 0x4321))
+        self.assertEqual(bpf.simulate(program, packet), bpf.DROP)
+
+        packet = bytes(echo(dpkt.icmp6.ICMP6_ECHO_REQUEST, 0x1234))
+        self.assertEqual(bpf.simulate(program, packet), bpf.DROP)
+
+        for icmp_type in (dpkt.icmp6.ICMP6_DST_UNREACH, dpkt.icmp6.ICMP6_TIME_EXCEEDED):
+            self.assertEqual(bpf.simulate(program, bytes(error(icmp_type, 0x1234))), bpf.ACCEPT)
+            self.assertEqual(bpf.simulate(program, bytes(error(icmp_type, 0x4321))), bpf.DROP)
+
+
+    def test_bad_label(self):
+        program = bpf.Program()
+        program.jump(bpf.BPF_JMP | bpf.BPF_JEQ | bpf.BPF_K, 0, 'nowhere', 0)
+
+        with self.assertRaises(bpf.BPFError):
+            program.assemble()
+
+
+    def test_attach(self):
+        """
+        Requires admin or root, same as test_is_admin.
+        """
+        sock = engine.create_engine_socket()
+        self.assertTrue(bpf.attach_filter(sock, self.program))
+
+        template = packets.PacketTemplate(16)
+        sock.sendto(template.patch(0x4321, 1), ('127.0.0.1', 0))
+        sock.sendto(template.patch(0x1234, 2), ('127.0.0.1', 0))
+
+        readable, _, _ = select.select([sock], [], [], 1.)
+        self.assertTrue(readable)
+
+        # Only our own reply gets through, not the foreign one or either echo request.
+        icmp = dpkt.ip.IP(sock.recv(0xffff)).icmp
+        self.assertEqual((icmp.type, icmp.echo.id), (dpkt.icmp.ICMP_ECHOREPLY, 0x1234))
+
+        readable, _, _ = select.select([sock], [], [], 0.1)
+        self.assertFalse(readable)
+        sock.close()
+
+
+
+# Standalone.
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
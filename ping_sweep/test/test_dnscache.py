@@ -0,0 +1,164 @@
+from __future__ import division, print_function, unicode_literals
+
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import unittest
+
+import dpkt
+
+import dnscache
+
+class Test_DNSCache(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.cache_path = os.path.join(self.folder, 'sub', 'hosts.json')
+
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+
+    def test_is_address(self):
+        self.assertTrue(dnscache.is_address('10.1.2.3'))
+        self.assertFalse(dnscache.is_address('10.1'))
+        self.assertFalse(dnscache.is_address('localhost'))
+
+        self.assertTrue(dnscache.is_address('fd00::1', family=socket.AF_INET6))
+        self.assertFalse(dnscache.is_address('10.1.2.3', family=socket.AF_INET6))
+        self.assertEqual(dnscache.normalize_ipv6('FD00:0::0001'), 'fd00::1')
+
+
+    def test_lookup_ipv6(self):
+        self.assertEqual(dnscache.lookup('FD00::1', family=socket.AF_INET6), ('fd00::1', None))
+
+        with self.assertRaises(dnscache.ResolverError):
+            dnscache.lookup('10.1.2.3', family=socket.AF_INET6)
+
+        with self.assertRaises(dnscache.ResolverError):
+            dnscache.lookup('fd00::1')
+
+        resolver = dnscache.Resolver(use_dns=False, family=socket.AF_INET6)
+        self.assertEqual(resolver.resolve('fd00:0::1'), 'fd00::1')
+
+
+    def test_family_cache_path(self):
+        self.assertEqual(dnscache.family_cache_path(self.cache_path), self.cache_path)
+        self.assertEqual(dnscache.family_cache_path(self.cache_path, socket.AF_INET6),
+                         os.path.join(self.folder, 'sub', 'hosts6.json'))
+        self.assertEqual(dnscache.family_cache_path('', socket.AF_INET6), '')
+
+
+    def test_nameservers(self):
+        path = os.path.join(self.folder, 'resolv.conf')
+        with open(path, 'w') as fo:
+            fo.write('# comment\nsearch example.com\nnameserver 10.0.0.1\nnameserver ::1\n'
+                     'nameserver fe80::1%eth0\nnameserver bogus\n')
+
+        self.assertEqual(dnscache.nameservers(path), ['10.0.0.1', '::1', 'fe80::1%eth0'])
+
+
+    def answer_once(self, server_addr, host_addr, ttl, query):
+        """
+        Run query(port) against a fake name server on server_addr, which answers once with
+        host_addr.
+        """
+        if ':' in server_addr:
+            server = socket.socket(socket.AF_INET6, socket.SOCK_DGRAM)
+        else:
+            server = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        server.bind((server_addr, 0))
+        port = server.getsockname()[1]
+
+        def answer():
+            data, addr = server.recvfrom(0x10000)
+            query = dpkt.dns.DNS(data)
+            reply = dpkt.dns.DNS(id=query.id, qd=query.qd)
+            reply.qr = dpkt.dns.DNS_R
+            reply.an = [dpkt.dns.DNS.RR(name=query.qd[0].name, type=dpkt.dns.DNS_A,
+                                        cls=dpkt.dns.DNS_IN, ttl=ttl, rdata=socket.inet_aton(host_addr))]
+            server.sendto(bytes(reply), addr)
+
+        thread = threading.Thread(target=answer)
+        thread.start()
+        try:
+            return query(port)
+        finally:
+            thread.join()
+            server.close()
+
+
+    def test_query_dns(self):
+        answer = self.answer_once('127.0.0.1', '10.9.8.7', 42, lambda port:
+                                  dnscache.query_dns('some.host', '127.0.0.1', timeout=2., port=port))
+
+        self.assertEqual(answer, ('10.9.8.7', 42))
+
+
+    def test_query_dns_ipv6_server(self):
+        answer = self.answer_once('::1', '10.9.8.7', 42, lambda port:
+                                  dnscache.query_dns('some.host', '::1', timeout=2., port=port))
+
+        self.assertEqual(answer, ('10.9.8.7', 42))
+
+
+    def test_lookup_system_first(self):
+        # System resolver knows the name, the name server is never asked.
+        server = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        server.bind((str('127.0.0.1'), 0))
+        try:
+            answer = dnscache.lookup('localhost', servers=['127.0.0.1'], timeout=2.,
+                                     port=server.getsockname()[1])
+
+            server.setblocking(False)
+            self.assertRaises(socket.error, server.recv, 0x10000)
+        finally:
+            server.close()
+
+        self.assertEqual(answer, ('127.0.0.1', dnscache.DEFAULT_TTL))
+
+
+    def test_lookup_fallback(self):
+        # Only a name the system can't resolve goes to the name server, and gets its TTL.
+        answer = self.answer_once('127.0.0.1', '10.9.8.7', 42, lambda port:
+                                  dnscache.lookup('no-such-host.invalid', servers=['127.0.0.1'],
+                                                  timeout=2., port=port))
+        self.assertEqual(answer, ('10.9.8.7', 42))
+
+
+    def test_resolve_all(self):
+        resolver = dnscache.Resolver(cache_path=self.cache_path, use_dns=False)
+
+        addresses, errors = resolver.resolve_all(['localhost', '10.1.2.3', 'no-such-host.invalid'])
+
+        self.assertEqual(addresses['localhost'], '127.0.0.1')
+        self.assertEqual(addresses['10.1.2.3'], '10.1.2.3')
+        self.assertEqual(list(errors), ['no-such-host.invalid'])
+        self.assertRaises(dnscache.ResolverError, resolver.resolve, 'no-such-host.invalid')
+
+        # Next run starts from the cache file.
+        resolver = dnscache.Resolver(cache_path=self.cache_path, use_dns=False)
+        self.assertEqual(resolver.cached('localhost'), '127.0.0.1')
+
+        # Repeated names are looked up once.
+        addresses, errors = dnscache.Resolver(use_dns=False).resolve_all(
+            ['localhost', 'no-such-host.invalid'] * 3)
+        self.assertEqual((list(addresses), list(errors)), (['localhost'], ['no-such-host.invalid']))
+
+
+    def test_expired(self):
+        resolver = dnscache.Resolver(use_dns=False)
+        resolver.cache['old.host'] = ('10.0.0.1', 0.)
+        resolver.cache['new.host'] = ('10.0.0.2', None)
+
+        self.assertEqual(resolver.cached('old.host'), None)
+        self.assertEqual(resolver.cached('new.host'), '10.0.0.2')
+
+
+
+# Standalone.
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,661 @@
+from __future__ import division, print_function, unicode_literals
+
+import collections
+import json
+import os
+import shutil
+import socket
+import tempfile
+import unittest
+
+import dpkt
+
+import engine
+import exporter
+import inflight
+import ping_sweep
+import stopping
+import targets
+import writers
+
+def send_unreachable(echo_id, echo_seq, icmp_type=None, icmp_code=None):
+    """
+    Send ourselves an ICMP host unreachable quoting the echo request (echo_id, echo_seq), or
+    another error given its type and code.
+    """
+    if icmp_type is None:
+        icmp_type, icmp_code = dpkt.icmp.ICMP_UNREACH, dpkt.icmp.ICMP_UNREACH_HOST
+
+    echo = dpkt.icmp.ICMP.Echo(id=echo_id, seq=echo_seq)
+    request = dpkt.ip.IP(p=dpkt.ip.IP_PROTO_ICMP, data=dpkt.icmp.ICMP(type=dpkt.icmp.ICMP_ECHO,
+                                                                        data=echo))
+    # Kernel drops errors quoting a request to 0.0.0.0 before any datagram socket sees them.
+    request.src = request.dst = socket.inet_aton(str('127.0.0.1'))
+    request.len = len(request)
+
+    quote = dpkt.icmp.ICMP.Quote(data=bytes(request))
+    icmp = dpkt.icmp.ICMP(type=icmp_type, code=icmp_code, data=quote)
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_RAW, dpkt.ip.IP_PROTO_ICMP)
+    try:
+        sock.sendto(bytes(icmp), (str('127.0.0.1'), 0))
+    finally:
+        sock.close()
+
+class Test_Engine(unittest.TestCase):
+
+    def test_add_target(self):
+        sweep = engine.SweepEngine()
+        cells = sweep.add_target('localhost', '127.0.0.1', [32, 64], count_send=3)
+
+        self.assertEqual([c.data_size for c in cells], [32, 64])
+        self.assertEqual(len(cells[1].payload), 64)
+        self.assertFalse(cells[0].is_done)
+
+
+    def test_empty_source(self):
+        sweep = engine.SweepEngine(time_pause=0)
+        sweep.add_source(iter([]), [32], count_send=1)
+
+        self.assertEqual(sweep.run(), [])
+
+
+    def test_localhost_sweep(self):
+        """
+        Requires admin or root, same as test_is_admin.
+        """
+        sweep = self.localhost_sweep(batch_size=32)
+
+        # Replies read in one batch still each get their own receive time.
+        self.assertTrue(sweep.kernel_timestamps)
+
+
+    def test_localhost_sweep_per_packet(self):
+        sweep = self.localhost_sweep(batch_size=None)
+
+        self.assertEqual(sweep.batch_size, 1)
+        self.assertFalse(sweep.kernel_timestamps)
+
+
+    def localhost_sweep(self, batch_size):
+        sweep = engine.SweepEngine(time_pause=0, max_in_flight=8, batch_size=batch_size,
+                                   keep_results=True)
+        sweep.add_target('localhost', '127.0.0.1', [32, 1024], count_send=10)
+
+        done = []
+        cells = sweep.run(callback=done.append)
+
+        self.assertEqual(len(done), 2)
+        for cell in cells:
+            self.assertTrue(cell.is_done)
+            seqs = [res['seq'] for res in cell.results]
+            self.assertEqual(len(set(seqs)), cell.count_send)
+
+            stats, count_recv = ping_sweep.summarize_results(cell.host_name, cell.data_size, cell.results,
+                                                             sweep.timeout, sweep.time_pause)
+            self.assertEqual(count_recv, cell.count_send)
+
+            stats, count_recv = ping_sweep.summarize_tally(cell.host_name, cell.data_size, cell.tally,
+                                                           sweep.timeout, sweep.time_pause)
+            self.assertEqual(count_recv, cell.count_send)
+            self.assertEqual(stats['accumulator'].count, cell.count_send)
+
+        self.assertEqual(sweep.counters.count_sent, 20)
+        self.assertGreaterEqual(sweep.counters.count_recv, 20)
+        self.assertGreater(sweep.counters.time_parse, 0.)
+        return sweep
+
+
+    def test_no_wait_when_done(self):
+        """
+        Requires admin or root, same as test_is_admin.
+        """
+        sweep = engine.SweepEngine(time_pause=0, timeout=5000, max_hosts=2)
+        host_addrs = ((str(h), str(h)) for h in targets.iter_targets([str('127.0.2.1-8')]))
+        sweep.add_source(host_addrs, [32], count_send=2)
+
+        # Every reply is in long before the timeout, stale deadlines are not waited for.
+        time_start = engine.clock()
+        cells = sweep.run()
+        self.assertTrue(engine.clock() - time_start < 2.)
+        self.assertEqual([cell.tally.count_recv for cell in cells], [2] * 8)
+
+
+    def test_release_cells(self):
+        """
+        Requires admin or root, same as test_is_admin.
+        """
+        sweep = engine.SweepEngine(time_pause=0, max_hosts=8, max_in_flight=16, keep_cells=False)
+        host_addrs = ((str(h), str(h)) for h in targets.iter_targets([str('127.0.1.1-200')]))
+        sweep.add_source(host_addrs, [32, 64], count_send=2)
+
+        sizes = []
+        def finished(cell):
+            self.assertEqual(cell.tally.count_recv, 2)
+            sizes.append((len(sweep.cells), len(sweep.cell_index), len(sweep.hosts)))
+
+        cells = sweep.run(callback=finished)
+
+        # Only the hosts being swept are held on to, never the whole target list.
+        self.assertEqual(len(sizes), 400)
+        self.assertTrue(max(count_cells for count_cells, _, _ in sizes) <= 2 * (8 + 16))
+        self.assertTrue(max(count_index for _, count_index, _ in sizes) <= 2 * (8 + 16))
+        self.assertTrue(max(count_hosts for _, _, count_hosts in sizes) <= 8 + 16)
+        self.assertEqual((cells, sweep.cell_index, sweep.hosts), ([], {}, {}))
+
+
+    def test_late_after_release(self):
+        """
+        Requires admin or root, same as test_is_admin.
+        """
+        seqs = collections.defaultdict(list)
+        def sent(cell, result):
+            seqs[cell].append(result['seq'])
+
+        # Silent host settles on its loss rate alone, leaving the rest of its probes spare.
+        rule = stopping.StoppingRule(loss_precision=0.9, min_count=2, max_factor=2)
+        with engine.SocketManager(pid=0x4747) as manager:
+            sweep = engine.SweepEngine(sock=manager.get(), pid=manager.pid, time_pause=0,
+                                       timeout=20, adaptive_timeout=True, stopping=rule,
+                                       keep_cells=False, probe_callback=sent)
+            sweep.add_target('silent', '192.0.2.77', [32, 64], count_send=4)
+            host_silent = sweep.hosts['192.0.2.77']
+
+            released = []
+            sweep.run(callback=released.append)
+
+            # Every probe shows up after all, once both cells and their host are done with.
+            sender = socket.socket(socket.AF_INET, socket.SOCK_RAW, dpkt.ip.IP_PROTO_ICMP)
+            for cell in released:
+                for seq in seqs[cell]:
+                    echo = dpkt.icmp.ICMP.Echo(id=0x4747, seq=seq, data=b'x' * cell.data_size)
+                    icmp = dpkt.icmp.ICMP(type=dpkt.icmp.ICMP_ECHOREPLY, data=echo)
+                    sender.sendto(bytes(icmp), (str('127.0.0.1'), 0))
+            sender.close()
+
+            # Read by the next run, on the same socket.
+            sweep.add_target('localhost', '127.0.0.1', [32], count_send=2)
+            sweep.run()
+
+        self.assertEqual(len(released), 2)
+        for cell in released:
+            self.assertTrue(cell not in sweep.cells)
+            self.assertEqual(cell.tally.count_lost, cell.tally.count_send)
+            self.assertEqual(cell.tally.count_late, cell.tally.count_timeout)
+
+            # Any that got an ICMP error back were already answered.
+            self.assertEqual(cell.tally.count_late + cell.tally.count_duplicate, len(seqs[cell]))
+
+        # Credited to the released cells and host, not lost as strangers.
+        self.assertEqual(sweep.in_flight.count_foreign, 0)
+        self.assertTrue('192.0.2.77' not in sweep.hosts)
+        self.assertTrue(host_silent.rtt.srtt is not None)
+
+
+    def test_ipv6_sweep(self):
+        """
+        Requires admin or root, same as test_is_admin.
+        """
+        for batch_size in (32, None):
+            sweep = engine.SweepEngine(time_pause=0, batch_size=batch_size,
+                                       family=socket.AF_INET6, keep_results=True)
+            sweep.add_target('localhost', '::1', [32, 1024], count_send=5)
+
+            cells = sweep.run()
+
+            self.assertFalse(sweep.ip_header)
+            for cell in cells:
+                self.assertEqual(cell.tally.count_recv, 5)
+                self.assertTrue(all(res['is_same_data'] for res in cell.results))
+
+
+    def test_ipv6_ping_once(self):
+        with engine.SocketManager() as manager:
+            sock = manager.get(socket.AF_INET6)
+            self.assertFalse(manager.get() is sock)
+
+            res = ping_sweep.ping_once(sock, data_size=64, pid=manager.pid, table=manager.table,
+                                       host_addr='::1', timeout=1.)
+
+        self.assertTrue(res['is_same_data'])
+        self.assertEqual(res['echo_id'], res['id'])
+
+
+    def test_ipv6_time_exceeded(self):
+        """
+        Requires admin or root, same as test_is_admin.
+        """
+        sock = engine.create_engine_socket(family=socket.AF_INET6)
+        try:
+            sweep = engine.SweepEngine(time_pause=0, sock=sock, pid=0x4545, keep_results=True,
+                                       family=socket.AF_INET6)
+            sweep.add_target('localhost', '::1', [32], count_send=1, ttl=1)
+
+            # Hop limit exceeded for the first probe, as from the first router.
+            echo = dpkt.icmp6.ICMP6.Echo(id=0x4545, seq=(sweep.in_flight.seq + 1) & 0xffff)
+            request = dpkt.icmp6.ICMP6(type=dpkt.icmp6.ICMP6_ECHO_REQUEST, data=echo)
+            quoted = dpkt.ip6.IP6(nxt=dpkt.ip.IP_PROTO_ICMP6, data=request, plen=len(request),
+                                  src=b'\x00' * 16, dst=b'\x00' * 15 + b'\x01')
+            # Bundled dpkt only packs a freshly built IP6 header by itself.
+            quote = quoted.pack_hdr() + bytes(request)
+            error = dpkt.icmp6.ICMP6(type=dpkt.icmp6.ICMP6_TIME_EXCEEDED,
+                                     data=dpkt.icmp6.ICMP6.TimeExceed(data=quote))
+
+            sender = engine.create_engine_socket(family=socket.AF_INET6)
+            sender.sendto(error.pack(), (str('::1'), 0))
+            sender.close()
+
+            cell = sweep.run()[0]
+        finally:
+            sock.close()
+
+        self.assertEqual(cell.tally.count_recv, 1)
+        self.assertEqual(cell.results[0]['hop_addr'], '::1')
+
+
+    @unittest.skipUnless(engine.dgram_available(), 'ICMP datagram sockets not allowed')
+    def test_dgram_sweep(self):
+        sweep = engine.SweepEngine(time_pause=0, dgram=True)
+        sweep.add_target('localhost', '127.0.0.1', [32, 1024], count_send=5)
+
+        cells = sweep.run()
+
+        self.assertFalse(sweep.ip_header)
+        for cell in cells:
+            self.assertEqual(cell.results, None)
+            self.assertEqual(cell.tally.count_recv, 5)
+
+
+    @unittest.skipUnless(engine.dgram_available(), 'ICMP datagram sockets not allowed')
+    def test_dgram_ping_once(self):
+        sock = ping_sweep.create_socket('127.0.0.1', dgram=True)
+
+        res = ping_sweep.ping_once(sock, data_size=64)
+        sock.close()
+
+        self.assertTrue(res['is_same_data'])
+        self.assertEqual(res['echo_id'], res['id'])
+
+
+    @unittest.skipUnless(engine.dgram_available(), 'ICMP datagram sockets not allowed')
+    def test_dgram_manager(self):
+        # Datagram path even where a raw socket could be had.
+        with engine.SocketManager(dgram=True, pid=0x4848) as manager:
+            sock = manager.get()
+            self.assertTrue(engine.is_dgram(sock))
+            self.assertEqual(manager.pid, sock.getsockname()[1])
+
+            sweep = engine.SweepEngine(time_pause=0, sock=sock, pid=manager.pid,
+                                       keep_results=True)
+            sweep.add_target('localhost', '127.0.0.1', [32], count_send=3)
+            cell = sweep.run()[0]
+
+        self.assertTrue(sweep.error_queue is not None)
+        self.assertEqual(cell.tally.count_recv, 3)
+        self.assertEqual([result['echo_id'] for result in cell.results], [manager.pid] * 3)
+
+
+    @unittest.skipUnless(engine.dgram_available(), 'ICMP datagram sockets not allowed')
+    def test_dgram_unbound(self):
+        # Kernel would pick the id on the first send, after the engine settled on its own.
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, dpkt.ip.IP_PROTO_ICMP)
+        sock.setblocking(False)
+        try:
+            sweep = engine.SweepEngine(time_pause=0, sock=sock, pid=0x4949, keep_results=True)
+            sweep.add_target('localhost', '127.0.0.1', [32], count_send=3)
+            cell = sweep.run()[0]
+
+            echo_id = sock.getsockname()[1]
+        finally:
+            sock.close()
+
+        self.assertEqual(sweep.pid, echo_id)
+        self.assertEqual(cell.tally.count_recv, 3)
+
+
+    @unittest.skipUnless(engine.dgram_available(), 'ICMP datagram sockets not allowed')
+    def test_dgram_icmp_error(self):
+        """
+        Requires admin or root, same as test_is_admin.
+        """
+        sock = engine.create_engine_socket(dgram=True)
+        try:
+            sweep = engine.SweepEngine(time_pause=0, sock=sock, timeout=5000, keep_results=True)
+            sweep.add_target('silent', '192.0.2.77', [32], count_send=1)
+
+            # Error for the first probe is already queued when it goes out.
+            self.assertTrue(engine.enable_error_queue(sock))
+            send_unreachable(engine.socket_echo_id(sock), (sweep.in_flight.seq + 1) & 0xffff)
+
+            time_start = engine.clock()
+            cell = sweep.run()[0]
+        finally:
+            sock.close()
+
+        # Read from the error queue, not waited out as a timeout.
+        self.assertTrue(sweep.error_queue is not None)
+        self.assertTrue(engine.clock() - time_start < 2.)
+        self.assertEqual(cell.tally.count_error, 1)
+        self.assertEqual(cell.results[0]['error'], 'host unreachable')
+
+
+    @unittest.skipUnless(engine.dgram_available(), 'ICMP datagram sockets not allowed')
+    def test_dgram_time_exceeded(self):
+        """
+        Requires admin or root, same as test_is_admin.
+        """
+        sock = engine.create_engine_socket(dgram=True)
+        try:
+            sweep = engine.SweepEngine(time_pause=0, sock=sock, timeout=5000, keep_results=True)
+            sweep.add_target('silent', '192.0.2.77', [32], count_send=1, ttl=1)
+
+            # Stands in for the first router on the way, ahead of anything the network sends.
+            self.assertTrue(engine.enable_error_queue(sock))
+            send_unreachable(engine.socket_echo_id(sock), (sweep.in_flight.seq + 1) & 0xffff,
+                             dpkt.icmp.ICMP_TIMEXCEED, dpkt.icmp.ICMP_TIMEXCEED_INTRANS)
+
+            cell = sweep.run()[0]
+        finally:
+            sock.close()
+
+        self.assertEqual(cell.tally.count_recv, 1)
+        self.assertEqual(cell.results[0]['hop_addr'], '127.0.0.1')
+
+
+    def test_ping_once_default_timeout(self):
+        """
+        Requires admin or root, same as test_is_admin.
+        """
+        # Non-blocking shared socket, and a blocking one with no timeout of its own.
+        with engine.SocketManager() as manager:
+            res = ping_sweep.ping_once(manager.get(), data_size=64, pid=manager.pid,
+                                       table=manager.table, host_addr=str('127.0.0.1'))
+            self.assertTrue(res['is_same_data'])
+            self.assertEqual(res['timeout'], engine.DEFAULT_TIMEOUT)
+
+        sock = engine.create_engine_socket()
+        sock.setblocking(True)
+        try:
+            res = ping_sweep.ping_once(sock, data_size=64, host_addr=str('127.0.0.1'))
+        finally:
+            sock.close()
+
+        self.assertTrue(res['is_same_data'])
+
+
+    def test_lost_probes(self):
+        """
+        Requires admin or root, same as test_is_admin.
+        """
+        # Socket filter is for another echo id, so every reply is dropped by the kernel.
+        with engine.SocketManager(pid=1) as manager:
+            sweep = engine.SweepEngine(timeout=50, time_pause=0, sock=manager.get(), pid=2,
+                                       socket_filter=False)
+            sweep.add_target('localhost', '127.0.0.1', [32], count_send=3)
+
+            cells = sweep.run()
+            self.assertEqual(cells[0].tally.count_timeout, 3)
+
+
+    def test_adaptive_timeout(self):
+        sweep = engine.SweepEngine(timeout=500, time_pause=5, adaptive_timeout=True, min_timeout=20,
+                                   keep_results=True)
+        sweep.add_target('localhost', '127.0.0.1', [32], count_send=5)
+
+        cells = sweep.run()
+        timeouts = [res['timeout'] for res in cells[0].results]
+
+        # Nothing to go on for the first probe, then down to the floor for a fast host.
+        self.assertEqual(timeouts[0], 500)
+        self.assertEqual(timeouts[-1], 20)
+        self.assertEqual(cells[0].tally.count_timeout, 0)
+
+
+    def test_early_stop(self):
+        # Loose on the median, localhost jitter is no test of the rule.
+        rule = stopping.StoppingRule(median_precision=1., min_count=10, max_factor=2)
+        sweep = engine.SweepEngine(time_pause=2, stopping=rule)
+        sweep.add_target('localhost', '127.0.0.1', [32, 256, 1024], count_send=40)
+
+        cells = sweep.run()
+        counts = [cell.tally.count_send for cell in cells]
+
+        # Settles well before the budget, never before min_count.
+        self.assertTrue(sum(counts) < 3*40)
+        for cell in cells:
+            self.assertTrue(cell.is_done)
+            self.assertTrue(10 <= cell.tally.count_send <= 2*40)
+
+
+    def test_icmp_error(self):
+        """
+        Requires admin or root, same as test_is_admin.
+        """
+        sock = engine.create_engine_socket()
+        try:
+            sweep = engine.SweepEngine(time_pause=0, sock=sock, pid=0x4242, keep_results=True)
+            sweep.add_target('localhost', '127.0.0.1', [32], count_send=1)
+
+            # Error for the first probe is already waiting when it goes out.
+            send_unreachable(0x4242, (sweep.in_flight.seq + 1) & 0xffff)
+
+            cell = sweep.run()[0]
+        finally:
+            sock.close()
+
+        self.assertEqual(cell.tally.count_error, 1)
+        self.assertEqual(cell.tally.count_lost, 1)
+        self.assertEqual(cell.results[0]['error'], 'host unreachable')
+
+
+    def test_time_exceeded(self):
+        """
+        Requires admin or root, same as test_is_admin.
+        """
+        sock = engine.create_engine_socket()
+        try:
+            sweep = engine.SweepEngine(time_pause=0, sock=sock, pid=0x4444, keep_results=True)
+            ttl_default = sock.getsockopt(socket.IPPROTO_IP, socket.IP_TTL)
+            sweep.add_target('localhost', '127.0.0.1', [32], count_send=1, ttl=1)
+
+            # Stands in for the first router on the way.
+            send_unreachable(0x4444, (sweep.in_flight.seq + 1) & 0xffff,
+                             dpkt.icmp.ICMP_TIMEXCEED, dpkt.icmp.ICMP_TIMEXCEED_INTRANS)
+
+            cell = sweep.run()[0]
+
+            # Shared socket is handed back with its TTL as it was.
+            self.assertEqual(sock.getsockopt(socket.IPPROTO_IP, socket.IP_TTL), ttl_default)
+        finally:
+            sock.close()
+
+        self.assertEqual(cell.tally.count_recv, 1)
+        self.assertEqual(cell.tally.count_error, 0)
+        self.assertEqual(cell.results[0]['ttl'], 1)
+        self.assertEqual(cell.results[0]['hop_addr'], '127.0.0.1')
+        self.assertEqual(cell.hop_addrs.most_common(1)[0][0], '127.0.0.1')
+
+
+    def test_icmp_error_ping_once(self):
+        with engine.SocketManager(pid=0x4343) as manager:
+            sock = manager.get()
+            send_unreachable(0x4343, (manager.table.seq + 1) & 0xffff)
+
+            res = ping_sweep.ping_once(sock, data_size=32, pid=manager.pid, table=manager.table,
+                                       host_addr='127.0.0.1', timeout=1.)
+
+        self.assertEqual(res['error'], 'host unreachable')
+        self.assertEqual(res['time_ping'], None)
+
+
+    def test_socket_manager(self):
+        """
+        Requires admin or root, same as test_is_admin.
+        """
+        with engine.SocketManager() as manager:
+            sock = manager.get()
+            self.assertTrue(manager.get() is sock)
+
+            # Same socket for every size and every sweep.
+            stats, count_recv = ping_sweep.ping_repeat('localhost', data_size=32, count_send=3,
+                                                       time_pause=1, manager=manager)
+            self.assertEqual(count_recv, 3)
+
+            stats_sweep = ping_sweep.ping_sweep_hosts(['localhost'], size_sweep=[32, 64], count_send=3,
+                                                      time_pause=0, manager=manager)
+            self.assertEqual([stats['count_lost'] for stats in stats_sweep], [0, 0])
+            self.assertTrue(manager.get() is sock)
+
+        self.assertEqual(manager.sockets, {})
+
+
+    def test_traceroute_hosts(self):
+        """
+        Requires admin or root, same as test_is_admin.
+        """
+        stats_sweep = ping_sweep.traceroute_hosts([str('127.0.0.1')], max_ttl=3, size_sweep=[32, 64],
+                                                  count_send=2, time_pause=0, timeout=200)
+
+        # Loopback is reached on the first hop, the rest are dropped.
+        self.assertEqual([(stats['ttl'], stats['data_size']) for stats in stats_sweep],
+                         [(1, 32), (1, 64)])
+        for stats in stats_sweep:
+            self.assertEqual(stats['hop_addr'], '127.0.0.1')
+            self.assertEqual(stats['count_lost'], 0)
+
+
+    def test_traceroute_ttl_per_packet(self):
+        """
+        Requires admin or root, same as test_is_admin.
+        """
+        with engine.SocketManager() as manager:
+            sock = manager.get()
+            ttl_default = sock.getsockopt(socket.IPPROTO_IP, socket.IP_TTL)
+
+            sweep = engine.SweepEngine(sock=sock, pid=manager.pid, time_pause=0, batch_size=8)
+            for ttl in range(1, 4):
+                sweep.add_target('localhost', '127.0.0.1', [32], count_send=2, ttl=ttl)
+            cells = sweep.run()
+
+            # Hops go out together, each packet with its own TTL, the socket's is never touched.
+            self.assertTrue(sweep.ttl_control)
+            self.assertEqual(sweep.ttl_current, ttl_default)
+            self.assertEqual([cell.tally.count_recv for cell in cells], [2, 2, 2])
+
+
+    def test_monitor_hosts(self):
+        """
+        Requires admin or root, same as test_is_admin.
+        """
+        metrics = exporter.MetricsExporter()
+        rolling_stats = ping_sweep.monitor_hosts([str('127.0.0.1')], size_sweep=[32, 64],
+                                                 count_send=3, rounds=2, time_pause=0,
+                                                 timeout=200, metrics=metrics)
+
+        self.assertEqual(len(rolling_stats), 2)
+        self.assertEqual(metrics.series[('127.0.0.1', 32)].count_send, 6)
+        self.assertEqual(metrics.sweep.counters.count_sent, 12)
+
+        stats_sweep = ping_sweep.summarize_rolling(rolling_stats, 60., engine.clock(), 200, 0)
+        self.assertEqual([stats['data_size'] for stats in stats_sweep], [32, 64])
+        for stats in stats_sweep:
+            # Both rounds fall in the last minute.
+            self.assertEqual(stats['count_send'], 6)
+            self.assertEqual(stats['count_lost'], 0)
+            self.assertEqual(stats['window'], 60.)
+
+
+    def test_carry_over(self):
+        """
+        Requires admin or root, same as test_is_admin.
+        """
+        table = inflight.InFlightTable()
+        hosts = {}
+        with engine.SocketManager(pid=0x4646) as manager:
+            options = dict(sock=manager.get(), pid=manager.pid, time_pause=0,
+                           adaptive_timeout=True, in_flight=table, hosts=hosts)
+
+            first = engine.SweepEngine(**options)
+            first.add_target('localhost', '127.0.0.1', [32], count_send=3)
+            first.run()
+            seq_last = table.seq
+
+            # Another reply to the first run's last probe shows up during the second.
+            echo = dpkt.icmp.ICMP.Echo(id=0x4646, seq=seq_last, data=b'x' * 32)
+            icmp = dpkt.icmp.ICMP(type=dpkt.icmp.ICMP_ECHOREPLY, data=echo)
+            sender = socket.socket(socket.AF_INET, socket.SOCK_RAW, dpkt.ip.IP_PROTO_ICMP)
+            sender.sendto(bytes(icmp), (str('127.0.0.1'), 0))
+            sender.close()
+
+            second = engine.SweepEngine(**options)
+            second.add_target('localhost', '127.0.0.1', [32], count_send=3)
+            cells = second.run()
+
+        self.assertEqual(cells[0].tally.count_recv, 3)
+        self.assertEqual(table.count_duplicate, 1)
+        self.assertEqual(table.count_foreign, 0)
+
+        # Sequence numbers and the RTT estimate carry on.
+        self.assertEqual(table.seq, (seq_last + 3) & 0xffff)
+        self.assertTrue(second.hosts['127.0.0.1'] is first.hosts['127.0.0.1'])
+        self.assertTrue(hosts['127.0.0.1'].rtt.srtt is not None)
+
+
+    def test_stream_records(self):
+        """
+        Requires admin or root, same as test_is_admin.
+        """
+        folder = tempfile.mkdtemp()
+        try:
+            path_probes = os.path.join(folder, str('probes.jsonl'))
+            path_cells = os.path.join(folder, str('cells.jsonl'))
+
+            with writers.create_writer(path_probes, writers.PROBE_FIELDS) as probe_writer, \
+                 writers.create_writer(path_cells, writers.CELL_FIELDS) as cell_writer:
+                ping_sweep.ping_sweep_hosts([str('127.0.0.1')], size_sweep=[32, 64], count_send=3,
+                                            time_pause=0, probe_writer=probe_writer,
+                                            cell_writer=cell_writer)
+
+            with open(path_probes) as fi:
+                probes = [json.loads(line) for line in fi]
+            with open(path_cells) as fi:
+                cells = [json.loads(line) for line in fi]
+        finally:
+            shutil.rmtree(folder)
+
+        self.assertEqual(len(probes), 6)
+        self.assertTrue(all(record['status'] == 'ok' for record in probes))
+        self.assertEqual(sorted(record['data_size'] for record in cells), [32, 64])
+        self.assertTrue(all(record['count_recv'] == 3 for record in cells))
+
+
+    def test_ping_sweep_times(self):
+        """
+        Requires admin or root, same as test_is_admin.
+        """
+        stats_sweep = ping_sweep.ping_sweep('localhost', size_sweep=[32], count_send=3,
+                                            time_pause=0)
+
+        # Every ping time is still there by default, same as always.
+        self.assertEqual(len(stats_sweep[0]['times']), 3)
+
+
+    def test_summarize_results(self):
+        results = [{'time_ping': 1.0, 'is_same_data': True, 'packet_size': 40},
+                   {'time_ping': 2.0, 'is_same_data': False, 'packet_size': 40},
+                   {'time_ping': None, 'is_same_data': False, 'packet_size': 40}]
+
+        stats, count_recv = ping_sweep.summarize_results('host', 32, results, 1000., 5.)
+
+        self.assertEqual(count_recv, 1)
+        self.assertEqual(stats['times'], [1.0])
+        self.assertEqual(stats['accumulator'].mean, 1.0)
+        self.assertEqual(stats['count_corrupt'], 1)
+        self.assertEqual(stats['count_timeout'], 1)
+        self.assertEqual(stats['count_lost'], 2)
+
+
+
+# Standalone.
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
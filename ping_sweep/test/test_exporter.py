@@ -0,0 +1,139 @@
+from __future__ import division, print_function, unicode_literals
+
+import unittest
+
+try:
+    from urllib2 import urlopen, HTTPError
+except ImportError:
+    from urllib.request import urlopen
+    from urllib.error import HTTPError
+
+import accumulator
+import engine
+import exporter
+
+
+def make_tally(times, count_timeout=0, count_error=0):
+    tally = accumulator.Tally()
+    for time_ping in times:
+        tally.add_result({'time_ping': time_ping, 'is_same_data': True, 'packet_size': 40})
+    for k in range(count_timeout):
+        tally.add_result({'time_ping': None, 'is_same_data': False, 'packet_size': 40})
+    tally.count_error += count_error
+
+    return tally
+
+
+def metric_lines(text):
+    return [line for line in text.splitlines() if not line.startswith('#')]
+
+
+class Test_Exporter(unittest.TestCase):
+
+    def test_bucket_counts(self):
+        histogram = accumulator.LogHistogram()
+        for value in [0.05, 0.3, 0.3, 4., 2000.]:
+            histogram.add(value)
+
+        self.assertEqual(exporter.bucket_counts(histogram, [0.1, 1., 10., 100.]), [1, 3, 4, 4])
+        self.assertEqual(exporter.bucket_counts(accumulator.LogHistogram(), [1., 10.]), [0, 0])
+
+
+    def test_render(self):
+        metrics = exporter.MetricsExporter(buckets=[1., 10.])
+        metrics.add(('host', 32), make_tally([0.5, 5.], count_timeout=1))
+        metrics.add(('host', 32), make_tally([20.], count_error=1))
+
+        lines = metric_lines(metrics.render())
+        self.assertEqual(lines, [
+            'ping_sweep_rtt_seconds_bucket{host="host",size="32",le="0.001"} 1',
+            'ping_sweep_rtt_seconds_bucket{host="host",size="32",le="0.01"} 2',
+            'ping_sweep_rtt_seconds_bucket{host="host",size="32",le="+Inf"} 3',
+            'ping_sweep_rtt_seconds_sum{host="host",size="32"} 0.0255',
+            'ping_sweep_rtt_seconds_count{host="host",size="32"} 3',
+            'ping_sweep_probes_sent_total{host="host",size="32"} 4',
+            'ping_sweep_probes_lost_total{host="host",size="32",reason="timeout"} 1',
+            'ping_sweep_probes_lost_total{host="host",size="32",reason="corrupt"} 0',
+            'ping_sweep_probes_lost_total{host="host",size="32",reason="error"} 1'])
+
+
+    def test_families_grouped(self):
+        metrics = exporter.MetricsExporter()
+        metrics.add(('a', 32), make_tally([1.]))
+        metrics.add(('b"\\', 32), make_tally([1.]))
+
+        text = metrics.render()
+
+        # Each family's lines all come together, right after its own header.
+        names = []
+        for line in metric_lines(text):
+            name = line.split('{', 1)[0]
+            for suffix in ('_bucket', '_sum', '_count'):
+                if name.endswith(suffix):
+                    name = name[:-len(suffix)]
+            if not names or names[-1] != name:
+                names.append(name)
+        self.assertEqual(names, [name for name, kind, help in exporter.SERIES_METRICS])
+
+        self.assertIn('ping_sweep_probes_sent_total{host="b\\"\\\\",size="32"} 1', text)
+
+
+    def test_incremental(self):
+        metrics = exporter.MetricsExporter()
+        for k in range(100):
+            metrics.add(('host{:d}'.format(k), 32), make_tally([1.]))
+
+        first = metrics.render()
+        chunk = metrics.chunks['ping_sweep_probes_sent_total'][('host1', 32)]
+
+        # Nothing changed, nothing rendered again.
+        self.assertEqual(metrics.render(), first)
+
+        metrics.add(('host7', 32), make_tally([2.]))
+        self.assertEqual(metrics.dirty, set([('host7', 32)]))
+
+        second = metrics.render()
+        self.assertIn('ping_sweep_probes_sent_total{host="host7",size="32"} 2', second)
+        self.assertTrue(metrics.chunks['ping_sweep_probes_sent_total'][('host1', 32)] is chunk)
+
+
+    def test_engine_metrics(self):
+        metrics = exporter.MetricsExporter()
+        self.assertNotIn('ping_sweep_engine', metrics.render())
+
+        sweep = engine.SweepEngine()
+        metrics.watch(sweep)
+        metrics.render(time_now=10.)
+
+        sweep.counters.count_sent += 50
+        text = metrics.render(time_now=12.)
+        self.assertIn('ping_sweep_engine_in_flight 0\n', text)
+        self.assertIn('ping_sweep_engine_send_rate 25.0\n', text)
+        self.assertIn('ping_sweep_engine_sent_packets_total 50\n', text)
+
+
+    def test_server(self):
+        metrics = exporter.MetricsExporter()
+        metrics.add(('host', 32), make_tally([1.]))
+
+        server = exporter.start_server(metrics, 0, host=str('127.0.0.1'))
+        try:
+            url = 'http://127.0.0.1:{:d}'.format(server.server_address[1])
+
+            response = urlopen(url + '/metrics')
+            self.assertEqual(response.info()['Content-Type'], exporter.CONTENT_TYPE)
+            self.assertIn(b'ping_sweep_probes_sent_total{host="host",size="32"} 1',
+                          response.read())
+
+            with self.assertRaises(HTTPError):
+                urlopen(url + '/other')
+
+        finally:
+            server.shutdown()
+            server.server_close()
+
+
+
+# Standalone.
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,97 @@
+from __future__ import division, print_function, unicode_literals
+
+import unittest
+
+import inflight
+import ping_sweep
+
+class Test_InFlight(unittest.TestCase):
+
+    def setUp(self):
+        self.table = inflight.InFlightTable()
+
+
+    def test_matched(self):
+        self.table.add((1, 10), 123.)
+
+        status, entry = self.table.match((1, 10))
+
+        self.assertEqual(status, inflight.MATCHED)
+        self.assertEqual(entry, 123.)
+        self.assertEqual(len(self.table), 0)
+
+
+    def test_late_then_duplicate(self):
+        self.table.add((1, 10), 123.)
+        self.table.expire((1, 10))
+
+        status, entry = self.table.match((1, 10))
+        self.assertEqual(status, inflight.LATE)
+        self.assertEqual(entry, 123.)
+
+        status, entry = self.table.match((1, 10))
+        self.assertEqual(status, inflight.DUPLICATE)
+
+        self.assertEqual(self.table.count_late, 1)
+        self.assertEqual(self.table.count_duplicate, 1)
+
+
+    def test_duplicate(self):
+        self.table.add((1, 10), 123.)
+        self.table.match((1, 10))
+
+        status, entry = self.table.match((1, 10))
+
+        self.assertEqual(status, inflight.DUPLICATE)
+        self.assertEqual(self.table.count_late, 0)
+
+
+    def test_foreign(self):
+        self.table.add((1, 10), 123.)
+
+        status, entry = self.table.match((2, 10))
+
+        self.assertEqual(status, inflight.FOREIGN)
+        self.assertEqual(entry, None)
+        self.assertEqual(self.table.count_foreign, 1)
+        self.assertTrue((1, 10) in self.table)
+
+
+    def test_history_limit(self):
+        table = inflight.InFlightTable(history=2)
+        for seq in range(3):
+            table.add((1, seq), seq)
+            table.match((1, seq))
+
+        status, entry = table.match((1, 0))
+        self.assertEqual(status, inflight.FOREIGN)
+
+
+    def test_next_seq_skips_pending(self):
+        self.table.seq = 4
+        self.table.add((1, 5), 0.)
+
+        self.assertEqual(self.table.next_seq(1), 6)
+
+
+    def test_ping_once_seq(self):
+        """
+        Requires admin or root, same as test_is_admin.
+        """
+        sock = ping_sweep.create_socket('127.0.0.1')
+        table = inflight.InFlightTable()
+
+        res_A = ping_sweep.ping_once(sock, data_size=32, table=table)
+        res_B = ping_sweep.ping_once(sock, data_size=32, table=table)
+        sock.close()
+
+        self.assertNotEqual(res_A['seq'], res_B['seq'])
+        self.assertTrue(res_A['is_same_data'])
+        self.assertTrue(res_B['is_same_data'])
+        self.assertEqual(len(table), 0)
+
+
+
+# Standalone.
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,69 @@
+from __future__ import division, print_function, unicode_literals
+
+import random
+import socket
+import unittest
+
+import dpkt
+
+import packets
+
+class Test_Packets(unittest.TestCase):
+
+    def test_template_matches_dpkt(self):
+        template = packets.PacketTemplate(100)
+        packet = template.patch(0x1234, 7)
+
+        echo = dpkt.icmp.ICMP.Echo(id=0x1234, seq=7, data=template.payload)
+        icmp = dpkt.icmp.ICMP(type=dpkt.icmp.ICMP_ECHO, data=echo)
+
+        self.assertEqual(bytes(packet), bytes(icmp))
+
+
+    def test_incremental_checksum(self):
+        template = packets.PacketTemplate(333, pattern=b'xyz')
+
+        for k in range(1000):
+            pid = random.randint(0, 0xffff)
+            seq = random.randint(0, 0xffff)
+            packet = template.patch(pid, seq)
+
+            self.assertEqual(dpkt.in_cksum(bytes(packet)), 0)
+
+        for pid, seq in [(0, 0), (0xffff, 0xffff), (0, 0xffff)]:
+            packet = template.patch(pid, seq)
+            self.assertEqual(dpkt.in_cksum(bytes(packet)), 0)
+
+
+    def test_pattern(self):
+        self.assertEqual(packets.make_payload(7, b'abc'), b'abcabca')
+        self.assertEqual(packets.make_payload(0, b'abc'), b'')
+
+
+    def test_template_cache(self):
+        template_A = packets.get_template(64)
+        template_B = packets.get_template(64)
+        template_C = packets.get_template(64, pattern=b'\x00')
+
+        self.assertTrue(template_A is template_B)
+        self.assertFalse(template_A is template_C)
+        self.assertEqual(len(template_C), 64 + packets.ICMP_HEADER_SIZE)
+
+
+
+    def test_template_ipv6(self):
+        template = packets.get_template(64, family=socket.AF_INET6)
+        packet = template.patch(0x1234, 7)
+
+        # Checksum is left for the kernel.
+        echo = dpkt.icmp6.ICMP6.Echo(id=0x1234, seq=7, data=template.payload)
+        icmp = dpkt.icmp6.ICMP6(type=dpkt.icmp6.ICMP6_ECHO_REQUEST, sum=0, data=echo)
+        self.assertEqual(bytes(packet), icmp.pack())
+
+        self.assertFalse(template is packets.get_template(64))
+        self.assertTrue(packets.get_template(64, family=socket.AF_INET) is packets.get_template(64))
+
+
+# Standalone.
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -39,6 +39,16 @@ class Test_Ping_Sweep(unittest.TestCase):
         self.assertEqual(cm.exception.msg, value_true)
 
 
+    def test_invalid_name_sweep(self):
+        # A single host sweep has nothing to do without its host.
+        with self.assertRaises(ping_sweep.PingSweepNameError):
+            ping_sweep.ping_sweep('no-such-host.invalid')
+
+        # Many hosts, the name is only skipped.
+        self.assertEqual(ping_sweep.ping_sweep_hosts(['no-such-host.invalid'], size_sweep=[32],
+                                                     count_send=1), [])
+
+
 
 
 
@@ -0,0 +1,98 @@
+
+from __future__ import division, print_function, unicode_literals
+
+import socket
+import unittest
+
+import dpkt
+
+import packets
+import pmtu
+
+def ip_packet(icmp):
+    ip = dpkt.ip.IP(p=dpkt.ip.IP_PROTO_ICMP, data=icmp)
+    ip.len = len(ip)
+    return bytes(ip)
+
+class FakePath(pmtu.PathMtu):
+    """
+    Path with a 1400 byte hop that reports its MTU, and a 1300 byte hop further along that
+    quietly drops anything bigger.
+    """
+    def probe(self, host_addr, data_size):
+        self.count_send += 1
+        size = data_size + pmtu.HEADER_SIZE
+        if size > 1400:
+            return pmtu.TOO_BIG, 1400
+        if size > 1300:
+            return pmtu.LOST, None
+        return pmtu.OK, None
+
+class Test_Pmtu(unittest.TestCase):
+
+    def test_parse_echo_reply(self):
+        echo = dpkt.icmp.ICMP.Echo(id=1234, seq=7, data=b'abcd')
+        buf = ip_packet(dpkt.icmp.ICMP(type=dpkt.icmp.ICMP_ECHOREPLY, data=echo))
+
+        self.assertEqual(pmtu.parse_packet(buf, 1234), (7, pmtu.OK, None))
+        self.assertEqual(pmtu.parse_packet(buf, 4321), None)
+
+
+    def test_parse_needfrag(self):
+        echo = dpkt.icmp.ICMP.Echo(id=1234, seq=9, data=b'x' * 1500)
+        request = ip_packet(dpkt.icmp.ICMP(type=dpkt.icmp.ICMP_ECHO, data=echo))
+
+        # Routers quote the IP header and the first 8 bytes of the original datagram.
+        unreach = dpkt.icmp.ICMP.Unreach(mtu=1400, data=request[:28])
+        buf = ip_packet(dpkt.icmp.ICMP(type=dpkt.icmp.ICMP_UNREACH,
+                                       code=dpkt.icmp.ICMP_UNREACH_NEEDFRAG, data=unreach))
+
+        self.assertEqual(pmtu.parse_packet(buf, 1234), (9, pmtu.TOO_BIG, 1400))
+
+
+    def test_search(self):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            finder = FakePath(sock=sock, retries=0)
+            result = finder.search(str('10.0.0.2'), size_max=9000)
+        finally:
+            sock.close()
+
+        self.assertEqual(result['mtu'], 1300)
+        self.assertEqual(result['data_size'], 1300 - pmtu.HEADER_SIZE)
+        self.assertTrue(result['count_send'] < 16)
+
+
+    def test_localhost(self):
+        """
+        Requires admin or root, same as test_is_admin.
+        """
+        count_templates = len(packets._templates)
+        result = pmtu.discover(str('127.0.0.1'), size_max=2000)
+
+        # Loopback MTU is far bigger.
+        self.assertEqual(result['data_size'], 2000)
+        self.assertEqual(result['mtu'], 2000 + pmtu.HEADER_SIZE)
+
+        # Probe sizes are not kept around as templates.
+        self.assertEqual(len(packets._templates), count_templates)
+
+
+    def test_packet(self):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            finder = pmtu.PathMtu(sock=sock, pid=1234)
+            finder.seq = 7
+            large = finder._packet(1000)
+            small = finder._packet(100)
+        finally:
+            sock.close()
+
+        echo = dpkt.icmp.ICMP(bytes(small))
+        self.assertEqual((echo.data.id, echo.data.seq), (1234, 7))
+        self.assertEqual(bytes(small[8:]), bytes(large[8:108]))
+        self.assertEqual(dpkt.in_cksum(bytes(small)), 0)
+
+# Standalone.
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,169 @@
+from __future__ import division, print_function, unicode_literals
+
+import os
+import shutil
+import tempfile
+import unittest
+import warnings
+
+import probelog
+import writers
+
+
+class Test_ProbeLog(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.path = os.path.join(self.folder, str('probes.plog'))
+
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+
+    def write_some(self):
+        with probelog.ProbeLog(self.path, buffer_size=100) as log:
+            log.append(100., 'a', '10.0.0.1', 32, 1, 1.25, 'ok')
+            log.append(101., 'b', '10.0.0.2', 64, 2, None, 'timeout')
+            log.append(102., 'a', '10.0.0.1', 64, 3, None, 'error', ttl=3)
+
+
+    @unittest.skipUnless(probelog.np, 'NumPy not installed')
+    def test_read_log(self):
+        self.write_some()
+
+        records, targets = probelog.read_log(self.path)
+
+        self.assertEqual(targets, [('a', '10.0.0.1'), ('b', '10.0.0.2')])
+        self.assertEqual(len(records), 3)
+        self.assertEqual(records.itemsize, probelog.RECORD.size)
+        self.assertEqual(list(records['target']), [0, 1, 0])
+        self.assertEqual(list(records['rtt_us']), [1250, probelog.RTT_NONE, probelog.RTT_NONE])
+        self.assertEqual([probelog.STATUSES[code] for code in records['status']],
+                         ['ok', 'timeout', 'error'])
+        self.assertEqual(list(records['ttl']), [0, 0, 3])
+
+        times = probelog.time_ping(records)
+        self.assertEqual(times[0], 1.25)
+        self.assertTrue(probelog.np.isnan(times[1]))
+
+
+    def test_iter_log(self):
+        self.write_some()
+
+        records = list(probelog.iter_log(self.path))
+
+        self.assertEqual([record['host_name'] for record in records], ['a', 'b', 'a'])
+        self.assertEqual([record['time_ping'] for record in records], [1.25, None, None])
+        self.assertEqual(records[1]['status'], 'timeout')
+        self.assertEqual(records[2]['timestamp'], 102.)
+
+
+    def test_append(self):
+        self.write_some()
+
+        # Known targets keep their index in later runs.
+        with probelog.ProbeLog(self.path) as log:
+            log.append(200., 'c', '10.0.0.3', 32, 4, 2., 'ok')
+            log.append(201., 'b', '10.0.0.2', 32, 5, 2., 'ok')
+
+        records = list(probelog.iter_log(self.path))
+        self.assertEqual([record['target'] for record in records], [0, 1, 0, 2, 1])
+
+
+    def test_partial_record(self):
+        self.write_some()
+
+        # Crash part way through a record.
+        with open(self.path, 'ab') as fo:
+            fo.write(b'\x00' * 10)
+
+        with probelog.ProbeLog(self.path) as log:
+            log.append(200., 'a', '10.0.0.1', 32, 4, 2., 'ok')
+
+        records = list(probelog.iter_log(self.path))
+        self.assertEqual([record['seq'] for record in records], [1, 2, 3, 4])
+
+
+    def test_partial_target(self):
+        self.write_some()
+
+        # Crash part way through writing out a new target.
+        with open(probelog.targets_path(self.path), 'ab') as fo:
+            fo.write(b'c\t10.0')
+
+        self.assertEqual(probelog.read_targets(self.path), [('a', '10.0.0.1'), ('b', '10.0.0.2')])
+
+        with probelog.ProbeLog(self.path) as log:
+            log.append(200., 'c', '10.0.0.3', 32, 4, 2., 'ok')
+
+        records = list(probelog.iter_log(self.path))
+        self.assertEqual([record['host_addr'] for record in records],
+                         ['10.0.0.1', '10.0.0.2', '10.0.0.1', '10.0.0.3'])
+
+
+    def test_malformed_target(self):
+        self.write_some()
+
+        with open(probelog.targets_path(self.path), 'ab') as fo:
+            fo.write(b'no tab here\n')
+
+        # Keeps its index, so the targets after it still line up.
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter(str('always'))
+            with probelog.ProbeLog(self.path) as log:
+                log.append(200., 'c', '10.0.0.3', 32, 4, 2., 'ok')
+
+        self.assertEqual(len(caught), 1)
+        self.assertEqual(list(probelog.iter_log(self.path))[-1]['target'], 3)
+
+
+    def test_bytes_target(self):
+        with probelog.ProbeLog(self.path) as log:
+            log.append(100., 'caf\xe9', '10.0.0.1', 32, 1, 1.25, 'ok')
+
+        # Names from the command line are bytes under Python 2, the ones read back are text.
+        with probelog.ProbeLog(self.path) as log:
+            log.append(200., 'caf\xe9'.encode('utf-8'), b'10.0.0.1', 32, 2, 2., 'ok')
+
+        self.assertEqual(probelog.read_targets(self.path), [('caf\xe9', '10.0.0.1')])
+        self.assertEqual([record['target'] for record in probelog.iter_log(self.path)], [0, 0])
+
+
+    def test_empty_and_bad(self):
+        probelog.ProbeLog(self.path).close()
+        self.assertEqual(list(probelog.iter_log(self.path)), [])
+
+        with open(self.path, 'wb') as fo:
+            fo.write(b'not a probe log at all')
+
+        with self.assertRaises(probelog.ProbeLogError):
+            probelog.ProbeLog(self.path)
+
+        with self.assertRaises(probelog.ProbeLogError):
+            list(probelog.iter_log(self.path))
+
+
+    def test_writer(self):
+        class Cell(object):
+            host_name = str('a')
+            host_addr = str('10.0.0.1')
+
+        result = {'time_ping': 0.5, 'data_size': 32, 'packet_size': 40, 'timeout': 1000.,
+                  'is_same_data': True, 'id': 1, 'echo_id': 1, 'seq': 9, 'error': None}
+
+        with writers.create_writer(self.path, writers.PROBE_FIELDS) as writer:
+            writer.write(writers.probe_record(Cell(), result, timestamp=100.))
+
+        records = list(probelog.iter_log(self.path))
+        self.assertEqual(len(records), 1)
+        self.assertEqual((records[0]['seq'], records[0]['time_ping']), (9, 0.5))
+
+        with self.assertRaises(writers.WriterError):
+            writers.create_writer(self.path, writers.CELL_FIELDS)
+
+
+
+# Standalone.
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
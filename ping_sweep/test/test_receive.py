@@ -0,0 +1,172 @@
+from __future__ import division, print_function, unicode_literals
+
+import socket
+import struct
+import unittest
+
+import dpkt
+
+import receive
+
+class Test_Receive(unittest.TestCase):
+
+    def make_reply(self, icmp_type=dpkt.icmp.ICMP_ECHOREPLY, payload=b'0123456789'):
+        echo = dpkt.icmp.ICMP.Echo(id=0x4321, seq=99, data=payload)
+        icmp = dpkt.icmp.ICMP(type=icmp_type, data=echo)
+        ip = dpkt.ip.IP(p=dpkt.ip.IP_PROTO_ICMP, data=icmp)
+        ip.len = len(ip)
+
+        buf = bytearray(receive.BUFFER_SIZE)
+        packet = bytes(ip)
+        buf[:len(packet)] = packet
+
+        return buf, len(packet)
+
+
+    def test_parse_echo_reply(self):
+        buf, nbytes = self.make_reply()
+
+        reply = receive.parse_echo_reply(buf, nbytes)
+
+        self.assertEqual(reply, (0x4321, 99, 28, 10))
+        self.assertEqual(receive.payload_digest(buf, 28, 10), receive.payload_digest(b'0123456789'))
+
+
+    def test_parse_no_ip_header(self):
+        buf, nbytes = self.make_reply()
+
+        reply = receive.parse_echo_reply(buf[20:], nbytes - 20, ip_header=False)
+
+        self.assertEqual(reply, (0x4321, 99, 8, 10))
+
+
+    def test_parse_other(self):
+        buf, nbytes = self.make_reply(icmp_type=dpkt.icmp.ICMP_ECHO)
+        self.assertEqual(receive.parse_echo_reply(buf, nbytes), None)
+
+        buf, nbytes = self.make_reply()
+        self.assertEqual(receive.parse_echo_reply(buf, 24), None)
+
+
+    def make_error(self, icmp_type, icmp_code, quote_size=28):
+        echo = dpkt.icmp.ICMP.Echo(id=0x4321, seq=99, data=b'0123456789')
+        request = dpkt.ip.IP(p=dpkt.ip.IP_PROTO_ICMP, data=dpkt.icmp.ICMP(type=dpkt.icmp.ICMP_ECHO,
+                                                                            data=echo))
+        request.len = len(request)
+
+        # Routers need only quote the IP header and the first 8 bytes of the datagram.
+        quote = dpkt.icmp.ICMP.Unreach(data=bytes(request)[:quote_size])
+        icmp = dpkt.icmp.ICMP(type=icmp_type, code=icmp_code, data=quote)
+        ip = dpkt.ip.IP(p=dpkt.ip.IP_PROTO_ICMP, data=icmp)
+        ip.len = len(ip)
+
+        buf = bytearray(receive.BUFFER_SIZE)
+        packet = bytes(ip)
+        buf[:len(packet)] = packet
+
+        return buf, len(packet)
+
+
+    def test_parse_icmp_error(self):
+        buf, nbytes = self.make_error(dpkt.icmp.ICMP_UNREACH, dpkt.icmp.ICMP_UNREACH_HOST)
+
+        self.assertEqual(receive.parse_echo_reply(buf, nbytes), None)
+        self.assertEqual(receive.parse_icmp_error(buf, nbytes),
+                         (dpkt.icmp.ICMP_UNREACH, dpkt.icmp.ICMP_UNREACH_HOST, 0x4321, 99))
+
+        error = receive.parse_icmp_error(buf[20:], nbytes - 20, ip_header=False)
+        self.assertEqual(error[2:], (0x4321, 99))
+
+        buf, nbytes = self.make_error(dpkt.icmp.ICMP_TIMEXCEED, dpkt.icmp.ICMP_TIMEXCEED_INTRANS)
+        self.assertEqual(receive.parse_icmp_error(buf, nbytes)[0], dpkt.icmp.ICMP_TIMEXCEED)
+
+
+    def test_parse_icmp_error_other(self):
+        buf, nbytes = self.make_reply()
+        self.assertEqual(receive.parse_icmp_error(buf, nbytes), None)
+
+        # Redirects quote the datagram too, but are not errors.
+        buf, nbytes = self.make_error(dpkt.icmp.ICMP_REDIRECT, 0)
+        self.assertEqual(receive.parse_icmp_error(buf, nbytes), None)
+
+        # Quote cut short before the echo id.
+        buf, nbytes = self.make_error(dpkt.icmp.ICMP_UNREACH, 0, quote_size=24)
+        self.assertEqual(receive.parse_icmp_error(buf, nbytes), None)
+
+
+    def test_parse_error_queue(self):
+        # What a datagram socket's error queue holds: the quoted echo request header as data, the
+        # error and who sent it as ancillary data.
+        buf = bytearray(struct.pack(str('>BBHHH'), dpkt.icmp.ICMP_ECHO, 0, 0, 0x4321, 99))
+        offender = (struct.pack(str('@H'), socket.AF_INET) + b'\x00\x00' +
+                    socket.inet_aton('10.0.0.1'))
+        error = struct.pack(str('@IBBBBII'), 113, receive.SO_EE_ORIGIN_ICMP,
+                            dpkt.icmp.ICMP_UNREACH, dpkt.icmp.ICMP_UNREACH_HOST, 0, 0, 0)
+        data = error + offender + b'\x00' * 8
+        control = struct.pack(str('@Lii'), struct.calcsize(str('@Lii')) + len(data),
+                              socket.IPPROTO_IP, receive.IP_RECVERR) + data
+
+        self.assertEqual(receive.parse_error_queue(buf, len(buf), control),
+                         (dpkt.icmp.ICMP_UNREACH, dpkt.icmp.ICMP_UNREACH_HOST, 0x4321, 99,
+                          '10.0.0.1'))
+
+        # No error message, or not about an echo request.
+        self.assertEqual(receive.parse_error_queue(buf, len(buf), b''), None)
+        buf[0] = dpkt.icmp.ICMP_ECHOREPLY
+        self.assertEqual(receive.parse_error_queue(buf, len(buf), control), None)
+
+
+    def test_error_name(self):
+        self.assertEqual(receive.error_name(dpkt.icmp.ICMP_UNREACH, dpkt.icmp.ICMP_UNREACH_HOST),
+                         'host unreachable')
+        self.assertEqual(receive.error_name(dpkt.icmp.ICMP_UNREACH, 15), 'unreachable code 15')
+        self.assertEqual(receive.error_name(dpkt.icmp.ICMP_TIMEXCEED, 0), 'ttl exceeded')
+
+
+    def test_buffer_pool(self):
+        pool = receive.BufferPool(count=2, size=100)
+
+        buf_A = pool.acquire()
+        buf_B = pool.acquire()
+        buf_C = pool.acquire()
+
+        self.assertEqual(len(pool), 0)
+        self.assertEqual(len(buf_C), 100)
+
+        pool.release(buf_A)
+        self.assertTrue(pool.acquire() is buf_A)
+
+
+
+    def test_parse_ipv6(self):
+        echo = dpkt.icmp6.ICMP6.Echo(id=0x4321, seq=99, data=b'0123456789')
+        reply = bytes(dpkt.icmp6.ICMP6(type=dpkt.icmp6.ICMP6_ECHO_REPLY, data=echo))
+        buf = bytearray(reply)
+
+        self.assertEqual(receive.parse_echo_reply(buf, len(buf), ip_header=False,
+                                                  family=socket.AF_INET6), (0x4321, 99, 8, 10))
+
+        # IPv4 echo reply type is not an ICMPv6 one.
+        self.assertEqual(receive.parse_echo_reply(buf, len(buf), ip_header=False), None)
+
+        request = dpkt.icmp6.ICMP6(type=dpkt.icmp6.ICMP6_ECHO_REQUEST, data=echo)
+        quoted = dpkt.ip6.IP6(nxt=dpkt.ip.IP_PROTO_ICMP6, hlim=1, data=request,
+                              src=b'\x00' * 16, dst=b'\x00' * 16)
+        quoted.plen = len(request)
+        # Bundled dpkt only packs a freshly built IP6 header by itself.
+        quote = quoted.pack_hdr() + bytes(request)
+        error = dpkt.icmp6.ICMP6(type=dpkt.icmp6.ICMP6_TIME_EXCEEDED, code=0,
+                                 data=dpkt.icmp6.ICMP6.TimeExceed(data=quote))
+        buf = bytearray(bytes(error))
+
+        self.assertEqual(receive.parse_icmp_error(buf, len(buf), ip_header=False,
+                                                  family=socket.AF_INET6),
+                         (dpkt.icmp6.ICMP6_TIME_EXCEEDED, 0, 0x4321, 99))
+        self.assertTrue(receive.is_time_exceeded(dpkt.icmp6.ICMP6_TIME_EXCEEDED, socket.AF_INET6))
+        self.assertEqual(receive.error_name(dpkt.icmp6.ICMP6_DST_UNREACH, 3, socket.AF_INET6),
+                         'address unreachable')
+
+
+# Standalone.
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,104 @@
+from __future__ import division, print_function, unicode_literals
+
+import threading
+import unittest
+
+import accumulator
+import rolling
+
+
+def make_tally(times, count_timeout=0):
+    tally = accumulator.Tally()
+    for time_ping in times:
+        tally.add_result({'time_ping': time_ping, 'is_same_data': True, 'packet_size': 40})
+    for k in range(count_timeout):
+        tally.add_result({'time_ping': None, 'is_same_data': False, 'packet_size': 40})
+
+    return tally
+
+
+class Test_Rolling(unittest.TestCase):
+
+    def test_ring(self):
+        ring = rolling.RollingTally(60., slots=6)
+
+        ring.add(make_tally([1., 2.]), 0.)
+        ring.add(make_tally([3.], count_timeout=1), 25.)
+
+        total = ring.total(30.)
+        self.assertEqual(total.count_send, 4)
+        self.assertEqual(total.count_timeout, 1)
+        self.assertEqual(total.accumulator.max, 3.)
+
+        # First slot has slid out of the window, the second not yet.
+        total = ring.total(65.)
+        self.assertEqual(total.count_send, 2)
+
+        self.assertEqual(ring.total(100.).count_send, 0)
+
+
+    def test_ring_reuse(self):
+        ring = rolling.RollingTally(60., slots=6)
+
+        # Same slot a whole ring later starts over.
+        ring.add(make_tally([1.]), 5.)
+        ring.add(make_tally([2.]), 65.)
+
+        total = ring.total(65.)
+        self.assertEqual(total.count_send, 1)
+        self.assertEqual(total.accumulator.min, 2.)
+        self.assertEqual(len(ring.tallies), 6)
+
+
+    def test_windows(self):
+        stats = rolling.RollingStats(windows=[60., 600.])
+
+        stats.add(('A', 32), make_tally([1.]), 50.)
+        stats.add(('A', 32), make_tally([2.]), 300.)
+        stats.add(('B', 32), make_tally([3.]), 300.)
+
+        short = stats.snapshot(60., 310.)
+        self.assertEqual([key for key, tally in short], [('A', 32), ('B', 32)])
+        self.assertEqual([tally.count_send for key, tally in short], [1, 1])
+
+        long = stats.snapshot(600., 310.)
+        self.assertEqual([tally.count_send for key, tally in long], [2, 1])
+
+
+    def test_prune(self):
+        stats = rolling.RollingStats(windows=[60., 600.])
+
+        stats.add(('A', 32), make_tally([1.]), 0.)
+        stats.add(('B', 32), make_tally([2.]), 500.)
+
+        self.assertEqual(stats.prune(700.), 1)
+        self.assertEqual(len(stats), 1)
+        self.assertEqual([key for key, tally in stats.snapshot(600., 700.)], [('B', 32)])
+
+
+    def test_reader_thread(self):
+        stats = rolling.RollingStats()
+        done = threading.Event()
+        counts = []
+
+        def reader():
+            while not done.is_set():
+                counts.append(sum(tally.count_send for key, tally in stats.snapshot(60., 1.)))
+
+        thread = threading.Thread(target=reader)
+        thread.start()
+        try:
+            for k in range(200):
+                stats.add(('A', k % 4), make_tally([1.]), 1.)
+        finally:
+            done.set()
+            thread.join()
+
+        self.assertEqual(sum(tally.count_send for key, tally in stats.snapshot(60., 1.)), 200)
+        self.assertEqual(counts, sorted(counts))
+
+
+
+# Standalone.
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
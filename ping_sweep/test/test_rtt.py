@@ -0,0 +1,54 @@
+
+from __future__ import division, print_function, unicode_literals
+
+import unittest
+
+import rtt
+
+class Test_Rtt(unittest.TestCase):
+
+    def test_initial(self):
+        estimator = rtt.RttEstimator(20., 1000.)
+        self.assertEqual(estimator.timeout, 1000.)
+
+        estimator = rtt.RttEstimator(20., 1000., timeout_initial=200.)
+        self.assertEqual(estimator.timeout, 200.)
+
+
+    def test_sample(self):
+        estimator = rtt.RttEstimator(1., 1000.)
+
+        # First sample: SRTT = R, RTTVAR = R/2, so RTO = 3 R.
+        estimator.sample(10.)
+        self.assertEqual(estimator.srtt, 10.)
+        self.assertEqual(estimator.rttvar, 5.)
+        self.assertEqual(estimator.timeout, 30.)
+
+        estimator.sample(18.)
+        self.assertEqual(estimator.rttvar, 0.75*5. + 0.25*8.)
+        self.assertEqual(estimator.srtt, 0.875*10. + 0.125*18.)
+        self.assertEqual(estimator.timeout, estimator.srtt + 4*estimator.rttvar)
+
+
+    def test_limits(self):
+        estimator = rtt.RttEstimator(20., 100.)
+
+        # Steady fast host settles at the floor.
+        for k in range(50):
+            estimator.sample(0.5)
+        self.assertEqual(estimator.timeout, 20.)
+
+        # Timeouts back off, up to the ceiling.
+        estimator.backoff()
+        self.assertEqual(estimator.timeout, 40.)
+        for k in range(5):
+            estimator.backoff()
+        self.assertEqual(estimator.timeout, 100.)
+
+        # Slow host is held to the ceiling too.
+        estimator.sample(500.)
+        self.assertEqual(estimator.timeout, 100.)
+
+# Standalone.
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,102 @@
+from __future__ import division, print_function, unicode_literals
+
+import unittest
+
+import engine
+import scheduler
+
+class Test_Scheduler(unittest.TestCase):
+
+    def test_token_bucket(self):
+        bucket = scheduler.TokenBucket(10., burst=2, time_start=0.)
+
+        self.assertTrue(bucket.take(0.))
+        self.assertTrue(bucket.take(0.))
+        self.assertFalse(bucket.take(0.))
+        self.assertAlmostEqual(bucket.time_available(), 0.1)
+
+        self.assertTrue(bucket.take(0.1))
+        self.assertFalse(bucket.take(0.15))
+
+        # Never more than burst, however long it sits idle.
+        bucket.refill(100.)
+        self.assertEqual(bucket.tokens, 2)
+
+
+    def test_interleave(self):
+        ready = scheduler.Scheduler(interval=1.)
+        ready.add('A', 0.)
+        ready.add('B', 0.)
+
+        self.assertEqual(ready.pop(0.), 'A')
+        ready.push('A', 0.)
+        self.assertEqual(ready.pop(0.), 'B')
+        ready.push('B', 0.)
+
+        self.assertEqual(ready.pop(0.5), None)
+        self.assertEqual(ready.time_next(), 1.)
+
+
+    def test_absolute_timeline(self):
+        ready = scheduler.Scheduler(interval=1.)
+        ready.add('A', 0.)
+
+        # Sent a little late each time, the schedule still doesn't drift.
+        for k in range(10):
+            self.assertEqual(ready.pop(k + 0.3), 'A')
+            ready.push('A', k + 0.3)
+        self.assertEqual(ready.time_next(), 10.)
+
+        # Held up for a long time, no catch up burst afterwards.
+        self.assertEqual(ready.pop(20.), 'A')
+        ready.push('A', 20.)
+        self.assertEqual(ready.time_next(), 21.)
+
+
+    def test_global_rate(self):
+        ready = scheduler.Scheduler(rate=100.)
+        for target in range(5):
+            ready.add(target, 0.)
+
+        sent = []
+        time_now = 0.
+        while len(sent) < 10:
+            target = ready.pop(time_now)
+            if target is None:
+                time_now = ready.time_next()
+                continue
+            sent.append(time_now)
+            ready.push(target, time_now)
+
+        self.assertAlmostEqual(sent[-1], 0.09)
+
+
+    def test_target_rate(self):
+        ready = scheduler.Scheduler(target_rate=2.)
+        ready.add('A', 0.)
+
+        self.assertEqual(ready.pop(0.), 'A')
+        ready.push('A', 0.)
+        self.assertAlmostEqual(ready.time_next(), 0.5)
+
+
+    def test_engine_rate(self):
+        """
+        Requires admin or root, same as test_is_admin.
+        """
+        sweep = engine.SweepEngine(time_pause=0, rate=200., batch_size=1)
+        sweep.add_target('localhost', '127.0.0.1', [32, 64], count_send=10)
+
+        time_start = engine.clock()
+        cells = sweep.run()
+        time_run = engine.clock() - time_start
+
+        # First packet goes right away, then 19 more at 5 ms apart.
+        self.assertTrue(time_run >= 19 * 0.005)
+        self.assertTrue(all(cell.is_done for cell in cells))
+
+
+
+# Standalone.
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,79 @@
+
+from __future__ import division, print_function, unicode_literals
+
+import os
+import unittest
+
+import ping_sweep
+import shards
+import targets
+
+class Test_Shards(unittest.TestCase):
+
+    def test_localhost_sharded(self):
+        """
+        Requires admin or root, same as test_is_admin.
+        """
+        host_addrs = [(str(h), str(h)) for h in targets.iter_targets([str('127.0.0.1-4')])]
+
+        tallies, timeout, time_pause, interrupted = shards.run_sharded(
+            host_addrs, 2, [32, 256], count_send=3, chunk_size=1, time_pause=0, keep_times=True)
+
+        self.assertFalse(interrupted)
+        self.assertEqual([key for key, tally in tallies],
+                         [(h, d) for h, a in host_addrs for d in [32, 256]])
+
+        for key, tally in tallies:
+            self.assertEqual(tally.count_send, 3)
+            self.assertEqual(tally.count_recv, 3)
+            self.assertEqual(len(tally.times), 3)
+
+        self.assertGreater(timeout, 0)
+
+
+    def test_bad_target(self):
+        def bad_targets():
+            yield str('localhost'), str('127.0.0.1')
+            raise targets.TargetError('Bad target')
+
+        self.assertRaises(targets.TargetError, shards.run_sharded, bad_targets(), 2, [32],
+                          count_send=1, time_pause=0)
+
+
+    def test_worker_killed(self):
+        """
+        Requires admin or root, same as test_is_admin.
+        """
+        worker = shards._worker
+
+        def dies_first(index, *args):
+            if index == 0:
+                os._exit(3)
+            worker(index, *args)
+
+        host_addrs = [(str(h), str(h)) for h in targets.iter_targets([str('127.0.0.1-4')])]
+
+        # Workers are forked, and see the replacement.
+        shards._worker = dies_first
+        try:
+            with self.assertRaises(shards.ShardError) as context:
+                shards.run_sharded(host_addrs, 2, [32], count_send=1, chunk_size=1, time_pause=0)
+        finally:
+            shards._worker = worker
+
+        self.assertTrue('exited with code 3' in str(context.exception))
+
+
+    def test_ping_sweep_hosts_workers(self):
+        stats_sweep = ping_sweep.ping_sweep_hosts([str('127.0.0.1'), str('127.0.0.2')],
+                                                  size_sweep=[32], count_send=2, time_pause=0,
+                                                  workers=2)
+
+        self.assertEqual([s['host_name'] for s in stats_sweep], ['127.0.0.1', '127.0.0.2'])
+        for stats in stats_sweep:
+            self.assertEqual(stats['count_lost'], 0)
+            self.assertEqual(stats['accumulator'].count, 2)
+
+# Standalone.
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,66 @@
+
+from __future__ import division, print_function, unicode_literals
+
+import unittest
+
+import accumulator
+import stopping
+
+def make_tally(times, count_lost=0):
+    tally = accumulator.Tally()
+    for time_ping in times:
+        tally.add_result({'time_ping': time_ping, 'is_same_data': True, 'packet_size': 40})
+    for k in range(count_lost):
+        tally.add_result({'time_ping': None, 'is_same_data': False, 'packet_size': 40})
+    return tally
+
+class Test_Stopping(unittest.TestCase):
+
+    def test_normal_quantile(self):
+        self.assertAlmostEqual(stopping.normal_quantile(0.95), 1.959964, places=5)
+        self.assertAlmostEqual(stopping.normal_quantile(0.99), 2.575829, places=5)
+        self.assertRaises(ValueError, stopping.normal_quantile, 1.)
+
+
+    def test_wilson_interval(self):
+        # Known value: 0 lost out of 10, z = 1.96.
+        lo, hi = stopping.wilson_interval(0, 10, 1.96)
+        self.assertEqual(lo, 0.)
+        self.assertAlmostEqual(hi, 0.2775, places=4)
+
+        lo, hi = stopping.wilson_interval(5, 10, 1.96)
+        self.assertAlmostEqual(lo, 0.2366, places=4)
+        self.assertAlmostEqual(hi, 0.7634, places=4)
+
+        self.assertEqual(stopping.wilson_interval(0, 0, 1.96), (0., 1.))
+
+
+    def test_converged(self):
+        rule = stopping.StoppingRule()
+
+        # Steady and no loss.
+        self.assertTrue(rule.is_converged(make_tally([10.] * 20)))
+
+        # Too few probes to pin down the loss rate.
+        self.assertFalse(rule.is_converged(make_tally([10.] * 5)))
+
+        # Median all over the place.
+        self.assertFalse(rule.is_converged(make_tally([1., 10.] * 10)))
+
+        # Some loss, the interval on the rate stays wide.
+        self.assertFalse(rule.is_converged(make_tally([10.] * 15, count_lost=5)))
+
+        # Dead host, only the loss rate matters.
+        self.assertTrue(rule.is_converged(make_tally([], count_lost=20)))
+
+
+    def test_median_interval(self):
+        rule = stopping.StoppingRule()
+        self.assertEqual(rule.median_interval(make_tally([10.])), None)
+
+        lo, hi = rule.median_interval(make_tally(range(1, 101)))
+        self.assertTrue(35 < lo < 50 < hi < 65)
+
+# Standalone.
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,92 @@
+from __future__ import division, print_function, unicode_literals
+
+import itertools
+import os
+import shutil
+import tempfile
+import unittest
+
+import engine
+import ping_sweep
+import targets
+
+class Test_Targets(unittest.TestCase):
+
+    def test_cidr(self):
+        self.assertEqual(list(targets.expand(str('10.0.0.0/30'))), ['10.0.0.1', '10.0.0.2'])
+        self.assertEqual(list(targets.expand(str('10.0.0.7/32'))), ['10.0.0.7'])
+        self.assertRaises(targets.TargetError, list, targets.expand(str('10.0.0.0/33')))
+
+
+    def test_range(self):
+        self.assertEqual(list(targets.expand(str('10.1.2.254-255'))), ['10.1.2.254', '10.1.2.255'])
+        self.assertEqual(list(targets.expand(str('10.1.2.255-10.1.3.0'))), ['10.1.2.255', '10.1.3.0'])
+        self.assertRaises(targets.TargetError, list, targets.expand(str('10.1.2.5-1')))
+
+        # Host names with a dash are just host names.
+        self.assertEqual(list(targets.expand(str('my-host'))), ['my-host'])
+
+
+    def test_shuffled_range(self):
+        for count in [1, 3, 100, 1000]:
+            values = list(targets.shuffled_range(count))
+            self.assertEqual(sorted(values), list(range(count)))
+
+        self.assertNotEqual(list(targets.shuffled_range(1000)), list(range(1000)))
+
+
+    def test_lazy(self):
+        # A whole /8, shuffled, without building it first.
+        first = list(itertools.islice(targets.iter_targets([str('10.0.0.0/8')], shuffle=True), 5))
+
+        self.assertEqual(len(set(first)), 5)
+        self.assertTrue(all(t.startswith('10.') for t in first))
+
+
+    def test_seed(self):
+        specs = [str('10.0.0.0/24')]
+        self.assertEqual(list(targets.iter_targets(specs, shuffle=True, seed=3)),
+                         list(targets.iter_targets(specs, shuffle=True, seed=3)))
+
+
+    def test_target_set(self):
+        target_set = targets.TargetSet([str('10.0.0.0/29')], shuffle=True, seed=3)
+
+        # Walked afresh each time, in the same order.
+        first = list(target_set)
+        self.assertEqual(len(first), 6)
+        self.assertEqual(list(target_set), first)
+
+
+    def test_file(self):
+        folder = tempfile.mkdtemp()
+        try:
+            path = os.path.join(folder, 'targets.txt')
+            with open(path, 'w') as fo:
+                fo.write('# routers\nlocalhost 10.0.0.1-2\n\n10.0.1.0/31  # link\n')
+
+            found = list(targets.expand(str('@') + path))
+        finally:
+            shutil.rmtree(folder)
+
+        self.assertEqual(found, ['localhost', '10.0.0.1', '10.0.0.2', '10.0.1.0', '10.0.1.1'])
+
+
+    def test_engine_source(self):
+        """
+        Requires admin or root, same as test_is_admin.
+        """
+        sweep = engine.SweepEngine(time_pause=0, max_hosts=2)
+        source = ping_sweep.resolve_targets(targets.iter_targets([str('127.0.0.1-5')]))
+        sweep.add_source(source, [32], count_send=2)
+
+        cells = sweep.run()
+
+        self.assertEqual(len(cells), 5)
+        self.assertTrue(all(cell.tally.count_recv == 2 for cell in cells))
+
+
+
+# Standalone.
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
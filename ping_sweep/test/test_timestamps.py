@@ -0,0 +1,77 @@
+from __future__ import division, print_function, unicode_literals
+
+import socket
+import struct
+import time
+import unittest
+
+import engine
+import ping_sweep
+import timestamps
+
+class Test_Timestamps(unittest.TestCase):
+
+    def test_monotonic(self):
+        time_A = timestamps.monotonic()
+        time.sleep(0.01)
+        time_B = timestamps.monotonic()
+
+        self.assertTrue(0.005 < time_B - time_A < 1.)
+
+
+    def test_parse_control(self):
+        header_size = struct.calcsize(str('@Lii'))
+        data = struct.pack(str('@Lii'), header_size + 16, socket.SOL_SOCKET, timestamps.SCM_TIMESTAMPNS)
+        data += struct.pack(str('@ll'), 1234, 500000000)
+
+        self.assertEqual(timestamps.parse_control(data), 1234.5)
+
+
+    def test_parse_control_empty(self):
+        self.assertEqual(timestamps.parse_control(b''), None)
+
+        header_size = struct.calcsize(str('@Lii'))
+        data = struct.pack(str('@Lii'), header_size + 4, socket.IPPROTO_IP, 1) + b'\x00' * 8
+        self.assertEqual(timestamps.parse_control(data), None)
+
+
+    def test_kernel_timestamps_sweep(self):
+        """
+        Requires admin or root, same as test_is_admin.
+        """
+        sweep = engine.SweepEngine(time_pause=0, batch_size=1, kernel_timestamps=True)
+        sweep.add_target('localhost', '127.0.0.1', [64], count_send=10)
+
+        cells = sweep.run()
+
+        acc = cells[0].tally.accumulator
+        self.assertEqual(acc.count, 10)
+        self.assertTrue(0 < acc.min <= acc.max < 1000.)
+
+
+    def test_kernel_timestamps_ping_once(self):
+        """
+        Requires admin or root, same as test_is_admin.
+        """
+        with engine.SocketManager() as manager:
+            for k in range(3):
+                res = ping_sweep.ping_once(manager.get(), pid=manager.pid, table=manager.table,
+                                           host_addr='127.0.0.1', timeout=1.,
+                                           kernel_timestamps=True)
+                self.assertTrue(res['is_same_data'])
+                self.assertTrue(0 < res['time_ping'] < 1000.)
+
+            # Or set up just once for the socket and handed in.
+            batch = manager.get_batch()
+            self.assertTrue(manager.get_batch() is batch)
+            for k in range(3):
+                res = ping_sweep.ping_once(manager.get(), pid=manager.pid, table=manager.table,
+                                           host_addr='127.0.0.1', timeout=1., batch=batch)
+                self.assertTrue(res['is_same_data'])
+                self.assertTrue(0 < res['time_ping'] < 1000.)
+
+
+
+# Standalone.
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
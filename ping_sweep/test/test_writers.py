@@ -0,0 +1,155 @@
+from __future__ import division, print_function, unicode_literals
+
+import collections
+import csv
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import accumulator
+import writers
+
+
+class FakeCell(object):
+    host_name = str('host')
+    host_addr = str('10.0.0.1')
+
+
+def make_result(seq, time_ping=1.5, is_same_data=True, error=None):
+    return {'time_ping': time_ping, 'data_size': 32, 'packet_size': 40, 'timeout': 1000.,
+            'is_same_data': is_same_data, 'id': 1, 'echo_id': 1, 'seq': seq, 'error': error}
+
+
+class BrokenWriter(writers.RecordWriter):
+    def _open(self):
+        pass
+
+    def _write_batch(self, records):
+        raise IOError('disk full')
+
+    def _close(self):
+        pass
+
+
+class Test_Writers(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+
+    def test_probe_record(self):
+        cell = FakeCell()
+
+        record = writers.probe_record(cell, make_result(7), timestamp=100.)
+        self.assertEqual(record['status'], 'ok')
+        self.assertEqual(record['time_ping'], 1.5)
+        self.assertEqual(record['host_addr'], '10.0.0.1')
+        self.assertEqual(record['seq'], 7)
+        self.assertEqual(record['timestamp'], 100.)
+
+        # Lost probes carry no ping time.
+        record = writers.probe_record(cell, make_result(8, time_ping=2., is_same_data=False))
+        self.assertEqual((record['status'], record['time_ping']), ('corrupt', None))
+
+        record = writers.probe_record(cell, make_result(9, time_ping=None, is_same_data=False))
+        self.assertEqual(record['status'], 'timeout')
+
+        record = writers.probe_record(cell, make_result(10, is_same_data=False,
+                                                        error='Destination unreachable'))
+        self.assertEqual(record['status'], 'error')
+
+
+    def test_cell_record(self):
+        tally = accumulator.Tally()
+        for seq in range(4):
+            tally.add_result(make_result(seq, time_ping=seq + 1.))
+        tally.add_result(make_result(4, time_ping=None, is_same_data=False))
+
+        record = writers.cell_record('host', 32, tally, timestamp=100.)
+        self.assertEqual(record['count_send'], 5)
+        self.assertEqual(record['count_recv'], 4)
+        self.assertEqual(record['count_timeout'], 1)
+        self.assertEqual((record['min'], record['mean'], record['max']), (1., 2.5, 4.))
+
+        # Every column the terminal shows.
+        self.assertEqual(set(record), set(name for name, kind in writers.CELL_FIELDS))
+        self.assertAlmostEqual(record['p99.9'], 4., delta=0.1)
+
+        record = writers.cell_record('host', 32, accumulator.Tally())
+        self.assertEqual((record['mean'], record['p50']), (None, None))
+
+
+    def test_jsonl(self):
+        path = os.path.join(self.folder, str('probes.jsonl'))
+        cell = FakeCell()
+
+        with writers.create_writer(path, writers.PROBE_FIELDS, batch_size=4) as writer:
+            for seq in range(10):
+                writer.write(writers.probe_record(cell, make_result(seq), timestamp=100.))
+
+        self.assertEqual(writer.count, 10)
+
+        with open(path) as fi:
+            records = [json.loads(line, object_pairs_hook=collections.OrderedDict) for line in fi]
+
+        self.assertEqual([record['seq'] for record in records], list(range(10)))
+        self.assertEqual(list(records[0].keys()), [name for name, kind in writers.PROBE_FIELDS])
+
+
+    def test_csv(self):
+        path = os.path.join(self.folder, str('probes.csv'))
+        cell = FakeCell()
+
+        with writers.create_writer(path, writers.PROBE_FIELDS) as writer:
+            writer.write(writers.probe_record(cell, make_result(1), timestamp=100.))
+            writer.write(writers.probe_record(cell, make_result(2, time_ping=None,
+                                                                is_same_data=False)))
+
+        with open(path) as fi:
+            rows = list(csv.DictReader(fi))
+
+        self.assertEqual(len(rows), 2)
+        self.assertEqual(float(rows[0]['time_ping']), 1.5)
+        self.assertEqual(rows[1]['time_ping'], '')
+        self.assertEqual(rows[1]['status'], 'timeout')
+
+
+    def test_unknown_format(self):
+        with self.assertRaises(writers.WriterError):
+            writers.create_writer(os.path.join(self.folder, str('probes.xls')),
+                                  writers.PROBE_FIELDS)
+
+
+    def test_failure(self):
+        writer = BrokenWriter(str('broken.jsonl'), writers.PROBE_FIELDS, batch_size=1)
+        writer.write({})
+
+        # Raised from the probe loop's side on the next chance, never lost.
+        with self.assertRaises(writers.WriterError):
+            writer.close()
+
+
+    @unittest.skipUnless(writers.pyarrow, 'pyarrow not installed')
+    def test_parquet(self):
+        path = os.path.join(self.folder, str('probes.parquet'))
+        cell = FakeCell()
+
+        with writers.create_writer(path, writers.PROBE_FIELDS, batch_size=4) as writer:
+            for seq in range(10):
+                writer.write(writers.probe_record(cell, make_result(seq)))
+
+        table = writers.pyarrow.parquet.read_table(path)
+        self.assertEqual(table.num_rows, 10)
+        self.assertEqual(table.column('seq').to_pylist(), list(range(10)))
+
+
+
+# Standalone.
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
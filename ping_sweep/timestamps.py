@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+
+#
+# Copyright 2011 Pierre V. Villeneuve
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Clocks and kernel receive timestamps.
+
+With SO_TIMESTAMPNS (or SO_TIMESTAMPING) enabled, Linux stamps each packet as it comes in and
+hands the stamp over as ancillary data next to the packet.  That keeps Python scheduling and GIL
+jitter out of measured ping times.  Kernel stamps are wall clock time, so they are shifted onto
+the monotonic clock used for send times before taking differences.
+"""
+
+from __future__ import division, print_function #, unicode_literals
+
+import ctypes
+import ctypes.util
+import os
+import socket
+import struct
+import time
+
+
+CLOCK_MONOTONIC = 1
+
+SO_TIMESTAMPNS = 35
+SO_TIMESTAMPING = 37
+SCM_TIMESTAMPNS = SO_TIMESTAMPNS
+SCM_TIMESTAMPING = SO_TIMESTAMPING
+
+SOF_TIMESTAMPING_RX_SOFTWARE = 1 << 3
+SOF_TIMESTAMPING_SOFTWARE = 1 << 4
+
+CONTROL_SIZE = 128   # room for one SCM_TIMESTAMPING message, three timespecs.
+
+_CMSG_HEADER = struct.Struct('@Lii')     # struct cmsghdr: cmsg_len, cmsg_level, cmsg_type
+_TIMESPEC = struct.Struct('@ll')         # struct timespec: tv_sec, tv_nsec
+_ALIGN = struct.calcsize('@L')           # size_t on Linux
+
+
+#################################################
+
+class timespec(ctypes.Structure):
+    _fields_ = [('tv_sec', ctypes.c_long),
+                ('tv_nsec', ctypes.c_long)]
+
+
+
+def _make_monotonic():
+    """
+    Pick the best available monotonic clock, returning seconds as a float.
+    """
+    if hasattr(time, 'monotonic'):
+        return time.monotonic
+
+    if os.sys.platform == 'win32':
+        return time.clock
+
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        clock_gettime = libc.clock_gettime
+    except (OSError, AttributeError):
+        return time.time
+
+    clock_gettime.argtypes = [ctypes.c_int, ctypes.POINTER(timespec)]
+    ts = timespec()
+
+    def monotonic():
+        clock_gettime(CLOCK_MONOTONIC, ctypes.byref(ts))
+        return ts.tv_sec + ts.tv_nsec * 1e-9
+
+    # Done.
+    return monotonic
+
+
+monotonic = _make_monotonic()
+
+
+
+def realtime_offset():
+    """
+    Wall clock minus monotonic clock, seconds.  Subtract from a kernel timestamp to put it on the
+    monotonic timeline.
+    """
+    return time.time() - monotonic()
+
+#################################################
+
+
+def enable(sock, mode=None):
+    """
+    Ask the kernel to timestamp received packets on this socket.  Returns True if it worked.
+
+    mode: 'ns' for SO_TIMESTAMPNS (default), or 'timestamping' for software receive stamps via
+          SO_TIMESTAMPING.
+    """
+    if not mode:
+        mode = 'ns'
+
+    if not os.sys.platform.startswith('linux'):
+        return False
+
+    try:
+        if mode == 'ns':
+            sock.setsockopt(socket.SOL_SOCKET, SO_TIMESTAMPNS, 1)
+        elif mode == 'timestamping':
+            flags = SOF_TIMESTAMPING_RX_SOFTWARE | SOF_TIMESTAMPING_SOFTWARE
+            sock.setsockopt(socket.SOL_SOCKET, SO_TIMESTAMPING, flags)
+        else:
+            raise ValueError('Unknown timestamp mode: {:s}'.format(mode))
+
+    except socket.error:
+        return False
+
+    # Done.
+    return True
+
+
+
+def parse_control(data):
+    """
+    Find the receive timestamp in a packet's ancillary data.  Returns wall clock seconds as a
+    float, or None if there isn't one.
+    """
+    offset = 0
+    while offset + _CMSG_HEADER.size <= len(data):
+        cmsg_len, cmsg_level, cmsg_type = _CMSG_HEADER.unpack_from(data, offset)
+        if cmsg_len < _CMSG_HEADER.size:
+            break
+
+        if cmsg_level == socket.SOL_SOCKET and cmsg_type in (SCM_TIMESTAMPNS, SCM_TIMESTAMPING):
+            # For SCM_TIMESTAMPING the software stamp is the first of three.
+            tv_sec, tv_nsec = _TIMESPEC.unpack_from(data, offset + _CMSG_HEADER.size)
+            if tv_sec or tv_nsec:
+                return tv_sec + tv_nsec * 1e-9
+
+        offset += (cmsg_len + _ALIGN - 1) & ~(_ALIGN - 1)
+
+    # Done.
+    return None
@@ -0,0 +1,453 @@
+#!/usr/bin/env python
+
+#
+# Copyright 2011 Pierre V. Villeneuve
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+
+"""
+Streaming output of sweep results as JSON Lines, CSV, Parquet or Arrow.
+
+Records are plain dicts, one per probe (probe_record) or one per finished (host, size)
+(cell_record), with the fields in PROBE_FIELDS and CELL_FIELDS.  A writer gathers them into
+batches and hands each full batch to a background thread to be written, so a slow disk never
+holds up the probe loop.  Should the disk fall far enough behind, write() waits for it rather
+than let memory grow.
+
+Parquet and Arrow need pyarrow, which is optional for the rest of ping_sweep.  Each batch becomes
+one Parquet row group or Arrow record batch.  Probe records may also go to a compact binary
+probelog, which is added to rather than overwritten.
+"""
+
+from __future__ import division, print_function #, unicode_literals
+
+import collections
+import csv
+import json
+import os
+import sys
+import threading
+import time
+
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+import probelog
+
+
+# Field names and types: 'int', 'float' or 'str'.  Missing values are None.
+PROBE_FIELDS = (('timestamp', 'float'),    # seconds since the epoch, when the outcome was known.
+                ('host_name', 'str'),
+                ('host_addr', 'str'),
+                ('data_size', 'int'),
+                ('packet_size', 'int'),
+                ('seq', 'int'),
+                ('ttl', 'int'),
+                ('status', 'str'),         # see STATUSES.
+                ('time_ping', 'float'),    # milliseconds, None if lost.
+                ('error', 'str'))
+
+CELL_FIELDS = (('timestamp', 'float'),
+               ('host_name', 'str'),
+               ('data_size', 'int'),
+               ('packet_size', 'int'),
+               ('count_send', 'int'),
+               ('count_recv', 'int'),
+               ('count_timeout', 'int'),
+               ('count_corrupt', 'int'),
+               ('count_error', 'int'),
+               ('count_late', 'int'),
+               ('count_duplicate', 'int'),
+               ('min', 'float'),           # ping times, milliseconds.
+               ('mean', 'float'),
+               ('std', 'float'),
+               ('max', 'float'),
+               ('p50', 'float'),
+               ('p90', 'float'),
+               ('p99', 'float'),
+               ('p99.9', 'float'))
+
+STATUSES = probelog.STATUSES
+
+QUEUE_BATCHES = 8   # batches waiting for the writer thread before write() blocks.
+
+
+#################################################
+
+class WriterError(Exception):
+    pass
+
+
+
+def probe_status(result):
+    """
+    Outcome of one probe from its ping_once() style result, one of STATUSES.  Same rules as
+    accumulator.Tally.add_result().
+    """
+    if result.get('error'):
+        return 'error'
+
+    if result['is_same_data']:
+        return 'ok'
+
+    if result['time_ping']:
+        return 'corrupt'
+
+    # Done.
+    return 'timeout'
+
+
+
+def probe_record(cell, result, timestamp=None):
+    """
+    Record for one probe, from the engine Cell it belongs to and its result.
+
+    timestamp: seconds since the epoch, default now.
+    """
+    if timestamp is None:
+        timestamp = time.time()
+
+    status = probe_status(result)
+    if status == 'ok':
+        time_ping = result['time_ping']
+    else:
+        time_ping = None
+
+    # Done.
+    return {'timestamp': timestamp,
+            'host_name': cell.host_name,
+            'host_addr': cell.host_addr,
+            'data_size': result['data_size'],
+            'packet_size': result['packet_size'],
+            'seq': result['seq'],
+            'ttl': result.get('ttl'),
+            'status': status,
+            'time_ping': time_ping,
+            'error': result.get('error')}
+
+
+
+def cell_record(host_name, data_size, tally, timestamp=None):
+    """
+    Record for one (host, size) from its accumulator.Tally.
+
+    timestamp: seconds since the epoch, default now.
+    """
+    if timestamp is None:
+        timestamp = time.time()
+
+    acc = tally.accumulator
+
+    # Done.
+    return {'timestamp': timestamp,
+            'host_name': host_name,
+            'data_size': data_size,
+            'packet_size': tally.packet_size,
+            'count_send': tally.count_send,
+            'count_recv': tally.count_recv,
+            'count_timeout': tally.count_timeout,
+            'count_corrupt': tally.count_corrupt,
+            'count_error': tally.count_error,
+            'count_late': tally.count_late,
+            'count_duplicate': tally.count_duplicate,
+            'min': acc.min,
+            'mean': acc.mean if acc.count else None,
+            'std': acc.std,
+            'max': acc.max,
+            'p50': acc.percentile(50),
+            'p90': acc.percentile(90),
+            'p99': acc.percentile(99),
+            'p99.9': acc.percentile(99.9)}
+
+#################################################
+
+
+class RecordWriter(object):
+    """
+    Write records to a file in batches from a background thread.  Subclasses do the formatting,
+    and must define:
+
+        _open()                  open self.path, called once from __init__().
+        _write_batch(records)    write a list of records, called from the writer thread.
+        _close()                 finish and close the file, called once from close().
+
+    path: output file, overwritten.
+    fields: sequence of (name, type), such as PROBE_FIELDS.  Other keys in a record are ignored.
+    batch_size: records per batch.
+    """
+    default_batch_size = 1024
+
+    def __init__(self, path, fields, batch_size=None):
+        if not batch_size:
+            batch_size = self.default_batch_size
+
+        self.path = path
+        self.fields = tuple(fields)
+        self.names = [name for name, kind in self.fields]
+        self.batch_size = batch_size
+
+        self.batch = []
+        self.count = 0
+        self.failure = None
+
+        # Opened here, so that a bad path shows up right away rather than in the thread.
+        self._open()
+
+        self.queue = queue.Queue(maxsize=QUEUE_BATCHES)
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+
+    def write(self, record):
+        """
+        Add one record.  It goes out with the rest of its batch.
+        """
+        self.batch.append(record)
+        if len(self.batch) >= self.batch_size:
+            self.flush()
+
+
+
+    def flush(self):
+        """
+        Hand the records so far to the writer thread, even if the batch isn't full.
+        """
+        if self.failure:
+            raise WriterError('Unable to write {:s}: {}'.format(self.path, self.failure))
+
+        if self.batch:
+            self.queue.put(self.batch)
+            self.batch = []
+
+
+
+    def close(self):
+        """
+        Write out everything left and close the file.
+        """
+        if self.thread is None:
+            return
+
+        try:
+            self.flush()
+        finally:
+            self.queue.put(None)
+            self.thread.join()
+            self.thread = None
+            self._close()
+
+        if self.failure:
+            raise WriterError('Unable to write {:s}: {}'.format(self.path, self.failure))
+
+
+
+    def _run(self):
+        """
+        Body of the writer thread.  After a failure, batches are dropped and the error is raised
+        from the next flush() or close().
+        """
+        while True:
+            batch = self.queue.get()
+            if batch is None:
+                return
+
+            if self.failure:
+                continue
+
+            try:
+                self._write_batch(batch)
+                self.count += len(batch)
+            except Exception as e:
+                self.failure = e
+
+
+
+class JsonLinesWriter(RecordWriter):
+    """
+    One JSON object per line, fields in order.
+    """
+    def _open(self):
+        self.fo = open(self.path, 'w')
+
+    def _write_batch(self, records):
+        lines = [json.dumps(collections.OrderedDict((name, record.get(name))
+                                                    for name in self.names)) + '\n'
+                 for record in records]
+        self.fo.write(''.join(lines))
+        self.fo.flush()
+
+    def _close(self):
+        self.fo.close()
+
+
+
+class CsvWriter(RecordWriter):
+    """
+    Comma separated values with a header row.  Missing values are left empty.
+    """
+    def _open(self):
+        if sys.version_info[0] < 3:
+            self.fo = open(self.path, 'wb')
+        else:
+            self.fo = open(self.path, 'w', newline='')
+
+        self.csv = csv.writer(self.fo)
+        self.csv.writerow(self.names)
+
+    def _write_batch(self, records):
+        rows = [[_csv_value(record.get(name)) for name in self.names] for record in records]
+        self.csv.writerows(rows)
+        self.fo.flush()
+
+    def _close(self):
+        self.fo.close()
+
+
+
+def _csv_value(value):
+    if value is None:
+        return ''
+
+    if isinstance(value, float):
+        return repr(value)
+
+    if sys.version_info[0] < 3 and not isinstance(value, (str, int, long)):
+        # Python 2 csv only takes byte strings.
+        return value.encode('utf-8')
+
+    # Done.
+    return value
+
+
+
+class _ColumnarWriter(RecordWriter):
+    """
+    Common part of the pyarrow writers.  Each batch becomes one table written in one go.
+    """
+    default_batch_size = 65536
+
+    def _schema(self):
+        if pyarrow is None:
+            raise WriterError('Writing {:s} needs pyarrow, which is not installed'.format(
+                self.path))
+
+        types = {'int': pyarrow.int64(), 'float': pyarrow.float64(), 'str': pyarrow.string()}
+
+        # Done.
+        return pyarrow.schema([(name, types[kind]) for name, kind in self.fields])
+
+    def _write_batch(self, records):
+        arrays = [pyarrow.array([record.get(name) for record in records], type=field.type)
+                  for name, field in zip(self.names, self.schema)]
+        self.writer.write_table(pyarrow.Table.from_arrays(arrays, schema=self.schema))
+
+    def _close(self):
+        self.writer.close()
+
+
+
+class ParquetWriter(_ColumnarWriter):
+    """
+    Parquet file, one row group per batch.  Needs pyarrow.
+    """
+    def _open(self):
+        self.schema = self._schema()
+        self.writer = pyarrow.parquet.ParquetWriter(self.path, self.schema)
+
+
+
+class ArrowWriter(_ColumnarWriter):
+    """
+    Arrow IPC file, also known as Feather version 2, one record batch per batch.  Needs pyarrow.
+    """
+    def _open(self):
+        self.schema = self._schema()
+        self.writer = pyarrow.ipc.new_file(self.path, self.schema)
+
+
+
+class ProbeLogWriter(RecordWriter):
+    """
+    Binary probelog, for probe records only.  Added to if it already exists.
+    """
+    default_batch_size = 4096
+
+    def _open(self):
+        if self.fields != PROBE_FIELDS:
+            raise WriterError('Only probe records go to a probe log: {:s}'.format(self.path))
+
+        try:
+            self.log = probelog.ProbeLog(self.path)
+        except probelog.ProbeLogError as e:
+            raise WriterError(str(e))
+
+    def _write_batch(self, records):
+        for record in records:
+            self.log.append(record['timestamp'], record['host_name'], record['host_addr'],
+                            record['data_size'], record['seq'], record['time_ping'],
+                            record['status'], ttl=record['ttl'])
+        self.log.flush()
+
+    def _close(self):
+        self.log.close()
+
+#################################################
+
+
+FORMATS = {'.jsonl': JsonLinesWriter,
+           '.ndjson': JsonLinesWriter,
+           '.csv': CsvWriter,
+           '.parquet': ParquetWriter,
+           '.arrow': ArrowWriter,
+           '.feather': ArrowWriter,
+           '.plog': ProbeLogWriter}
+
+
+
+def create_writer(path, fields, batch_size=None):
+    """
+    Writer for a file, its format going by the file name extension: .jsonl, .csv, .parquet,
+    .arrow, or .plog for a probelog.  Raises WriterError for anything else.
+    """
+    ext = os.path.splitext(path)[1].lower()
+    if ext not in FORMATS:
+        raise WriterError('Unknown output format: {:s}, use one of {:s}'.format(
+            path, ', '.join(sorted(FORMATS))))
+
+    try:
+        writer = FORMATS[ext](path, fields, batch_size=batch_size)
+    except (IOError, OSError) as e:
+        raise WriterError('Unable to write {:s}: {}'.format(path, e))
+
+    # Done.
+    return writer
@@ -14,6 +14,10 @@ setup(name='ping_sweep',
 
       entry_points=entry_points,
 
+      # Only needed for the analysis module, and for Parquet or Arrow output.
+      extras_require={'analysis': ['numpy'],
+                      'columnar': ['pyarrow']},
+
       # Metadata
       version=version,
       license='FreeBSD',